@@ -1,11 +1,68 @@
-import json
 import math
+import os
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timezone
 
+from chassis_facts import chassis_facts
+
+# Seconds a fetched /chassis, /cards, /ports or /perfcounters response is reused
+# by the other consumers polling the same chassis
+SNAPSHOT_TTL = int(os.environ.get("IIE_SNAPSHOT_TTL", "10"))
+
+_snapshots = {}
+# Fetch in progress of every (chassis, resource), concurrent callers wait for it instead of fetching again
+_snapshot_fetches = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(session, resource):
+    """Method to get the data of a chassis REST resource (chassis, cards, ports, perfcounters),
+    fetched at most once per SNAPSHOT_TTL for every chassis.
+    The returned data is shared, callers must not modify it"""
+    key = (session.chassis_ip, resource)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached and time.time() - cached[0] < SNAPSHOT_TTL:
+            return cached[1]
+        fetch = _snapshot_fetches.get(key)
+        if fetch is None:
+            fetch = _snapshot_fetches[key] = Future()
+            fetching = True
+        else:
+            fetching = False
+    if not fetching:
+        # Raises the error of the fetch too, e.g. the chassis is unreachable
+        return fetch.result()
+    try:
+        data = getattr(session, "get_" + resource)().data
+    except Exception as e:
+        with _snapshots_lock:
+            del _snapshot_fetches[key]
+        fetch.set_exception(e)
+        raise
+    with _snapshots_lock:
+        _snapshots[key] = (time.time(), data)
+        del _snapshot_fetches[key]
+    fetch.set_result(data)
+    return data
+
+def clear_snapshots():
+    """Method to forget every cached chassis REST resource"""
+    with _snapshots_lock:
+        _snapshots.clear()
+
+def forget_snapshots(chassis_ip):
+    """Method to forget the cached REST resources of a chassis, e.g. when it is removed"""
+    with _snapshots_lock:
+        for key in [key for key in _snapshots if key[0] == chassis_ip]:
+            del _snapshots[key]
+
 def get_chassis_os(session):
     """Method to get Chassis Type based on IP from Chassis DB"""
     try:
-        port_list = session.get_ports().data
+        port_list = get_snapshot(session, "ports")
         #linkState field is only in Linux Based Chassis
         if 'linkState' in  port_list[0]:
             return "Linux"
@@ -29,7 +86,7 @@ def get_perf_metrics(session, chassisIp):
     # Exception Handling for Windows Chassis
     perf = {}
     try:
-        perf = session.get_perfcounters().data[0]
+        perf = get_snapshot(session, "perfcounters")[0]
     except Exception:
         pass
     
@@ -58,12 +115,13 @@ def get_chassis_information(session):
     mem_bytes = "NA"
     mem_bytes_total = "NA"
     cpu_pert_usage =  "NA"
-    os = get_chassis_os(session)
-    
-    chassisInfo = session.get_chassis()
+    chassis_data = get_snapshot(session, "chassis")[0]
+    ixos_version = next((item["version"] for item in chassis_data.get("ixosApplications", []) if item["name"] == "IxOS"), None)
+    chassis_facts.check_identity(session.chassis_ip, chassis_data.get("serialNumber"), ixos_version)
+    os = chassis_facts.get(session.chassis_ip, "os", lambda: get_chassis_os(session))
     try:
         # Exception Handling for Windows Chassis
-        perf = session.get_perfcounters().data[0]
+        perf = get_snapshot(session, "perfcounters")[0]
         mem_bytes = convert_size(perf["memoryInUseBytes"])
         mem_bytes_total = convert_size(perf["memoryTotalBytes"])
         cpu_pert_usage = perf["cpuUsagePercent"]
@@ -71,7 +129,6 @@ def get_chassis_information(session):
        pass
         
     
-    chassis_data = json.loads(json.dumps(chassisInfo.data[0]))
     last_update_at = datetime.now(timezone.utc).strftime("%m/%d/%Y, %H:%M:%S")
     
     if chassis_data["type"] == "Ixia_Virtual_Test_Appliance":
@@ -101,7 +158,7 @@ def get_chassis_information(session):
     
 def get_chassis_cards_information(session, ip, type_of_chassis):
     """Method to get chassis card information from Ixia Chassis using RestPy"""
-    card_list= session.get_cards().data
+    card_list= get_snapshot(session, "cards")
     final_card_details_list= []
     last_update_at = datetime.now(timezone.utc).strftime("%m/%d/%Y, %H:%M:%S")
     # Cards on Chassis
@@ -128,25 +185,16 @@ def get_chassis_ports_information(session, chassisIp, chassisType):
     used_ports = 0
     
     last_update_at = datetime.now(timezone.utc).strftime("%m/%d/%Y, %H:%M:%S")
-    port_list = session.get_ports().data
+    port_list = get_snapshot(session, "ports")
     
     keys_to_keep = ['owner', 'transceiverModel', 'transceiverManufacturer', 'cardNumber', 'portNumber', 'phyMode', 'linkState', 'speed', 'type', 'transmitState']
 
-    if port_list:
-        a = list(port_list[0].keys())
-    else:
-        a = []
-    keys_to_remove = [x for x in a if x not in keys_to_keep]
-    # Removing the extra keys from port details json response
-    for port_data in port_list:
+    # Copying only the needed keys, the snapshot port list is shared with other consumers
+    for port in port_list:
+        port_data = {k: v for k, v in port.items() if k in keys_to_keep}
         if not port_data.get("owner"):
             port_data["owner"] = "Free"
-            
-        for k in keys_to_remove:
-            port_data.pop(k)
-    
-    for port in port_list:
-        port_data_list.append(port)
+        port_data_list.append(port_data)
     
     # Lets get used ports, free ports and total ports
     if port_data_list:
@@ -169,7 +217,7 @@ def get_chassis_ports_information(session, chassisIp, chassisType):
         
 def get_license_activation(session, ip, type_chassis):
     """Method to get license information from Ixia Chassis using RestPy"""
-    host_id = session.get_license_server_host_id()
+    host_id = chassis_facts.get(session.chassis_ip, "hostId", session.get_license_server_host_id)
     license_info = session.get_license_activation().json()
     last_update_at = datetime.now(timezone.utc).strftime("%m/%d/%Y, %H:%M:%S")
     license_info_list= []
@@ -197,4 +245,67 @@ def get_sensor_information(session, chassis, type_chassis):
         for item in keys_to_remove:
             record.pop(item, "NA")
         record.update({"chassisIp":chassis, "typeOfChassis": type_chassis, "lastUpdatedAt_UTC": datetime.now(timezone.utc).strftime("%m/%d/%Y, %H:%M:%S")})
-    return sensor_list
\ No newline at end of file
+    return sensor_list
+
+
+# Port counters stored by the portstats category and the portstats fields they are read from
+PORT_STATS_FIELDS = {"txFrames": ("framesSent", "txFrames"),
+                     "rxFrames": ("framesReceived", "validFramesReceived", "rxFrames"),
+                     "txBytes": ("bytesSent", "txBytes"),
+                     "rxBytes": ("bytesReceived", "rxBytes"),
+                     "fcsErrors": ("fcsErrors", "crcErrors")}
+
+
+def get_port_statistics(session, chassisIp):
+    """Method to get the traffic and error counters of every port from Ixia Chassis"""
+    stats = session.get_portstats().data or []
+    sampled_at = int(datetime.now(timezone.utc).timestamp())
+    ports_by_id = None
+    samples = []
+    for stat in stats:
+        card_number, port_number = stat.get("cardNumber"), stat.get("portNumber")
+        if card_number is None or port_number is None:
+            # Stats that only reference their port resource
+            if ports_by_id is None:
+                ports_by_id = {port.get("id"): port for port in get_snapshot(session, "ports")}
+            port = ports_by_id.get(stat.get("portId", stat.get("id")))
+            if port is None:
+                continue
+            card_number, port_number = port["cardNumber"], port["portNumber"]
+        sample = {"chassisIp": chassisIp, "ts": sampled_at,
+                  "cardNumber": int(card_number), "portNumber": int(port_number)}
+        for counter, fields in PORT_STATS_FIELDS.items():
+            value = next((stat[field] for field in fields if stat.get(field) is not None), None)
+            sample[counter] = int(value) if value is not None else None
+        samples.append(sample)
+    return samples
+
+def take_ports_ownership(session, chassisIp, ports):
+    """Method to take ownership of ports of an Ixia Chassis, all of them or none.
+    Ports already owned on the chassis are refused, ports taken before a failure are released"""
+    ports_by_number = {(int(port["cardNumber"]), int(port["portNumber"])): port for port in session.get_ports().data}
+    chassis_ports = []
+    for port in ports:
+        chassis_port = ports_by_number.get((int(port["cardNumber"]), int(port["portNumber"])))
+        if chassis_port is None:
+            raise Exception(f"Port {port['cardNumber']}/{port['portNumber']} not found on {chassisIp}")
+        if chassis_port.get("owner"):
+            raise Exception(f"Port {port['cardNumber']}/{port['portNumber']} of {chassisIp} is owned by {chassis_port['owner']}")
+        chassis_ports.append(chassis_port)
+    taken = []
+    try:
+        for chassis_port in chassis_ports:
+            session.take_ownership(chassis_port["id"])
+            taken.append(chassis_port)
+    except Exception:
+        release_ports_ownership(session, taken)
+        raise
+    return taken
+
+def release_ports_ownership(session, chassis_ports):
+    """Method to release ports taken by take_ports_ownership, best effort"""
+    for chassis_port in chassis_ports:
+        try:
+            session.release_ownership(chassis_port["id"])
+        except Exception as e:
+            print(f"Failed to release port {chassis_port.get('cardNumber')}/{chassis_port.get('portNumber')}: {e}")
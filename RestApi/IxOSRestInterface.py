@@ -8,7 +8,11 @@ import sys
 import os
 import json
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import HTTP_REQUEST_SECONDS, HTTP_REQUEST_ERRORS, endpoint_of
 
 # handle urllib3 differences between python versions
 if sys.version_info[0] == 2 and ((sys.version_info[1] == 7 and sys.version_info[2] < 9) or sys.version_info[1] < 7):
@@ -16,6 +20,57 @@ if sys.version_info[0] == 2 and ((sys.version_info[1] == 7 and sys.version_info[
 else:
     import urllib3
 
+# Default number of keep-alive connections kept open towards each chassis
+DEFAULT_POOL_SIZE = int(os.environ.get("IIE_HTTP_POOL_SIZE", "10"))
+
+# One requests.Session (and therefore one urllib3 connection pool) per chassis,
+# shared by every IxRestSession created for that chassis in this process, with its pool size
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def _mount_pool(http_session, pool_size):
+    """mount a pool of pool_size connections on http_session and close the pools it replaces"""
+    replaced = {http_session.adapters.get(prefix) for prefix in ('https://', 'http://')} - {None}
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    # Idle connections are closed now, the ones of requests in flight when they are returned
+    for previous_adapter in replaced:
+        previous_adapter.close()
+
+
+def get_http_session(chassis_address, pool_size=None):
+    """
+    return the long-lived requests.Session used to talk to chassis_address,
+    creating it on first use. The pool grows when a caller asks for more
+    connections than it holds, it never shrinks.
+    """
+    pool_size = pool_size or DEFAULT_POOL_SIZE
+    with _http_sessions_lock:
+        http_session, current_size = _http_sessions.get(chassis_address, (None, 0))
+        if http_session is None:
+            http_session = requests.Session()
+            http_session.verify = False
+        if pool_size > current_size:
+            _mount_pool(http_session, pool_size)
+            _http_sessions[chassis_address] = (http_session, pool_size)
+        return http_session
+
+
+def close_http_sessions(chassis_address=None):
+    """
+    close the pooled connections to chassis_address, e.g. when it is removed,
+    or to every chassis when no address is given, e.g. on poller shutdown
+    """
+    with _http_sessions_lock:
+        addresses = list(_http_sessions) if chassis_address is None else [chassis_address]
+        for address in addresses:
+            http_session, _ = _http_sessions.pop(address, (None, 0))
+            if http_session is not None:
+                http_session.close()
+
+
 class IxRestException(Exception):
     pass
 
@@ -32,10 +87,12 @@ class IxRestSession(object):
         timeout:        Time to wait (in seconds) while polling \
                         for async operation.
         poll_interval:  Polling inteval in seconds.
+        pool_size:      Number of keep-alive connections kept open \
+                        towards the chassis (default IIE_HTTP_POOL_SIZE).
     """
 
     def __init__(self, chassis_address, username=None, password=None, api_key=None,timeout=1200, 
-                 poll_interval=2, verbose=False, insecure_request_warning=False):
+                 poll_interval=2, verbose=False, insecure_request_warning=False, pool_size=None):
 
         self.chassis_ip = chassis_address
         self.api_key = api_key
@@ -45,6 +102,8 @@ class IxRestSession(object):
         self._authUri = '/platform/api/v1/auth/session'
         self.username = username
         self.password = password
+        self.http_session = get_http_session(chassis_address, pool_size)
+        self._auth_lock = threading.Lock()
 
         # ignore self sign certificate warning(s) if insecure_request_warning=False
         if not insecure_request_warning:
@@ -89,9 +148,18 @@ class IxRestSession(object):
         )
         self.api_key = response.data['apiKey']
 
-    def http_request(self, method, uri, payload=None, params=None):
+    def reauthenticate(self, rejected_api_key):
+        """
+        obtain a new API key after the chassis rejected rejected_api_key.
+        Concurrent callers that hit the same 401 only authenticate once.
+        """
+        with self._auth_lock:
+            if self.api_key == rejected_api_key:
+                self.authenticate(username=self.username, password=self.password)
+
+    def http_request(self, method, uri, payload=None, params=None, retry_on_unauthorized=True):
         """
-        wrapper over requests.requests to pretty-print debug info
+        wrapper over the pooled requests.Session to pretty-print debug info
         and invoke async operation polling depending on HTTP status code (e.g. 202)
         """
         try:
@@ -99,14 +167,27 @@ class IxRestSession(object):
             if not uri.startswith('http'):
                 uri = self.get_ixos_uri() + uri
 
+            body = None
             if payload is not None:
-                payload = json.dumps(payload, indent=2, sort_keys=True)
+                body = json.dumps(payload, indent=2, sort_keys=True)
 
             headers = self.get_headers()
-            response = requests.request(
-                method, uri, data=payload, params=params,
-                headers=headers, verify=False, timeout=10
-            )
+            endpoint = endpoint_of(uri)
+            try:
+                with HTTP_REQUEST_SECONDS.time(chassis=self.chassis_ip, method=method, endpoint=endpoint):
+                    response = self.http_session.request(
+                        method, uri, data=body, params=params,
+                        headers=headers, verify=False, timeout=10
+                    )
+            except requests.exceptions.Timeout:
+                HTTP_REQUEST_ERRORS.inc(chassis=self.chassis_ip, endpoint=endpoint, reason="timeout")
+                raise
+            except requests.exceptions.ConnectionError:
+                HTTP_REQUEST_ERRORS.inc(chassis=self.chassis_ip, endpoint=endpoint, reason="connection")
+                raise
+            if response.status_code >= 400:
+                HTTP_REQUEST_ERRORS.inc(chassis=self.chassis_ip, endpoint=endpoint,
+                                        reason=f"{str(response.status_code)[0]}xx")
 
             # debug_string = 'Response => Status %d\n' % response.status_code
             data = None
@@ -117,6 +198,13 @@ class IxRestSession(object):
                 print('Invalid/Non-JSON payload received: %s' % data)
                 data = None
 
+            # API key expired or was revoked, get a new one and replay the request once
+            if response.status_code == 401 and retry_on_unauthorized and self.username is not None \
+                    and uri[-len(self._authUri):] != self._authUri:
+                self.reauthenticate(headers['x-api-key'])
+                return self.http_request(method, uri, payload=payload, params=params,
+                                         retry_on_unauthorized=False)
+
             if str(response.status_code)[0] == '4':
                 raise IxRestException("{code} {reason}: {data}.{extraInfo}".format(
                     code=response.status_code,
@@ -253,7 +341,39 @@ class IxRestSession(object):
         card_id = chassis_info["id"]
         resultUrl = self.http_request('POST', self.get_ixos_uri() + f"/chassis/{card_id}/operations/collectlogs", params=" ")
         return resultUrl     
-     
+
+
+# Authenticated sessions keyed by chassis address and credentials, so every poll
+# category reuses the same API key instead of POSTing to the auth endpoint each cycle
+_cached_sessions = {}
+_cached_sessions_lock = threading.Lock()
+
+
+def get_cached_session(chassis_address, username=None, password=None, **kwargs):
+    """
+    return an authenticated IxRestSession for chassis_address, authenticating
+    only the first time the chassis is seen. Expired API keys are renewed
+    transparently by IxRestSession.http_request when a 401 comes back.
+    """
+    key = (chassis_address, username, password)
+    with _cached_sessions_lock:
+        session = _cached_sessions.get(key)
+    if session is None:
+        session = IxRestSession(chassis_address, username, password, **kwargs)
+        with _cached_sessions_lock:
+            session = _cached_sessions.setdefault(key, session)
+    return session
+
+
+def invalidate_cached_session(chassis_address):
+    """
+    forget every cached session of chassis_address, e.g. when it is removed
+    or its credentials change
+    """
+    with _cached_sessions_lock:
+        for key in [k for k in _cached_sessions if k[0] == chassis_address]:
+            del _cached_sessions[key]
+
 
 if __name__ == '__main__':
     print('''
@@ -1,4 +1,8 @@
-from flask import Flask
+import time
+
+from flask import Flask, g, request
+
+from metrics import WEB_REQUEST_SECONDS
 
 def create_app():
     """Initialize the flask app instance
@@ -6,4 +10,18 @@ def create_app():
     app = Flask(__name__)
     app.jinja_env.auto_reload = True
     app.config['TEMPLATES_AUTO_RELOAD'] = True
-    return app
\ No newline at end of file
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_latency(response):
+        """Latency per route pattern, e.g. /perfMetrics/<ip>, not per url"""
+        if "request_started" in g:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            WEB_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started,
+                                        route=route, method=request.method, status=response.status_code)
+        return response
+
+    return app
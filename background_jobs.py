@@ -0,0 +1,121 @@
+"""Background jobs for work started from the web UI.
+
+Requests that used to run a fleet poll or wait on an IxOS async operation
+inside the Flask request thread now submit a job and get its id back right
+away. Jobs run on a bounded worker pool and their state is written to the
+background_jobs table, so status_of answers from any web worker and after a
+restart. Submitting a job whose key matches a queued or running job returns
+that job instead of starting a second one, so concurrent clicks coalesce.
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite3_utilities import write_job_to_database, read_job_from_database, delete_finished_jobs_from_database
+
+MAX_JOB_WORKERS = int(os.environ.get("IIE_JOB_WORKERS", "4"))
+# Long running IxOS operations (e.g. log collection) get their own pool so they never delay refreshes
+MAX_OPERATION_WORKERS = int(os.environ.get("IIE_OPERATION_WORKERS", "8"))
+# How long finished jobs stay queryable, in seconds
+JOB_RETENTION = int(os.environ.get("IIE_JOB_RETENTION", "3600"))
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+DONE = "DONE"
+FAILED = "FAILED"
+
+
+class JobQueue(object):
+    """Bounded worker pool with coalescing on job keys and persisted job state"""
+
+    def __init__(self, workers=MAX_JOB_WORKERS, retention=JOB_RETENTION):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+
+    def submit(self, key, kind, method, *args, coalesce_with=(), **details):
+        """Run method(*args) in the background and return the job state.
+        If a job is already active under key, or under one of coalesce_with,
+        that job is returned and nothing new is started.
+        """
+        with self._lock:
+            for active_key in (key,) + tuple(coalesce_with):
+                job_id = self._active.get(active_key)
+                if job_id is not None:
+                    job = dict(self._jobs[job_id])
+                    job["coalesced"] = True
+                    return job
+            self._prune()
+            job_id = uuid.uuid4().hex
+            job = {"id": job_id,
+                   "kind": kind,
+                   "status": QUEUED,
+                   "submittedAt": time.time(),
+                   "startedAt": None,
+                   "finishedAt": None,
+                   "result": None,
+                   "error": None}
+            job.update(details)
+            self._jobs[job_id] = job
+            self._active[key] = job_id
+            self._save(job)
+            self.executor.submit(self._run, job_id, key, method, args)
+            return dict(job)
+
+    def _run(self, job_id, key, method, args):
+        """Worker pool entry point, records the outcome of the job"""
+        self._update(job_id, status=RUNNING, startedAt=time.time())
+        try:
+            result = method(*args)
+            self._update(job_id, status=DONE, result=result, finishedAt=time.time())
+        except Exception as e:
+            print(f"Background job {job_id} failed: {e}")
+            self._update(job_id, status=FAILED, error=str(e), finishedAt=time.time())
+        finally:
+            with self._lock:
+                if self._active.get(key) == job_id:
+                    del self._active[key]
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            self._jobs[job_id].update(changes)
+            job = dict(self._jobs[job_id])
+        self._save(job)
+
+    @staticmethod
+    def _save(job):
+        """Persist the job state, a database error never fails the job itself"""
+        try:
+            write_job_to_database(job)
+        except Exception as e:
+            print(f"Failed to save background job {job['id']}: {e}")
+
+    def _prune(self):
+        """Forget finished jobs older than retention, caller holds the lock"""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["finishedAt"] is not None and job["finishedAt"] < cutoff]:
+            del self._jobs[job_id]
+        try:
+            delete_finished_jobs_from_database(cutoff)
+        except Exception as e:
+            print(f"Failed to prune background jobs: {e}")
+
+    def status_of(self, job_id):
+        """Copy of the job state, None for unknown or expired job ids.
+        Jobs started by another web worker or before a restart are read from the database.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return read_job_from_database(job_id)
+
+
+job_queue = JobQueue()
+operation_queue = JobQueue(workers=MAX_OPERATION_WORKERS)
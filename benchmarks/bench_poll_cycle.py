@@ -0,0 +1,60 @@
+"""End to end poll cycle benchmark against the local IxOS REST simulator.
+
+Starts benchmarks/ixos_simulator.py in process with the requested fleet,
+loads its chassis list into a scratch inventory.db and times the fleet wide
+poll of every category, REST calls and database writes included.
+
+    python3 benchmarks/bench_poll_cycle.py --chassis 1000 --latency 0.05 --workers 32
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ixos_simulator import fleet_options, fleet_from_options, start_simulator, chassis_address
+
+
+@click.command()
+@fleet_options
+@click.option('--categories', default="chassis,cards,ports,sensors,perf,licensing", help='Comma separated categories to poll')
+@click.option('--workers', default=16, help='Chassis polled concurrently by one category')
+@click.option('--cycles', default=2, help='Poll cycles to run, the first one also authenticates every chassis')
+def run_benchmark(port, categories, workers, cycles, **fleet_config):
+    """Print the duration of every category poll of every cycle"""
+    os.chdir(tempfile.mkdtemp())
+    import init_db  # creates inventory.db in the current directory
+    import data_poller
+    from IxOSRestAPICaller import clear_snapshots
+    from sqlite3_utilities import write_username_password_to_database, read_data_from_database
+
+    fleet = fleet_from_options(**fleet_config)
+    server = start_simulator(fleet, port=port)
+    write_username_password_to_database("\n".join(f"ADD,{chassis_address(index, port)},admin,admin"
+                                                  for index in range(fleet.chassis)))
+    data_poller.set_max_poll_workers(workers)
+
+    print(f"{fleet.chassis} chassis, {fleet.cards * fleet.ports_per_card} ports each, {workers} workers")
+    for cycle in range(1, cycles + 1):
+        # Cycles run back to back, start each one like a poll interval later with no cached resource
+        clear_snapshots()
+        cycle_start = time.perf_counter()
+        for category in categories.split(","):
+            requests_before = server.simulator_state.requests
+            start = time.perf_counter()
+            data_poller.categoryToFuntionMap[category]()
+            seconds = time.perf_counter() - start
+            served = server.simulator_state.requests - requests_before
+            print(f"cycle {cycle} {category:<10} {seconds:8.2f} s {fleet.chassis / seconds:10.1f} chassis/s {served:8d} requests")
+        print(f"cycle {cycle} total      {time.perf_counter() - cycle_start:8.2f} s")
+
+    rows = len(read_data_from_database("chassis_port_details"))
+    print(f"{rows} port rows in inventory.db")
+    server.shutdown()
+
+if __name__ == '__main__':
+    run_benchmark()
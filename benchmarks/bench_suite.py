@@ -0,0 +1,153 @@
+"""Repeatable benchmark of the database and web paths on synthetic fleets.
+
+For every fleet size a scratch inventory.db is filled with benchmarks/synthetic_fleet.py
+records, then write_data_to_database (first write and unchanged rewrite) of every
+table, read_data_from_database, read_tags/write_tags and every Flask view of myapp.py
+are timed. Results are written as JSON so runs of two versions can be compared, under
+IIE_BENCH_RESULTS_DIR (the iie-benchmarks directory of the system temp directory by default)
+unless --output is given.
+
+    python3 benchmarks/bench_suite.py --sizes 10,1000,10000
+    python3 benchmarks/bench_suite.py --sizes 10,1000 --compare /tmp/iie-benchmarks/<previous run>.json
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_fleet import generate_fleet, fleet_chassis_ips, row_count
+
+RESULTS_DIR = os.environ.get("IIE_BENCH_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "iie-benchmarks"))
+
+
+def time_call(method, repeat):
+    """min and median seconds of repeat calls of method"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        method()
+        samples.append(time.perf_counter() - start)
+    return {"min": min(samples), "median": statistics.median(samples), "repeat": repeat}
+
+
+def run_fleet_size(chassis, cards, ports_per_card, repeat):
+    """Timings of one fleet size, run in a fresh process with its own scratch inventory.db"""
+    os.chdir(tempfile.mkdtemp())
+    import init_db  # creates inventory.db in the current directory
+    from sqlite3_utilities import write_data_to_database, read_data_from_database, read_tags, write_tags, \
+        write_username_password_to_database
+
+    fleet = generate_fleet(chassis, cards=cards, ports_per_card=ports_per_card)
+    ips = fleet_chassis_ips(chassis)
+    results = {}
+
+    for table_name, records in fleet.items():
+        rows = row_count(records)
+        write = lambda: write_data_to_database(table_name=table_name, records=records, ip_tags_dict={})
+        results[f"write.{table_name}.initial"] = dict(time_call(write, 1), rows=rows)
+        if table_name != "chassis_utilization_details":
+            # Time series rows are appended on every write, rewriting them would only grow the table
+            results[f"write.{table_name}.unchanged"] = dict(time_call(write, repeat), rows=rows)
+        results[f"read.{table_name}"] = dict(time_call(lambda: read_data_from_database(table_name), repeat), rows=rows)
+
+    tagged = ips[:100]
+    results["tags.write_tags.chassis"] = dict(time_call(lambda: [write_tags(ip, "bench", "chassis", "add") for ip in tagged], 1),
+                                              calls=len(tagged))
+    results["tags.read_tags.chassis"] = time_call(lambda: read_tags("chassis"), repeat)
+    results["tags.read_tags.card"] = time_call(lambda: read_tags("card"), repeat)
+
+    write_username_password_to_database("\n".join(f"ADD,{ip},admin,admin" for ip in ips))
+    import myapp
+    client = myapp.app.test_client()
+    views = ["/chassisDetails", "/cardDetails", "/portDetails", "/licenseDetails", "/sensorInformation",
+             f"/lineChartPerfMetrics/{ips[0]}", f"/perfMetrics/{ips[0]}", "/uploadConfig", "/capacityReport",
+             "/fleetSummary", "/search?q=SYN0000001*", "/search?q=user7/session",
+             "/freePorts?count=4&speed=100G", "/freePorts?count=200&speed=10G&phyMode=COPPER"]
+    for page in ("cardDetails", "portDetails", "licenseDetails", "sensorInformation"):
+        views += [f"/tableData/{page}?start=0&length=50",
+                  f"/tableData/{page}?start=0&length=50&search[value]=10.0.1",
+                  f"/tableData/{page}?start=0&length=50&order[0][column]=1&order[0][dir]=desc"]
+
+    def render(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}")
+
+    for url in views:
+        results[f"view.{url}"] = time_call(lambda: render(url), repeat)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_comparison(current, previous):
+    """Median of every timing next to the one of a previous run"""
+    for size, timings in current["results"].items():
+        previous_timings = previous["results"].get(size, {})
+        width = max(len(name) for name in timings)
+        print(f"\n{size + ' chassis':<{width}} {'now':>10} {'before':>10} {'ratio':>7}")
+        for name, timing in timings.items():
+            before = previous_timings.get(name)
+            if before:
+                print(f"{name:<{width}} {timing['median']:10.4f} {before['median']:10.4f} {timing['median'] / before['median']:7.2f}")
+            else:
+                print(f"{name:<{width}} {timing['median']:10.4f} {'-':>10}")
+
+
+@click.command()
+@click.option('--sizes', default="10,1000,10000", help='Comma separated fleet sizes, in chassis')
+@click.option('--cards', default=4, help='Cards per chassis')
+@click.option('--ports-per-card', default=16, help='Ports per card')
+@click.option('--repeat', default=3, help='Runs of every timing, min and median are kept')
+@click.option('--output', default=None, help='JSON results file, <IIE_BENCH_RESULTS_DIR>/<time>-<revision>.json by default')
+@click.option('--compare', default=None, help='JSON results of a previous run to compare with')
+def run_benchmark(sizes, cards, ports_per_card, repeat, output, compare):
+    """Time the database and web paths for every fleet size and save the results"""
+    revision = git_revision()
+    report = {"meta": {"revision": revision,
+                       "startedAt": datetime.now(timezone.utc).isoformat(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "cards": cards,
+                       "portsPerCard": ports_per_card,
+                       "repeat": repeat},
+              "results": {}}
+
+    # A process per size, sqlite3_utilities keeps its connections to the first inventory.db it opened
+    context = multiprocessing.get_context("spawn")
+    for size in [int(size) for size in sizes.split(",")]:
+        with context.Pool(1) as pool:
+            report["results"][str(size)] = pool.apply(run_fleet_size, (size, cards, ports_per_card, repeat))
+        print(f"{size} chassis done")
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{revision or 'unknown'}.json")
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {output}")
+
+    if compare:
+        with open(compare) as compare_file:
+            print_comparison(report, json.load(compare_file))
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,81 @@
+"""Benchmark of the sqlite3_utilities write path on a synthetic port fleet.
+
+Runs write_data_to_database for chassis_port_details in a scratch inventory.db:
+a first write into an empty table, a rewrite where nothing changed and a
+rewrite where a share of the ports changed owner. Prints rows/second for each.
+
+    python3 benchmarks/bench_write_path.py --ports 100000
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def generate_port_fleet(total_ports, cards_per_chassis=10, ports_per_card=40):
+    """Synthetic poll result of chassis_port_details, one list of ports per chassis"""
+    ports_per_chassis = cards_per_chassis * ports_per_card
+    fleet = []
+    for chassis_index in range(max(1, total_ports // ports_per_chassis)):
+        chassis_ip = f"10.{chassis_index // 65536}.{(chassis_index // 256) % 256}.{chassis_index % 256}"
+        ports = []
+        for card in range(1, cards_per_chassis + 1):
+            for port in range(1, ports_per_card + 1):
+                ports.append({"chassisIp": chassis_ip,
+                              "typeOfChassis": "Ixia_XGS12",
+                              "cardNumber": card,
+                              "portNumber": port,
+                              "linkState": "UP",
+                              "phyMode": "FIBER",
+                              "transceiverModel": "QSFP28-100G-SR4 O'Brien",
+                              "transceiverManufacturer": "Keysight",
+                              "owner": "Free",
+                              "speed": "100000",
+                              "type": "NOVUS100GE8Q28",
+                              "totalPorts": ports_per_chassis,
+                              "ownedPorts": 0,
+                              "freePorts": ports_per_chassis,
+                              "transmitState": "IDLE"})
+        fleet.append(ports)
+    return fleet
+
+
+def time_write(fleet):
+    """Seconds taken by one write_data_to_database of fleet"""
+    from sqlite3_utilities import write_data_to_database
+    start = time.perf_counter()
+    write_data_to_database(table_name="chassis_port_details", records=fleet)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option('--ports', default=100000, help='Number of ports in the synthetic fleet')
+@click.option('--changed', default=0.1, help='Share of ports that change owner in the last write')
+def run_benchmark(ports, changed):
+    """Print rows/second of the port table write path"""
+    os.chdir(tempfile.mkdtemp())
+    import init_db  # creates inventory.db in the current directory
+
+    fleet = generate_port_fleet(ports)
+    rows = sum(len(chassis_ports) for chassis_ports in fleet)
+
+    results = [("initial write", time_write(fleet)),
+               ("unchanged rewrite", time_write(fleet))]
+    every = max(1, int(1 / changed)) if changed else 0
+    for chassis_ports in fleet:
+        for index, port in enumerate(chassis_ports):
+            if every and index % every == 0:
+                port["owner"] = "benchmark"
+    results.append((f"rewrite, {changed:.0%} changed", time_write(fleet)))
+
+    print(f"{rows} port rows")
+    for name, seconds in results:
+        print(f"{name:<24} {seconds:8.2f} s {rows / seconds:12.0f} rows/s")
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,358 @@
+"""Local stand-in for the IxOS REST API of a whole chassis fleet.
+
+One HTTPS server answers for every simulated chassis. Chassis are addressed
+as 127.x.y.z:<port>; the whole 127.0.0.0/8 range reaches the loopback
+interface, so thousands of distinct chassis addresses need no setup and the
+Host header tells which chassis a request is for. Every chassis gets
+deterministic cards, ports, licenses, sensors and port counters, and serves
+the endpoints IxRestSession uses, including the 202 async flows of licensing
+and collectlogs. Latency, error rate and unreachable chassis are configurable.
+
+    python3 benchmarks/ixos_simulator.py --chassis 1000 --port 8443 --latency 0.05
+
+prints the chassis list to paste into /uploadConfig and serves until stopped.
+"""
+
+import itertools
+import json
+import os
+import random
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+AUTH_URI = "/platform/api/v1/auth/session"
+IXOS_URI = "/chassis/api/v2/ixos"
+LICENSING_URI = "/platform/api/v2/licensing/servers"
+
+CARD_TYPES = ["NOVUS100GE8Q28", "NOVUS10/1GE32S", "AresONE-400GE-8P", "K400-QDD-8"]
+TRANSCEIVERS = [("QSFP28-100G-SR4", "Keysight"), ("QSFP-DD-400G-DR4", "Finisar"), ("SFP+-10G-LR", "Avago")]
+LICENSE_PARTS = ["930-2171", "930-2173", "940-0006", "930-2100"]
+
+
+def chassis_address(index, port):
+    """Address of the index-th simulated chassis, unique inside 127.0.0.0/8"""
+    host = index + 2
+    return f"127.{(host >> 16) & 255}.{(host >> 8) & 255}.{host & 255}:{port}"
+
+
+class SimulatedFleet(object):
+    """Configuration and deterministic inventory of the simulated chassis"""
+
+    def __init__(self, chassis=10, cards=4, ports_per_card=16, licenses=8, sensors=12, owned_share=0.3,
+                 latency=0.0, jitter=0.0, error_rate=0.0, unreachable_share=0.0, async_steps=1, key_ttl=0, seed=0):
+        self.chassis = chassis
+        self.cards = cards
+        self.ports_per_card = ports_per_card
+        self.licenses = licenses
+        self.sensors = sensors
+        self.owned_share = owned_share
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.unreachable_share = unreachable_share
+        self.async_steps = async_steps
+        self.key_ttl = key_ttl
+        self.seed = seed
+        self.started_at = time.time()
+        self._inventory = {}
+        self._lock = threading.Lock()
+
+    def _random(self, address, salt=""):
+        return random.Random(f"{self.seed}/{address}/{salt}")
+
+    def is_unreachable(self, address):
+        return self._random(address, "unreachable").random() < self.unreachable_share
+
+    def inventory(self, address):
+        """Static chassis, cards, ports, licenses and sensors of address, built on first use"""
+        with self._lock:
+            inventory = self._inventory.get(address)
+        if inventory is not None:
+            return inventory
+        rnd = self._random(address)
+        serial = f"SIM{rnd.randrange(10 ** 6):06d}"
+        chassis = {"id": 1,
+                   "managementIp": address,
+                   "serialNumber": serial,
+                   "controllerSerialNumber": f"CTL{rnd.randrange(10 ** 6):06d}",
+                   "type": rnd.choice(["Ixia XGS12", "Ixia XGS2", "Ixia Novus One"]),
+                   "numberOfPhysicalCards": self.cards,
+                   "state": "UP",
+                   "ixosApplications": [{"name": "IxOS", "version": "9.30.3001.12"},
+                                        {"name": "IxNetwork Protocols", "version": "9.30.2212.1"},
+                                        {"name": "IxOS REST", "version": "1.6.2.21"}]}
+        cards = []
+        ports = []
+        for card_number in range(1, self.cards + 1):
+            card_type = rnd.choice(CARD_TYPES)
+            cards.append({"id": card_number,
+                          "cardNumber": card_number,
+                          "serialNumber": f"{serial}-{card_number:02d}",
+                          "type": card_type,
+                          "state": "UP",
+                          "numberOfPorts": self.ports_per_card})
+            for port_number in range(1, self.ports_per_card + 1):
+                model, manufacturer = rnd.choice(TRANSCEIVERS)
+                owned = rnd.random() < self.owned_share
+                ports.append({"id": len(ports) + 1,
+                              "cardNumber": card_number,
+                              "portNumber": port_number,
+                              "owner": f"user{rnd.randrange(20)}/session" if owned else "",
+                              "transceiverModel": model,
+                              "transceiverManufacturer": manufacturer,
+                              "phyMode": rnd.choice(["FIBER", "COPPER"]),
+                              "linkState": "UP" if owned or rnd.random() < 0.5 else "DOWN",
+                              "speed": rnd.choice(["10000", "100000", "400000"]),
+                              "type": card_type,
+                              "transmitState": "TRANSMITTING" if owned and rnd.random() < 0.5 else "IDLE"})
+        licenses = [{"partNumber": rnd.choice(LICENSE_PARTS),
+                     "activationCode": f"{rnd.randrange(16 ** 4):04X}-{rnd.randrange(16 ** 4):04X}-{rnd.randrange(16 ** 4):04X}",
+                     "quantity": rnd.randint(1, 8),
+                     "description": f"Simulated license {index}, {serial}",
+                     "maintenanceDate": f"{rnd.randint(2024, 2030)}-12-31",
+                     "expiryDate": "Permanent",
+                     "isExpired": False} for index in range(self.licenses)]
+        sensors = [{"id": index, "parentId": 1, "type": sensor_type, "unit": unit, "name": f"{name} {index}",
+                    "value": rnd.randint(20, 70), "criticalValue": 90, "maxValue": 100, "minValue": 0,
+                    "adapterName": "sim", "sensorSetName": "sim", "cpuName": "sim"}
+                   for index, (sensor_type, unit, name) in zip(range(self.sensors), itertools.cycle(
+                       [("TEMPERATURE", "CELSIUS", "Card temperature"), ("FAN", "RPM", "Fan"),
+                        ("VOLTAGE", "VOLT", "Rail")]))]
+        inventory = {"chassis": chassis, "cards": cards, "ports": ports, "licenses": licenses,
+                     "sensors": sensors, "hostId": f"HOST-{serial}"}
+        with self._lock:
+            return self._inventory.setdefault(address, inventory)
+
+    def portstats(self, address):
+        """Counters of every port, growing at a steady per port rate since the simulator started"""
+        elapsed = time.time() - self.started_at
+        stats = []
+        for port in self.inventory(address)["ports"]:
+            frames_per_second = 0 if port["transmitState"] == "IDLE" else 100000 + port["id"] * 1000
+            frames = int(frames_per_second * elapsed)
+            stats.append({"id": port["id"], "cardNumber": port["cardNumber"], "portNumber": port["portNumber"],
+                          "framesSent": frames, "framesReceived": frames, "bytesSent": frames * 512,
+                          "bytesReceived": frames * 512, "fcsErrors": int(elapsed) // 600})
+        return stats
+
+    def perfcounters(self, address):
+        rnd = random.Random()
+        total = 16 * 1024 ** 3
+        return [{"memoryTotalBytes": total,
+                 "memoryInUseBytes": int(total * rnd.uniform(0.2, 0.8)),
+                 "cpuUsagePercent": round(rnd.uniform(1, 90), 2)}]
+
+
+class SimulatorState(object):
+    """Issued API keys and running async operations, shared by all handler threads"""
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.lock = threading.Lock()
+        self.api_keys = {}
+        self.operations = {}
+        self.requests = 0
+
+
+class IxOSSimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.simulator_state
+
+    @property
+    def address(self):
+        return self.headers.get("Host", "")
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _url(self, path):
+        return f"https://{self.address}{path}"
+
+    def _start_operation(self, path, result):
+        """Answer 202 with an operation that reports IN_PROGRESS async_steps times, then SUCCESS"""
+        operation_id = uuid.uuid4().hex
+        with self.state.lock:
+            self.state.operations[operation_id] = {"remaining": self.state.fleet.async_steps, "result": result}
+        self._send_json(202, {"id": operation_id, "state": "IN_PROGRESS", "progress": 0,
+                              "url": self._url(f"{path}/{operation_id}")})
+
+    def _poll_operation(self, path, operation_id, want_result):
+        with self.state.lock:
+            operation = self.state.operations.get(operation_id)
+            if operation is not None and not want_result and operation["remaining"] > 0:
+                operation["remaining"] -= 1
+        if operation is None:
+            return self._send_json(404, {"message": f"Unknown operation {operation_id}"})
+        if want_result:
+            return self._send_json(200, operation["result"])
+        if operation["remaining"] > 0:
+            return self._send_json(200, {"id": operation_id, "state": "IN_PROGRESS", "url": self._url(path)})
+        return self._send_json(200, {"id": operation_id, "state": "SUCCESS", "url": self._url(path),
+                                     "resultUrl": self._url(f"{path}/result")})
+
+    def _authorized(self):
+        api_key = self.headers.get("x-api-key")
+        with self.state.lock:
+            issued_at = self.state.api_keys.get(api_key)
+        ttl = self.state.fleet.key_ttl
+        return issued_at is not None and (not ttl or time.time() - issued_at < ttl)
+
+    def _handle(self, method):
+        fleet = self.state.fleet
+        with self.state.lock:
+            self.state.requests += 1
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if fleet.is_unreachable(self.address):
+            # Drop the connection, the client sees a connection error like for a powered off chassis
+            self.close_connection = True
+            self.connection.close()
+            return
+        if fleet.latency or fleet.jitter:
+            time.sleep(max(0.0, random.gauss(fleet.latency, fleet.jitter)))
+        if fleet.error_rate and random.random() < fleet.error_rate:
+            return self._send_json(500, {"message": "Simulated failure"})
+
+        path = self.path.split("?")[0]
+        if method == "POST" and path == AUTH_URI:
+            api_key = uuid.uuid4().hex
+            with self.state.lock:
+                self.state.api_keys[api_key] = time.time()
+            return self._send_json(200, {"apiKey": api_key})
+        if not self._authorized():
+            return self._send_json(401, {"message": "Invalid API key"})
+
+        inventory = fleet.inventory(self.address)
+        if method == "GET" and path.startswith(IXOS_URI + "/"):
+            resource = path[len(IXOS_URI) + 1:]
+            if resource in ("chassis", "cards", "ports", "sensors"):
+                body = [inventory["chassis"]] if resource == "chassis" else inventory[resource]
+                return self._send_json(200, body)
+            if resource == "perfcounters":
+                return self._send_json(200, fleet.perfcounters(self.address))
+            if resource == "portstats":
+                return self._send_json(200, fleet.portstats(self.address))
+        if method == "GET" and path == LICENSING_URI:
+            return self._send_json(200, [{"id": 1}])
+
+        match = re.match(r"^(.*/ports/(\d+)/operations/(takeownership|releaseownership))(?:/(\w+)(/result)?)?$", path)
+        if match:
+            operation_path, port_id, operation, operation_id, result = match.groups()
+            if method == "POST" and operation_id is None:
+                port = next((port for port in inventory["ports"] if port["id"] == int(port_id)), None)
+                if port is None:
+                    return self._send_json(404, {"message": f"Unknown port {port_id}"})
+                with self.state.lock:
+                    port["owner"] = "admin/simulator" if operation == "takeownership" else ""
+                return self._start_operation(operation_path, {})
+            if method == "GET" and operation_id is not None:
+                return self._poll_operation(f"{operation_path}/{operation_id}", operation_id, bool(result))
+
+        match = re.match(r"^(.*/operations/(retrievehostid|retrievelicenses|collectlogs))(?:/(\w+)(/result)?)?$", path)
+        if match:
+            operation_path, operation, operation_id, result = match.groups()
+            if method == "POST" and operation_id is None:
+                results = {"retrievehostid": {"hostId": inventory["hostId"]},
+                           "retrievelicenses": inventory["licenses"],
+                           "collectlogs": {"file": f"logs-{inventory['chassis']['serialNumber']}.zip"}}
+                return self._start_operation(operation_path, results[operation])
+            if method == "GET" and operation_id is not None:
+                return self._poll_operation(f"{operation_path}/{operation_id}", operation_id, bool(result))
+        return self._send_json(404, {"message": f"{method} {path} is not simulated"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def create_self_signed_certificate(directory):
+    """certfile and keyfile of a throwaway certificate, IxRestSession does not verify it"""
+    certfile = os.path.join(directory, "simulator.crt")
+    keyfile = os.path.join(directory, "simulator.key")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "7",
+                    "-subj", "/CN=ixos-simulator", "-keyout", keyfile, "-out", certfile],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def start_simulator(fleet, port=8443, certfile=None, keyfile=None):
+    """Serve fleet on 0.0.0.0:port from a background thread, returns the server (call shutdown() to stop)"""
+    if certfile is None:
+        certfile, keyfile = create_self_signed_certificate(tempfile.mkdtemp())
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    server = ThreadingHTTPServer(("0.0.0.0", port), IxOSSimulatorHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.simulator_state = SimulatorState(fleet)
+    threading.Thread(target=server.serve_forever, name="ixos-simulator", daemon=True).start()
+    return server
+
+
+def fleet_options(function):
+    """click options shared by the simulator and the poll cycle harness"""
+    options = [click.option('--chassis', default=10, help='Number of simulated chassis'),
+               click.option('--cards', default=4, help='Cards per chassis'),
+               click.option('--ports-per-card', default=16, help='Ports per card'),
+               click.option('--licenses', default=8, help='Licenses per chassis'),
+               click.option('--sensors', default=12, help='Sensors per chassis'),
+               click.option('--latency', default=0.0, help='Mean response latency in seconds'),
+               click.option('--jitter', default=0.0, help='Standard deviation of the latency in seconds'),
+               click.option('--error-rate', default=0.0, help='Share of requests answered with a 500'),
+               click.option('--unreachable', default=0.0, help='Share of chassis that drop every connection'),
+               click.option('--async-steps', default=1, help='IN_PROGRESS answers before an async operation succeeds'),
+               click.option('--key-ttl', default=0, help='Seconds an API key stays valid, 0 for forever'),
+               click.option('--port', default=8443, help='Port the simulator listens on')]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+def fleet_from_options(chassis, cards, ports_per_card, licenses, sensors, latency, jitter, error_rate,
+                       unreachable, async_steps, key_ttl):
+    return SimulatedFleet(chassis=chassis, cards=cards, ports_per_card=ports_per_card, licenses=licenses,
+                          sensors=sensors, latency=latency, jitter=jitter, error_rate=error_rate,
+                          unreachable_share=unreachable, async_steps=async_steps, key_ttl=key_ttl)
+
+
+@click.command()
+@fleet_options
+@click.option('--certfile', default=None, help='TLS certificate, a self signed one is created if omitted')
+@click.option('--keyfile', default=None, help='TLS private key of --certfile')
+def run_simulator(port, certfile, keyfile, **fleet_config):
+    """Serve a simulated chassis fleet and print its chassis list"""
+    fleet = fleet_from_options(**fleet_config)
+    server = start_simulator(fleet, port=port, certfile=certfile, keyfile=keyfile)
+    print("\n".join(f"ADD,{chassis_address(index, port)},admin,admin" for index in range(fleet.chassis)))
+    try:
+        while True:
+            time.sleep(60)
+            print(f"{server.simulator_state.requests} requests served")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    run_simulator()
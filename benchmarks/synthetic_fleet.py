@@ -0,0 +1,110 @@
+"""Synthetic poll results of a whole chassis fleet, in the shapes the data_poller categories hand to write_data_to_database."""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+CARD_TYPES = ["NOVUS100GE8Q28", "NOVUS10/1GE32S", "AresONE-400GE-8P", "K400-QDD-8"]
+CHASSIS_TYPES = ["Ixia_XGS12", "Ixia_XGS2", "Ixia_Novus_One"]
+
+
+def fleet_chassis_ips(chassis):
+    """Addresses of the synthetic chassis"""
+    return [f"10.{index // 65536}.{(index // 256) % 256}.{index % 256}" for index in range(chassis)]
+
+
+def generate_fleet(chassis, cards=8, ports_per_card=16, licenses=10, sensors=20, perf_samples=60, seed=0):
+    """Records of every polled table for a fleet of chassis, keyed by table name"""
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    last_update_at = now.strftime("%m/%d/%Y, %H:%M:%S")
+    fleet = {"chassis_summary_details": [],
+             "chassis_card_details": [],
+             "chassis_port_details": [],
+             "license_details_records": [],
+             "chassis_sensor_details": [],
+             "chassis_utilization_details": []}
+
+    for index, ip in enumerate(fleet_chassis_ips(chassis)):
+        chassis_type = rnd.choice(CHASSIS_TYPES)
+        serial = f"SYN{index:07d}"
+        fleet["chassis_summary_details"].append({"chassisIp": ip,
+                                                 "chassisSerial#": serial,
+                                                 "controllerSerial#": f"CTL{index:07d}",
+                                                 "chassisType": chassis_type,
+                                                 "physicalCards#": str(cards),
+                                                 "chassisStatus": "UP",
+                                                 "lastUpdatedAt_UTC": last_update_at,
+                                                 "mem_bytes": "7.5 GB",
+                                                 "mem_bytes_total": "16.0 GB",
+                                                 "cpu_pert_usage": rnd.randint(1, 90),
+                                                 "os": "Linux",
+                                                 "IxOS": "9.30.3001.12",
+                                                 "IxNetwork Protocols": "9.30.2212.1",
+                                                 "IxOS REST": "1.6.2.21"})
+
+        card_records = []
+        port_records = []
+        for card_number in range(1, cards + 1):
+            card_type = rnd.choice(CARD_TYPES)
+            card_records.append({"chassisIp": ip,
+                                 "chassisType": chassis_type,
+                                 "cardNumber": card_number,
+                                 "serialNumber": f"{serial}-{card_number:02d}",
+                                 "cardType": card_type,
+                                 "cardState": "UP",
+                                 "numberOfPorts": ports_per_card,
+                                 "lastUpdatedAt_UTC": last_update_at})
+            for port_number in range(1, ports_per_card + 1):
+                owned = rnd.random() < 0.3
+                port_records.append({"chassisIp": ip,
+                                     "typeOfChassis": chassis_type,
+                                     "cardNumber": card_number,
+                                     "portNumber": port_number,
+                                     "linkState": "UP" if owned or rnd.random() < 0.5 else "DOWN",
+                                     "phyMode": rnd.choice(["FIBER", "COPPER"]),
+                                     "transceiverModel": "QSFP28-100G-SR4",
+                                     "transceiverManufacturer": "Keysight",
+                                     "owner": f"user{rnd.randrange(50)}/session" if owned else "Free",
+                                     "speed": rnd.choice(["10000", "100000", "400000"]),
+                                     "type": card_type,
+                                     "transmitState": "IDLE",
+                                     "lastUpdatedAt_UTC": last_update_at})
+        owned_ports = sum(1 for port in port_records if port["owner"] != "Free")
+        for port in port_records:
+            port.update({"totalPorts": len(port_records), "ownedPorts": owned_ports,
+                         "freePorts": len(port_records) - owned_ports})
+        fleet["chassis_card_details"].append(card_records)
+        fleet["chassis_port_details"].append(port_records)
+
+        fleet["license_details_records"].append([{"chassisIp": ip,
+                                                  "typeOfChassis": chassis_type,
+                                                  "hostId": f"HOST-{serial}",
+                                                  "partNumber": f"930-{2100 + license_index}",
+                                                  "activationCode": f"{index:04X}-{license_index:04X}",
+                                                  "quantity": rnd.randint(1, 8),
+                                                  "description": f"Synthetic license {license_index}",
+                                                  "maintenanceDate": "2030-12-31",
+                                                  "expiryDate": "Permanent",
+                                                  "isExpired": False,
+                                                  "lastUpdatedAt_UTC": last_update_at}
+                                                 for license_index in range(licenses)])
+        fleet["chassis_sensor_details"].append([{"chassisIp": ip,
+                                                 "typeOfChassis": chassis_type,
+                                                 "type": "TEMPERATURE",
+                                                 "unit": "CELSIUS",
+                                                 "name": f"Sensor {sensor_index}",
+                                                 "value": rnd.randint(20, 70),
+                                                 "lastUpdatedAt_UTC": last_update_at}
+                                                for sensor_index in range(sensors)])
+        for sample in range(perf_samples):
+            sampled_at = now - timedelta(minutes=perf_samples - sample)
+            fleet["chassis_utilization_details"].append({"chassisIp": ip,
+                                                         "mem_utilization": rnd.uniform(20, 80),
+                                                         "cpu_utilization": rnd.uniform(1, 90),
+                                                         "lastUpdatedAt_UTC": sampled_at.strftime("%m/%d/%Y, %H:%M:%S")})
+    return fleet
+
+
+def row_count(records):
+    """Number of table rows in a list of poll results"""
+    return sum(len(record) if isinstance(record, list) else 1 for record in records)
@@ -0,0 +1,85 @@
+"""Long lived cache of chassis attributes that almost never change.
+
+The OS of a chassis, its type and the host ID of its license servers used to
+be rediscovered on every poll, the host ID through an async REST operation
+per license server. They are now discovered once and kept, in memory and in
+the chassis_facts table so a poller restart does not rediscover them, for
+STATIC_FACTS_TTL seconds. The facts of a chassis are dropped as soon as its
+serial number or IxOS version changes, e.g. after a controller swap or an
+upgrade.
+"""
+
+import os
+import threading
+import time
+
+from sqlite3_utilities import read_chassis_facts_from_database, write_chassis_facts_to_database, delete_chassis_facts_from_database
+
+STATIC_FACTS_TTL = int(os.environ.get("IIE_STATIC_FACTS_TTL", "86400"))
+FACT_NAMES = ("os", "chassisType", "hostId")
+
+
+class ChassisFacts(object):
+    """Static facts of every chassis ip with their identity (serial number, IxOS version)"""
+
+    def __init__(self, ttl=STATIC_FACTS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._facts = {}
+
+    def _reset(self, facts):
+        for name in FACT_NAMES:
+            facts[name] = None
+        facts["expiresAt"] = int(time.time()) + self.ttl
+
+    def _facts_of(self, ip):
+        """Cached facts of ip, loaded from DB on first use, caller holds the lock"""
+        facts = self._facts.get(ip)
+        if facts is None:
+            facts = read_chassis_facts_from_database(ip)
+            if facts is None:
+                facts = {"ip": ip, "serialNumber": None, "ixosVersion": None}
+                self._reset(facts)
+            self._facts[ip] = facts
+        if facts["expiresAt"] < time.time():
+            self._reset(facts)
+        return facts
+
+    def check_identity(self, ip, serial_number, ixos_version):
+        """Forget the facts of ip if it is not the chassis they were discovered on anymore"""
+        with self._lock:
+            facts = self._facts_of(ip)
+            if (facts["serialNumber"], facts["ixosVersion"]) == (serial_number, ixos_version):
+                return
+            self._reset(facts)
+            facts["serialNumber"] = serial_number
+            facts["ixosVersion"] = ixos_version
+            facts = dict(facts)
+        write_chassis_facts_to_database(facts)
+
+    def get(self, ip, name, discover):
+        """Cached value of fact name of ip, discover() is only called when it is not known yet.
+        Empty and NA results are not cached, they are retried on the next poll.
+        """
+        with self._lock:
+            value = self._facts_of(ip)[name]
+        if value is not None:
+            return value
+        value = discover()
+        if value in (None, "", "NA"):
+            return value
+        with self._lock:
+            facts = self._facts_of(ip)
+            facts[name] = value
+            facts = dict(facts)
+        write_chassis_facts_to_database(facts)
+        return value
+
+    def forget(self, ip):
+        """Drop the facts of ip, e.g. when it is removed from the inventory"""
+        with self._lock:
+            self._facts.pop(ip, None)
+        delete_chassis_facts_from_database(ip)
+
+
+chassis_facts = ChassisFacts()
@@ -0,0 +1,107 @@
+"""Per chassis health tracking used to stop polling chassis that are down.
+
+A chassis whose polls fail FAILURE_THRESHOLD times in a row because it cannot
+be reached is open-circuited: every category skips it until an exponentially
+growing, jittered backoff expires. A cheap TCP connect to the REST port then
+decides whether full polling resumes or the backoff grows again.
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+
+import requests
+
+FAILURE_THRESHOLD = int(os.environ.get("IIE_FAILURE_THRESHOLD", "3"))
+BASE_BACKOFF = int(os.environ.get("IIE_BASE_BACKOFF", "60"))
+MAX_BACKOFF = int(os.environ.get("IIE_MAX_BACKOFF", "3600"))
+PROBE_PORT = 443
+PROBE_TIMEOUT = 2
+
+
+class ChassisHealth(object):
+    """Failure counting and circuit breaker state for every chassis ip"""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, base_backoff=BASE_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._retry_at = {}
+        self._probing = set()
+
+    @staticmethod
+    def is_unreachable_error(error):
+        """Only connectivity problems count towards opening the circuit"""
+        return isinstance(error, (requests.exceptions.ConnectionError,
+                                  requests.exceptions.Timeout,
+                                  socket.error))
+
+    @staticmethod
+    def probe(ip):
+        """Cheap reachability check, a plain TCP connect to the chassis REST port"""
+        # Chassis addresses may carry a port, e.g. chassis behind a NAT or simulated ones
+        host, _, port = ip.rpartition(":") if ip.count(":") == 1 else (ip, None, PROBE_PORT)
+        try:
+            socket.create_connection((host, int(port)), timeout=PROBE_TIMEOUT).close()
+            return True
+        except OSError:
+            return False
+
+    def is_open(self, ip):
+        """True while the chassis is being skipped"""
+        with self._lock:
+            return ip in self._retry_at
+
+    def should_poll(self, ip):
+        """Decide whether the chassis is polled now, probing it once its backoff expired"""
+        with self._lock:
+            retry_at = self._retry_at.get(ip)
+            if retry_at is None:
+                return True
+            if time.time() < retry_at or ip in self._probing:
+                return False
+            self._probing.add(ip)
+
+        try:
+            reachable = self.probe(ip)
+        finally:
+            with self._lock:
+                self._probing.discard(ip)
+
+        if not reachable:
+            self.record_failure(ip)
+            return False
+        # Half open, the next poll failure re-opens the circuit with a longer backoff
+        with self._lock:
+            self._retry_at.pop(ip, None)
+        return True
+
+    def record_success(self, ip):
+        with self._lock:
+            self._failures.pop(ip, None)
+            self._retry_at.pop(ip, None)
+
+    def record_failure(self, ip):
+        """Count a failed poll, returns True if the chassis is now open-circuited"""
+        with self._lock:
+            failures = self._failures.get(ip, 0) + 1
+            self._failures[ip] = failures
+            if failures < self.failure_threshold:
+                return False
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (failures - self.failure_threshold))
+            self._retry_at[ip] = time.time() + random.uniform(backoff / 2, backoff)
+            return True
+
+    def forget(self, ip):
+        """Drop every state of ip, e.g. when it is removed from the inventory"""
+        with self._lock:
+            self._failures.pop(ip, None)
+            self._retry_at.pop(ip, None)
+            self._probing.discard(ip)
+
+
+chassis_health = ChassisHealth()
@@ -1,197 +1,339 @@
 import click
 import time
 import json
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 
-from sqlite3_utilities import read_username_password_from_database, write_data_to_database, get_chassis_type_from_ip, delte_half_data_from_performace_metric_table, read_poll_setting_from_database
+from sqlite3_utilities import read_username_password_from_database, write_data_to_database, get_chassis_type_from_ip, rollup_utilization, rollup_and_prune_utilization, prune_port_stats, read_poll_setting_from_database, mark_chassis_data_stale, chassis_has_data_in_database, delete_data_of_removed_chassis, REMOVED_CHASSIS_TABLES
 import IxOSRestAPICaller as ixOSRestCaller
-from RestApi.IxOSRestInterface import IxRestSession
+from RestApi.IxOSRestInterface import get_cached_session
+from chassis_health import chassis_health
+from chassis_facts import chassis_facts
+from metrics import start_flusher, POLL_CATEGORY_SECONDS, POLL_CATEGORY_ERRORS, POLL_CHASSIS_SECONDS, POLL_CHASSIS_RESULTS, POLL_CYCLE_OVERRUNS
 
-def get_chassis_summary_data():
-    """This is a call to RestAPI to get chassis summary data
+# Upper bound on the number of chassis polled at the same time by one category
+MAX_POLL_WORKERS = int(os.environ.get("IIE_POLL_WORKERS", "16"))
+
+
+def set_max_poll_workers(workers):
+    """Change the concurrency limit used when polling the chassis list"""
+    global MAX_POLL_WORKERS
+    MAX_POLL_WORKERS = max(1, int(workers))
+
+
+def poll_chassis_list(chassis_list, poll_method):
+    """Run poll_method for every chassis on a bounded worker pool.
+    Results are returned in the same order as chassis_list.
     """
-    list_of_chassis = []
-    serv_list = read_username_password_from_database()
-    if serv_list:
-        chassis_list = json.loads(serv_list)
-        for chassis in chassis_list:
+    workers = min(MAX_POLL_WORKERS, len(chassis_list))
+    if workers <= 1:
+        return [poll_method(chassis) for chassis in chassis_list]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(poll_method, chassis_list))
+
+
+def timed_category(category):
+    """Record duration and failures of a fleet wide category function"""
+    def decorator(poll_function):
+        @functools.wraps(poll_function)
+        def timed(*args, **kwargs):
             try:
-                session = IxRestSession(
-                    chassis["ip"], chassis["username"], chassis["password"], verbose=False)
-                out = ixOSRestCaller.get_chassis_information(session)
-                out["chassisIp"] = chassis["ip"]
-                list_of_chassis.append(out)
+                with POLL_CATEGORY_SECONDS.time(category=category):
+                    return poll_function(*args, **kwargs)
             except Exception:
-                list_of_chassis.append({ "chassisIp": chassis["ip"],
-                    "chassisSerial#": "NA",
-                    "controllerSerial#": "NA",
-                    "chassisType": "NA",
-                    "physicalCards#": "NA",
-                    "chassisStatus": "Not Reachable",
-                    "lastUpdatedAt_UTC": "NA",
-                    "mem_bytes": "NA", 
-                    "mem_bytes_total": "NA", 
-                    "cpu_pert_usage": "NA",
-                    "os": "NA",
-                    "IxOS": "NA",
-                    "IxNetwork Protocols": "NA",
-                    "IxOS REST": "NA"})
-                    
-
-        write_data_to_database(table_name="chassis_summary_details",
-                            records=list_of_chassis, ip_tags_dict={})
-    else:
+                POLL_CATEGORY_ERRORS.inc(category=category)
+                raise
+        return timed
+    return decorator
+
+
+def timed_chassis_poll(category, placeholder):
+    """Poll category on a single chassis through its circuit breaker, recording duration and outcome.
+    A failed poll returns None when the chassis already has data in DB, which is kept, and
+    placeholder(chassis) for a chassis that never had any.
+    """
+    def decorator(poll_method):
+        @functools.wraps(poll_method)
+        def timed(chassis):
+            # Skipped while the circuit breaker is open, the chassis was unreachable the last times
+            if not chassis_health.should_poll(chassis["ip"]):
+                POLL_CHASSIS_RESULTS.inc(category=category, chassis=chassis["ip"], outcome="unreachable")
+                return None
+            try:
+                with POLL_CHASSIS_SECONDS.time(category=category, chassis=chassis["ip"]):
+                    out = poll_method(chassis)
+            except Exception as e:
+                if chassis_health.is_unreachable_error(e):
+                    POLL_CHASSIS_RESULTS.inc(category=category, chassis=chassis["ip"], outcome="unreachable")
+                    chassis_health.record_failure(chassis["ip"])
+                else:
+                    # HTTP errors, unexpected answers and poller bugs
+                    print(f"Poll of {category} for {chassis['ip']} failed: {e!r}")
+                    POLL_CHASSIS_RESULTS.inc(category=category, chassis=chassis["ip"], outcome="error")
+                if chassis_has_data_in_database(categoryToChassisPollMap[category][1], chassis["ip"]):
+                    return None
+                return placeholder(chassis)
+            chassis_health.record_success(chassis["ip"])
+            POLL_CHASSIS_RESULTS.inc(category=category, chassis=chassis["ip"], outcome="ok")
+            return out
+        return timed
+    return decorator
+
+
+def _chassis_type(ip):
+    """Type of chassis ip as seen by the last chassis summary poll, cached once known"""
+    return chassis_facts.get(ip, "chassisType", lambda: get_chassis_type_from_ip(ip))
+
+
+
+def poll_and_stream(category):
+    """Poll category on every chassis, each chassis's rows are committed as soon as its poll returns.
+    Rows of chassis removed from the inventory are deleted once every chassis was polled.
+    """
+    serv_list = read_username_password_from_database()
+    if not serv_list:
         print("No Chassis List")
+        return
+    chassis_list = json.loads(serv_list)
 
+    def poll_one(chassis):
+        try:
+            poll_single_chassis(category, chassis)
+        except Exception as e:
+            print(f"Poll of {category} for {chassis['ip']} failed: {e}")
 
+    poll_chassis_list(chassis_list, poll_one)
+    _, table_name = categoryToChassisPollMap[category]
+    if table_name in REMOVED_CHASSIS_TABLES:
+        delete_data_of_removed_chassis(table_name, [chassis["ip"] for chassis in chassis_list])
+
+
+def _unreachable_summary(chassis):
+    """Placeholder chassis summary of a chassis that never answered"""
+    return { "chassisIp": chassis["ip"],
+        "chassisSerial#": "NA",
+        "controllerSerial#": "NA",
+        "chassisType": "NA",
+        "physicalCards#": "NA",
+        "chassisStatus": "Not Reachable",
+        "lastUpdatedAt_UTC": "NA",
+        "mem_bytes": "NA",
+        "mem_bytes_total": "NA",
+        "cpu_pert_usage": "NA",
+        "os": "NA",
+        "IxOS": "NA",
+        "IxNetwork Protocols": "NA",
+        "IxOS REST": "NA"}
+
+
+@timed_chassis_poll("chassis", _unreachable_summary)
+def _poll_chassis_summary(chassis):
+    """Poll chassis summary for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_chassis_information(session)
+    out["chassisIp"] = chassis["ip"]
+    return out
+
+
+@timed_category("chassis")
+def get_chassis_summary_data():
+    """This is a call to RestAPI to get chassis summary data
+    """
+    poll_and_stream("chassis")
+
+
+def _unreachable_cards(chassis):
+    """Placeholder cards data of a chassis that never answered"""
+    return [{'chassisIp': chassis["ip"],
+           'chassisType': 'NA',
+           'cardNumber': 'NA',
+           'serialNumber': 'NA',
+           'cardType': 'NA',
+           'cardState': 'NA',
+           'numberOfPorts': 'NA',
+           'lastUpdatedAt_UTC': 'NA'}]
+
+
+@timed_chassis_poll("cards", _unreachable_cards)
+def _poll_chassis_cards(chassis):
+    """Poll card details for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_chassis_cards_information(
+        session, chassis["ip"], _chassis_type(chassis["ip"]))
+    return out
+
+
+@timed_category("cards")
 def get_chassis_card_data():
     """This is a call to RestAPI to get chassis card summary data
     """
-    list_of_cards = []
-    serv_list = read_username_password_from_database()
-    if serv_list:
-        chassis_list = json.loads(serv_list)
-        for chassis in chassis_list:
-            try:
-                session = IxRestSession(
-                    chassis["ip"], chassis["username"], chassis["password"], verbose=False)
-                out = ixOSRestCaller.get_chassis_cards_information(
-                    session, chassis["ip"], get_chassis_type_from_ip(chassis["ip"]))
-                list_of_cards.append(out)
-            except Exception:
-                out = [{'chassisIp': chassis["ip"], 
-                       'chassisType': 'NA', 
-                       'cardNumber': 'NA', 
-                       'serialNumber': 'NA', 
-                       'cardType': 'NA', 
-                       'cardState': 'NA', 
-                       'numberOfPorts': 'NA', 
-                       'lastUpdatedAt_UTC': 'NA'}]
-                list_of_cards.append(out)
-        
-        write_data_to_database(table_name="chassis_card_details",
-                            records=list_of_cards, ip_tags_dict={})
+    poll_and_stream("cards")
+
+
+def _unreachable_ports(chassis):
+    """Placeholder ports data of a chassis that never answered"""
+    return [{
+        'owner': 'NA',
+        'transceiverModel': 'NA',
+        'transceiverManufacturer': 'NA',
+        'portNumber': 'NA',
+        'linkState': 'NA',
+        'cardNumber': 'NA',
+        'lastUpdatedAt_UTC': 'NA',
+        'totalPorts': 'NA',
+        'ownedPorts': 'NA',
+        'freePorts': 'NA',
+        'chassisIp': chassis["ip"],
+        'typeOfChassis': 'NA',
+        'transmitState': 'NA'
+    }]
 
 
+@timed_chassis_poll("ports", _unreachable_ports)
+def _poll_chassis_ports(chassis):
+    """Poll port details for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_chassis_ports_information(
+        session, chassis["ip"], _chassis_type(chassis["ip"]))
+    return out
+
+
+@timed_category("ports")
 def get_chassis_port_data():
     """This is a call to RestAPI to get chassis card port summary data
     """
-    port_list_details = []
-    serv_list = read_username_password_from_database()
-    if serv_list:
-        chassis_list = json.loads(serv_list)
-        if chassis_list:
-            for chassis in chassis_list:
-                try:
-                    session = IxRestSession(
-                        chassis["ip"], chassis["username"], chassis["password"], verbose=False)
-                    out = ixOSRestCaller.get_chassis_ports_information(
-                        session, chassis["ip"], get_chassis_type_from_ip(chassis["ip"]))
-                    port_list_details.append(out)
-                except Exception:
-                    a = [{
-                        'owner': 'NA',
-                        'transceiverModel': 'NA',
-                        'transceiverManufacturer': 'NA',
-                        'portNumber': 'NA',
-                        'linkState': 'NA',
-                        'cardNumber': 'NA',
-                        'lastUpdatedAt_UTC': 'NA',
-                        'totalPorts': 'NA',
-                        'ownedPorts': 'NA',
-                        'freePorts': 'NA',
-                        'chassisIp': chassis["ip"],
-                        'typeOfChassis': 'NA',
-                        'transmitState': 'NA'
-                    }]
-                    port_list_details.append(a)
-            write_data_to_database(
-                table_name="chassis_port_details", records=port_list_details)
+    poll_and_stream("ports")
+
+
+def _unreachable_licensing(chassis):
+    """Placeholder licensing data of a chassis that never answered"""
+    return [{
+        'chassisIp': chassis["ip"],
+        'typeOfChassis': 'NA',
+        'hostId': 'NA',
+        'partNumber': 'NA',
+        'activationCode': 'NA',
+        'quantity': 'NA',
+        'description': 'NA',
+        'maintenanceDate': 'NA',
+        'expiryDate': 'NA',
+        'isExpired': 'NA',
+        'lastUpdatedAt_UTC': 'NA'
+    }]
 
 
+@timed_chassis_poll("licensing", _unreachable_licensing)
+def _poll_chassis_licensing(chassis):
+    """Poll licensing details for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_license_activation(
+        session, chassis["ip"], _chassis_type(chassis["ip"]))
+    return out
+
+
+@timed_category("licensing")
 def get_chassis_licensing_data():
     """This is a call to RestAPI to get chassis licensing data
     """
-    list_of_licenses = []
-    serv_list = read_username_password_from_database()
-    if serv_list:
-        chassis_list = json.loads(serv_list)
-        for chassis in chassis_list:
-            try:
-                session = IxRestSession(
-                    chassis["ip"], chassis["username"], chassis["password"], verbose=False)
-                out = ixOSRestCaller.get_license_activation(
-                    session, chassis["ip"], get_chassis_type_from_ip(chassis["ip"]))
-                list_of_licenses.append(out)
-            except Exception:
-                a = [{
-                'chassisIp': chassis["ip"],
-                'typeOfChassis': 'NA',
-                'hostId': 'NA',
-                'partNumber': 'NA',
-                'activationCode': 'NA',
-                'quantity': 'NA',
-                'description': 'NA',
-                'maintenanceDate': 'NA',
-                'expiryDate': 'NA',
-                'isExpired': 'NA',
-                'lastUpdatedAt_UTC': 'NA'
-                }]
-                list_of_licenses.append(a)
-        write_data_to_database(
-            table_name="license_details_records", records=list_of_licenses)
+    poll_and_stream("licensing")
 
+
+def _unreachable_sensors(chassis):
+    """Placeholder sensors data of a chassis that never answered"""
+    return [{
+        'type': 'NA',
+        'unit': 'NA',
+        'name': 'NA',
+        'value': 'NA',
+        'chassisIp': chassis["ip"],
+        'typeOfChassis': 'NA',
+        'lastUpdatedAt_UTC': 'NA'
+    }]
+
+
+@timed_chassis_poll("sensors", _unreachable_sensors)
+def _poll_chassis_sensors(chassis):
+    """Poll sensor details for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_sensor_information(session, chassis["ip"], _chassis_type(chassis["ip"]))
+    return out
+
+
+@timed_category("sensors")
 def get_sensor_information():
     """This is a call to RestAPI to get chassis sensors summary data
     """
-    sensor_list_details = []
-    serv_list = read_username_password_from_database()
-    if serv_list:
-        chassis_list = json.loads(serv_list)
-        for chassis in chassis_list:
-            try:
-                session = IxRestSession(chassis["ip"], chassis["username"], chassis["password"], verbose=False)
-                out = ixOSRestCaller.get_sensor_information(session, chassis["ip"], get_chassis_type_from_ip(chassis["ip"]))
-                sensor_list_details.append(out)
-            except Exception:
-                a =   [{
-                        'type': 'NA',
-                        'unit': 'NA',
-                        'name': 'NA',
-                        'value': 'NA',
-                        'chassisIp': chassis["ip"],
-                        'typeOfChassis': 'NA',
-                        'lastUpdatedAt_UTC': 'NA'
-                    }]
-                sensor_list_details.append(a)
-        write_data_to_database(
-            table_name="chassis_sensor_details", records=sensor_list_details)
+    poll_and_stream("sensors")
+
+
+def _unreachable_perf(chassis):
+    """Placeholder performance metrics of a chassis that never answered"""
+    return {'chassisIp': chassis["ip"],
+            'mem_utilization': 0,
+            'cpu_utilization': 0,
+            'lastUpdatedAt_UTC': '03/15/2023, 03:31:47'}
 
+
+@timed_chassis_poll("perf", _unreachable_perf)
+def _poll_chassis_perf(chassis):
+    """Poll performance metrics for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_perf_metrics(session, chassis["ip"])
+    return out
+
+
+@timed_category("perf")
 def get_perf_metrics():
     """This is a call to RestAPI to get chassis performance metrics data
     """
-    serv_list = read_username_password_from_database()
-    perf_list_details = []
-    if serv_list:
-        chassis_list = json.loads(serv_list)
-        for chassis in chassis_list:
-            try:
-                session = IxRestSession(chassis["ip"], chassis["username"], chassis["password"], verbose=False)
-                out = ixOSRestCaller.get_perf_metrics(session, chassis["ip"])
-                perf_list_details.append(out)
-            except Exception:
-                a = {'chassisIp': chassis["ip"], 
-                     'mem_utilization': 0, 
-                     'cpu_utilization': 0, 
-                     'lastUpdatedAt_UTC': '03/15/2023, 03:31:47'}
-                perf_list_details.append(a)
-        write_data_to_database(
-            table_name="chassis_utilization_details", records=perf_list_details)
-        
-def delete_half_metric_records_weekly():
-    """This method will do periodic cleanup of inventord DB performance metrics data
+    poll_and_stream("perf")
+
+def _unreachable_portstats(chassis):
+    """Port counters have no placeholder value, nothing is written for this sample"""
+    return []
+
+
+@timed_chassis_poll("portstats", _unreachable_portstats)
+def _poll_chassis_portstats(chassis):
+    """Poll port counters for a single chassis"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    out = ixOSRestCaller.get_port_statistics(session, chassis["ip"])
+    return out
+
+
+@timed_category("portstats")
+def get_port_statistics_data():
+    """This is a call to RestAPI to get chassis port counters and rates
+    """
+    poll_and_stream("portstats")
+
+@timed_category("data_purge")
+def apply_metric_retention():
+    """This method will do periodic rollup and cleanup of inventory DB performance metrics and port counters data
     """
-    delte_half_data_from_performace_metric_table()
+    rollup_and_prune_utilization()
+    prune_port_stats()
+
+
+@timed_category("rollup")
+def apply_metric_rollup():
+    """Roll up the performance metrics polled since the last rollup, keeps the capacity report current
+    between two data purges"""
+    rollup_utilization()
+
+
+def poll_single_chassis(category, chassis):
+    """Poll one category of one chassis and replace only that chassis's rows in DB"""
+    poll_method, table_name = categoryToChassisPollMap[category]
+    out = poll_method(chassis)
+    if out is None:
+        # Poll failed or was skipped, the chassis's last known data is kept and shown as stale
+        mark_chassis_data_stale(chassis["ip"])
+        return
+    write_data_to_database(table_name=table_name, records=[out],
+                           ip_tags_dict={}, chassis_ip=chassis["ip"])
 
 
 def controller(category_of_poll=None):
@@ -204,29 +346,46 @@ categoryToFuntionMap = {"chassis": get_chassis_summary_data,
                         "licensing": get_chassis_licensing_data,
                         "sensors": get_sensor_information,
                         "perf": get_perf_metrics,
-                        "data_purge": delete_half_metric_records_weekly}
+                        "portstats": get_port_statistics_data,
+                        "data_purge": apply_metric_retention}
+
+# Per chassis poll method and the table its result is written to
+categoryToChassisPollMap = {"chassis": (_poll_chassis_summary, "chassis_summary_details"),
+                            "cards": (_poll_chassis_cards, "chassis_card_details"),
+                            "ports": (_poll_chassis_ports, "chassis_port_details"),
+                            "licensing": (_poll_chassis_licensing, "license_details_records"),
+                            "sensors": (_poll_chassis_sensors, "chassis_sensor_details"),
+                            "perf": (_poll_chassis_perf, "chassis_utilization_details"),
+                            "portstats": (_poll_chassis_portstats, "chassis_port_stats")}
 
 
 
 @click.command()
-@click.option('--category', default= "", help='What chassis aspect to poll. chassis, cards, ports, licensing')
+@click.option('--category', default= "", help='What chassis aspect to poll. chassis, cards, ports, licensing, sensors, perf, portstats, data_purge')
 @click.option('--interval', default= "", help='Interval between Polls')
-def start_poller(category, interval): 
+@click.option('--workers', default= MAX_POLL_WORKERS, help='Maximum number of chassis polled concurrently')
+def start_poller(category, interval, workers):
     """Since not all the parameters are modified with same interval, this way, we can specify exactly what we want to monitor at what interval
   Args:
         category (_type_): _description_
         interval (_type_): _description_
+        workers (_type_): _description_
     """
+    set_max_poll_workers(workers)
+    start_flusher()
     while True:
         poll_interval = read_poll_setting_from_database()
-        if poll_interval:
+        if poll_interval and poll_interval[category]:
             interval = poll_interval[category]
+        started = time.time()
         categoryToFuntionMap[category]()
-        
+
         # Data Purge would be in days
         if category == "data_purge":
 
             interval = int(interval) * 24 * 60 * 60
+        if time.time() - started > int(interval):
+            POLL_CYCLE_OVERRUNS.inc(category=category)
         time.sleep(int(interval))
 
 if __name__ == '__main__':
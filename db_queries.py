@@ -13,27 +13,29 @@ create_chassis_summary_sql = """CREATE TABLE IF NOT EXISTS chassis_summary_detai
                                 mem_bytes TEXT, 
                                 mem_bytes_total TEXT, 
                                 cpu_pert_usage TEXT,
-                                os TEXT
+                                os TEXT,
+                                rowHash TEXT
                                 );"""
                             
                                             
 create_card_details_records_sql = """CREATE TABLE IF NOT EXISTS chassis_card_details (
                                         'chassisIp' VARCHAR(255) NOT NULL,
                                         'typeOfChassis' TEXT,
-                                        'cardNumber' TEXT,
+                                        'cardNumber' INTEGER,
                                         'serialNumber' TEXT,
                                         'cardType' TEXT,
                                         'cardState' TEXT,
-                                        'numberOfPorts' TEXT, 
+                                        'numberOfPorts' INTEGER, 
                                         'tags' TEXT, 
-                                        'lastUpdatedAt_UTC' TEXT
+                                        'lastUpdatedAt_UTC' TEXT,
+                                        'rowHash' TEXT
                                         );"""
                                         
 create_port_details_records_sql = """CREATE TABLE IF NOT EXISTS chassis_port_details (
                                         'chassisIp' VARCHAR(255) NOT NULL,
                                         'typeOfChassis' TEXT,
-                                        'cardNumber' TEXT,
-                                        'portNumber' TEXT,
+                                        'cardNumber' INTEGER,
+                                        'portNumber' INTEGER,
                                         'phyMode' TEXT,
                                         'linkState' TEXT,
                                         'transceiverModel' TEXT,
@@ -41,11 +43,12 @@ create_port_details_records_sql = """CREATE TABLE IF NOT EXISTS chassis_port_det
                                         'owner' TEXT,
                                         'speed' TEXT, 
                                         'type' TEXT,
-                                        'totalPorts' TEXT,  
-                                        'ownedPorts' TEXT,
-                                        'freePorts' TEXT,
+                                        'totalPorts' INTEGER,  
+                                        'ownedPorts' INTEGER,
+                                        'freePorts' INTEGER,
                                         'transmitState' TEXT,
-                                        'lastUpdatedAt_UTC' TEXT
+                                        'lastUpdatedAt_UTC' TEXT,
+                                        'rowHash' TEXT
                                         );"""
                                         
 create_license_details_records_sql = """CREATE TABLE IF NOT EXISTS license_details_records (
@@ -59,7 +62,8 @@ create_license_details_records_sql = """CREATE TABLE IF NOT EXISTS license_detai
                                             'maintenanceDate' TEXT,
                                             'expiryDate' TEXT,
                                             'isExpired' TEXT,
-                                            'lastUpdatedAt_UTC' TEXT
+                                            'lastUpdatedAt_UTC' TEXT,
+                                            'rowHash' TEXT
                                             );"""
                                             
 
@@ -70,17 +74,72 @@ create_sensor_details_sql = """CREATE TABLE IF NOT EXISTS chassis_sensor_details
                                 sensorName TEXT,
                                 sensorValue TEXT,
                                 unit TEXT,
-                                lastUpdatedAt_UTC TEXT
+                                lastUpdatedAt_UTC TEXT,
+                                rowHash TEXT
                                 );"""
                                             
 create_usage_metrics = """CREATE TABLE IF NOT EXISTS chassis_utilization_details (
                                             chassisIp VARCHAR(255) NOT NULL,
-                                            mem_utilization TEXT, 
-                                            cpu_utilization TEXT,
-                                            lastUpdatedAt_UTC TEXT
+                                            mem_utilization REAL, 
+                                            cpu_utilization REAL,
+                                            lastUpdatedAt_UTC TEXT,
+                                            sampledAt INTEGER
                                             );"""
                                             
 
+create_usage_metrics_5min = """CREATE TABLE IF NOT EXISTS chassis_utilization_5min (
+                                            chassisIp VARCHAR(255) NOT NULL,
+                                            bucketStart INTEGER NOT NULL,
+                                            samples INTEGER,
+                                            mem_min REAL,
+                                            mem_avg REAL,
+                                            mem_max REAL,
+                                            cpu_min REAL,
+                                            cpu_avg REAL,
+                                            cpu_max REAL,
+                                            PRIMARY KEY (chassisIp, bucketStart)
+                                            );"""
+
+create_usage_metrics_hourly = """CREATE TABLE IF NOT EXISTS chassis_utilization_hourly (
+                                            chassisIp VARCHAR(255) NOT NULL,
+                                            bucketStart INTEGER NOT NULL,
+                                            samples INTEGER,
+                                            mem_min REAL,
+                                            mem_avg REAL,
+                                            mem_max REAL,
+                                            cpu_min REAL,
+                                            cpu_avg REAL,
+                                            cpu_max REAL,
+                                            PRIMARY KEY (chassisIp, bucketStart)
+                                            );"""
+
+# Raw samples of complete 5 minute buckets starting at or after :since
+rollup_usage_metrics_5min_sql = """INSERT INTO chassis_utilization_5min
+                                   SELECT chassisIp, (sampledAt / 300) * 300, COUNT(*),
+                                          MIN(mem_utilization), AVG(mem_utilization), MAX(mem_utilization),
+                                          MIN(cpu_utilization), AVG(cpu_utilization), MAX(cpu_utilization)
+                                   FROM chassis_utilization_details
+                                   WHERE sampledAt >= :since AND sampledAt < :until
+                                   GROUP BY chassisIp, (sampledAt / 300) * 300
+                                   ON CONFLICT (chassisIp, bucketStart) DO UPDATE SET
+                                   samples = excluded.samples,
+                                   mem_min = excluded.mem_min, mem_avg = excluded.mem_avg, mem_max = excluded.mem_max,
+                                   cpu_min = excluded.cpu_min, cpu_avg = excluded.cpu_avg, cpu_max = excluded.cpu_max;"""
+
+# 5 minute buckets of complete hours starting at or after :since, averages weighted by sample count
+rollup_usage_metrics_hourly_sql = """INSERT INTO chassis_utilization_hourly
+                                     SELECT chassisIp, (bucketStart / 3600) * 3600, SUM(samples),
+                                            MIN(mem_min), SUM(mem_avg * samples) / SUM(samples), MAX(mem_max),
+                                            MIN(cpu_min), SUM(cpu_avg * samples) / SUM(samples), MAX(cpu_max)
+                                     FROM chassis_utilization_5min
+                                     WHERE bucketStart >= :since AND bucketStart < :until
+                                     GROUP BY chassisIp, (bucketStart / 3600) * 3600
+                                     ON CONFLICT (chassisIp, bucketStart) DO UPDATE SET
+                                     samples = excluded.samples,
+                                     mem_min = excluded.mem_min, mem_avg = excluded.mem_avg, mem_max = excluded.mem_max,
+                                     cpu_min = excluded.cpu_min, cpu_avg = excluded.cpu_avg, cpu_max = excluded.cpu_max;"""
+
+
 create_ip_tags_sql = """CREATE TABLE IF NOT EXISTS user_ip_tags (
                                 ip VARCHAR(255) NOT NULL,
                                 tags TEXT
@@ -110,5 +169,178 @@ create_poll_settings_table = """CREATE TABLE IF NOT EXISTS poll_setting (
                                 perf INTEGER,
                                 licensing INTEGER,
                                 data_purge INTEGER,
-                                alertMonitor INTEGER
-                                );"""
\ No newline at end of file
+                                alertMonitor INTEGER,
+                                portstats INTEGER
+                                );"""
+
+# Port counters sampled every few seconds, rates are computed from the previous sample of the port when written.
+# The key starts with (chassisIp, ts) so retention and history reads of a chassis are range scans
+create_port_stats_table = """CREATE TABLE IF NOT EXISTS chassis_port_stats (
+                                chassisIp TEXT NOT NULL,
+                                ts INTEGER NOT NULL,
+                                cardNumber INTEGER NOT NULL,
+                                portNumber INTEGER NOT NULL,
+                                txFrames INTEGER,
+                                rxFrames INTEGER,
+                                txBytes INTEGER,
+                                rxBytes INTEGER,
+                                fcsErrors INTEGER,
+                                txFrameRate REAL,
+                                rxFrameRate REAL,
+                                txBitRate REAL,
+                                rxBitRate REAL,
+                                fcsErrorRate REAL,
+                                PRIMARY KEY (chassisIp, ts, cardNumber, portNumber)
+                                ) WITHOUT ROWID;"""
+
+# Attributes of a chassis that almost never change, dropped when serialNumber or ixosVersion change
+create_chassis_facts_table = """CREATE TABLE IF NOT EXISTS chassis_facts (
+                                ip TEXT PRIMARY KEY,
+                                serialNumber TEXT,
+                                ixosVersion TEXT,
+                                os TEXT,
+                                chassisType TEXT,
+                                hostId TEXT,
+                                expiresAt INTEGER
+                                );"""
+
+# State of background jobs started from the web UI, readable from every web worker and after a restart
+create_background_jobs_table = """CREATE TABLE IF NOT EXISTS background_jobs (
+                                id TEXT PRIMARY KEY,
+                                kind TEXT,
+                                status TEXT,
+                                details TEXT,
+                                submittedAt REAL,
+                                startedAt REAL,
+                                finishedAt REAL,
+                                result TEXT,
+                                error TEXT
+                                );"""
+
+# Jobs still queued or running when the web process stopped will never finish
+fail_interrupted_jobs_sql = """UPDATE background_jobs
+                               SET status = 'FAILED', error = 'Interrupted by a restart', finishedAt = strftime('%s', 'now')
+                               WHERE status IN ('QUEUED', 'RUNNING');"""
+
+# Time of the last successful poll written for every chassis of an inventory table. lastUpdatedAt_UTC
+# of the rows is when their content last changed, unchanged rows are not rewritten by a poll
+create_last_poll_times_table = """CREATE TABLE IF NOT EXISTS last_poll_times (
+                                tableName TEXT NOT NULL,
+                                chassisIp TEXT NOT NULL,
+                                lastPolledAt TEXT NOT NULL,
+                                PRIMARY KEY (tableName, chassisIp)
+                                ) WITHOUT ROWID;"""
+
+# Dashboard counters kept up to date by write_data_to_database: the groups of every chassis, so a
+# rewritten chassis can be recounted alone, and their fleet wide totals the summary view reads
+create_fleet_summary_by_chassis_table = """CREATE TABLE IF NOT EXISTS fleet_summary_by_chassis (
+                                chassisIp TEXT NOT NULL,
+                                metric TEXT NOT NULL,
+                                groupValue TEXT NOT NULL,
+                                count INTEGER NOT NULL,
+                                PRIMARY KEY (chassisIp, metric, groupValue)
+                                ) WITHOUT ROWID;"""
+
+create_fleet_summary_table = """CREATE TABLE IF NOT EXISTS fleet_summary (
+                                metric TEXT NOT NULL,
+                                groupValue TEXT NOT NULL,
+                                count INTEGER NOT NULL,
+                                PRIMARY KEY (metric, groupValue)
+                                ) WITHOUT ROWID;"""
+
+# Counters of the fleet summary: table -> (chassis column, column whose 'NA' marks an unreachable
+# chassis placeholder row, {metric: SQL expression of the group a row is counted in, NULL to skip it})
+fleet_summary_metrics = {"chassis_summary_details": ("ip", None,
+                                                     {"chassis": "'all'",
+                                                      "chassisStatus": "status_status",
+                                                      "chassisType": "type_of_chassis",
+                                                      "ixosVersion": "ixOS"}),
+                         "chassis_card_details": ("chassisIp", "cardNumber",
+                                                  {"cards": "'all'",
+                                                   "cardType": "cardType",
+                                                   "cardState": "cardState"}),
+                         "chassis_port_details": ("chassisIp", "cardNumber",
+                                                  {"ports": "CASE WHEN owner = 'Free' THEN 'free' ELSE 'owned' END",
+                                                   "freePortsBySpeed": "CASE WHEN owner = 'Free' THEN speed END",
+                                                   "linkState": "linkState"}),
+                         "license_details_records": ("chassisIp", "activationCode",
+                                                     {"licenseExpiryDate": "expiryDate",
+                                                      "licenseExpired": "isExpired"})}
+
+# Global inventory search: one document per chassis, card, port, license and tag row, indexed by the
+# FTS5 table search_index that reads its text from search_documents (external content)
+create_search_documents_table = """CREATE TABLE IF NOT EXISTS search_documents (
+                                id INTEGER PRIMARY KEY,
+                                kind TEXT NOT NULL,
+                                sourceKey TEXT NOT NULL,
+                                rowKey TEXT,
+                                label TEXT,
+                                body TEXT
+                                );"""
+
+create_search_index_table = """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                                label, body, content='search_documents', content_rowid='id'
+                                );"""
+
+# Documents of the search index: table -> (kind, column of the chassis or card the documents belong to, column
+# whose 'NA' marks an unreachable chassis placeholder row, SQL expression of the label, columns of the body).
+# A document is refreshed by the key of its row, POLLED_TABLE_KEYS of polled tables and the column above otherwise
+search_documents = {"chassis_summary_details": ("chassis", "ip", None, "ip",
+                                                ["chassisSN", "controllerSN", "type_of_chassis", "status_status",
+                                                 "ixOS", "os", "tags"]),
+                    "chassis_card_details": ("card", "chassisIp", "cardNumber", "chassisIp || ' card ' || cardNumber",
+                                             ["serialNumber", "cardType", "cardState", "typeOfChassis", "tags"]),
+                    "chassis_port_details": ("port", "chassisIp", "cardNumber",
+                                             "chassisIp || ' port ' || cardNumber || '/' || portNumber",
+                                             ["owner", "transceiverModel", "transceiverManufacturer", "phyMode",
+                                              "speed", "type", "linkState"]),
+                    "license_details_records": ("license", "chassisIp", "activationCode",
+                                                "chassisIp || ' license ' || partNumber",
+                                                ["hostId", "partNumber", "activationCode", "description", "expiryDate"]),
+                    "user_ip_tags": ("chassisTag", "ip", None, "ip", ["tags"]),
+                    "user_card_tags": ("cardTag", "serialNumber", None, "'card ' || serialNumber", ["tags"])}
+
+# Columns added after the first release, added to existing inventory.db files by init_db
+added_columns = {"chassis_summary_details": [("rowHash", "TEXT")],
+                 "chassis_card_details": [("rowHash", "TEXT")],
+                 "chassis_port_details": [("rowHash", "TEXT")],
+                 "license_details_records": [("rowHash", "TEXT")],
+                 "chassis_sensor_details": [("rowHash", "TEXT")],
+                 "chassis_utilization_details": [("sampledAt", "INTEGER")],
+                 "poll_setting": [("portstats", "INTEGER")],
+                 "search_documents": [("rowKey", "TEXT")]}
+
+# Tables whose column types changed after the first release, rebuilt by init_db
+retyped_tables = {"chassis_card_details": create_card_details_records_sql,
+                  "chassis_port_details": create_port_details_records_sql,
+                  "chassis_utilization_details": create_usage_metrics}
+
+# lastUpdatedAt_UTC of utilization samples is "%m/%d/%Y, %H:%M:%S" which does not sort, sampledAt is its epoch
+backfill_sampled_at_sql = """UPDATE chassis_utilization_details
+                             SET sampledAt = CAST(strftime('%s', substr(lastUpdatedAt_UTC, 7, 4) || '-' ||
+                                                                 substr(lastUpdatedAt_UTC, 1, 2) || '-' ||
+                                                                 substr(lastUpdatedAt_UTC, 4, 2) || ' ' ||
+                                                                 substr(lastUpdatedAt_UTC, 13, 8)) AS INTEGER)
+                             WHERE sampledAt IS NULL;"""
+
+# Indexes replaced by a wider one in create_indexes_sql, dropped from existing inventory.db files by init_db
+dropped_indexes = ["idx_search_documents_source"]
+
+create_indexes_sql = ["CREATE INDEX IF NOT EXISTS idx_chassis_summary_ip ON chassis_summary_details (ip);",
+                      "CREATE INDEX IF NOT EXISTS idx_card_chassis ON chassis_card_details (chassisIp, cardNumber);",
+                      "CREATE INDEX IF NOT EXISTS idx_card_serial ON chassis_card_details (serialNumber);",
+                      "CREATE INDEX IF NOT EXISTS idx_port_chassis ON chassis_port_details (chassisIp, cardNumber, portNumber);",
+                      "CREATE INDEX IF NOT EXISTS idx_license_chassis ON license_details_records (chassisIp);",
+                      "CREATE INDEX IF NOT EXISTS idx_sensor_chassis ON chassis_sensor_details (chassisIp);",
+                      "CREATE INDEX IF NOT EXISTS idx_utilization_chassis_time ON chassis_utilization_details (chassisIp, sampledAt);",
+                      "CREATE INDEX IF NOT EXISTS idx_utilization_time ON chassis_utilization_details (sampledAt);",
+                      "CREATE INDEX IF NOT EXISTS idx_utilization_5min_time ON chassis_utilization_5min (bucketStart);",
+                      "CREATE INDEX IF NOT EXISTS idx_utilization_hourly_time ON chassis_utilization_hourly (bucketStart);",
+                      "CREATE INDEX IF NOT EXISTS idx_ip_tags_ip ON user_ip_tags (ip);",
+                      "CREATE INDEX IF NOT EXISTS idx_card_tags_serial ON user_card_tags (serialNumber);",
+                      "CREATE INDEX IF NOT EXISTS idx_background_jobs_finished ON background_jobs (finishedAt);",
+                      "CREATE INDEX IF NOT EXISTS idx_port_stats_time ON chassis_port_stats (ts);",
+                      # The rowKey of a document starts with its sourceKey, one index finds documents by either
+                      "CREATE INDEX IF NOT EXISTS idx_search_documents_row ON search_documents (kind, sourceKey, rowKey);",
+                      # Free port finder: filters first, then the locality columns so the index covers the query
+                      "CREATE INDEX IF NOT EXISTS idx_port_free ON chassis_port_details (owner, speed, phyMode, linkState, chassisIp, cardNumber, portNumber);"]
@@ -0,0 +1,110 @@
+"""Fleet wide capacity analytics over the port, card and utilization tables.
+
+Each table is read once into a pandas frame and every aggregate of the report
+is a vectorized group-by over it, so the report stays fast with hundreds of
+thousands of ports instead of scanning per row in Python.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from sqlite3_utilities import read_columns_from_database
+
+PORT_COLUMNS = ["chassisIp", "cardNumber", "portNumber", "owner", "speed", "phyMode", "linkState", "transceiverModel"]
+CARD_COLUMNS = ["chassisIp", "cardNumber", "cardType"]
+UTILIZATION_COLUMNS = ["bucketStart", "mem_avg", "cpu_avg"]
+
+
+def load_ports():
+    """Ports of every reachable chassis, placeholder rows of unreachable chassis excluded"""
+    ports = pd.DataFrame.from_records(read_columns_from_database("chassis_port_details", PORT_COLUMNS,
+                                                                 "WHERE cardNumber IS NOT 'NA'"),
+                                      columns=PORT_COLUMNS)
+    ports["free"] = ports["owner"].isin(["Free", ""]) | ports["owner"].isna()
+    return ports
+
+
+def load_cards():
+    return pd.DataFrame.from_records(read_columns_from_database("chassis_card_details", CARD_COLUMNS,
+                                                                "WHERE cardNumber IS NOT 'NA'"),
+                                     columns=CARD_COLUMNS)
+
+
+def load_hourly_utilization(since):
+    return pd.DataFrame.from_records(read_columns_from_database("chassis_utilization_hourly", UTILIZATION_COLUMNS,
+                                                                "WHERE bucketStart >= ?", (since,)),
+                                     columns=UTILIZATION_COLUMNS)
+
+
+def _records(frame):
+    """JSON friendly list of dicts, NaN becomes None"""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def free_ports_by(ports, column):
+    """Total, owned and free ports for every value of column, most free first"""
+    grouped = ports.groupby(ports[column].fillna("NA"), sort=False)["free"].agg(["size", "sum"])
+    grouped.columns = ["total", "free"]
+    grouped["owned"] = grouped["total"] - grouped["free"]
+    grouped["freeShare"] = (grouped["free"] / grouped["total"]).round(4)
+    grouped = grouped.sort_values(["free", "total"], ascending=False).reset_index().rename(columns={column: "value"})
+    return _records(grouped[["value", "total", "owned", "free", "freeShare"]])
+
+
+def owner_share(ports, top=20):
+    """Ports held by each owner and their share of all ports, largest first"""
+    owned = ports.loc[~ports["free"], "owner"].value_counts()
+    shares = pd.DataFrame({"owner": owned.index, "ports": owned.values,
+                           "share": (owned.values / max(len(ports), 1)).round(4)})
+    return _records(shares.head(top))
+
+
+def card_type_utilization(ports, cards):
+    """Cards, ports and share of owned ports for every card type"""
+    if ports.empty or cards.empty:
+        return []
+    merged = ports.merge(cards, on=["chassisIp", "cardNumber"], how="left")
+    merged["cardType"] = merged["cardType"].fillna("NA")
+    grouped = merged.groupby("cardType").agg(ports=("free", "size"), free=("free", "sum"))
+    grouped["cards"] = cards.groupby(cards["cardType"].fillna("NA")).size()
+    grouped["owned"] = grouped["ports"] - grouped["free"]
+    grouped["utilization"] = (grouped["owned"] / grouped["ports"]).round(4)
+    grouped = grouped.fillna(0).sort_values("utilization", ascending=False).reset_index()
+    return _records(grouped[["cardType", "cards", "ports", "owned", "free", "utilization"]])
+
+
+def peak_hours(utilization):
+    """Fleet average CPU and memory utilization per UTC hour of day, with the busiest hour"""
+    if utilization.empty:
+        return {"byHour": [], "peakHour": None}
+    hours = (utilization["bucketStart"].to_numpy() // 3600) % 24
+    by_hour = utilization[["cpu_avg", "mem_avg"]].groupby(hours).mean().round(2)
+    by_hour.index.name = "hour"
+    peak_hour = int(by_hour["cpu_avg"].idxmax()) if by_hour["cpu_avg"].notna().any() else None
+    return {"byHour": _records(by_hour.reset_index()), "peakHour": peak_hour}
+
+
+def capacity_report(days=7, top_owners=20):
+    """Fleet capacity report: port totals, free ports by speed, phyMode and transceiver,
+    owner share, per card type utilization and peak hours over the last days"""
+    started = time.perf_counter()
+    ports = load_ports()
+    cards = load_cards()
+    utilization = load_hourly_utilization(int(time.time()) - days * 86400)
+
+    free = int(ports["free"].sum())
+    report = {"ports": {"total": len(ports),
+                        "owned": len(ports) - free,
+                        "free": free,
+                        "linkUp": int(np.count_nonzero(ports["linkState"].to_numpy() == "UP")),
+                        "chassis": int(ports["chassisIp"].nunique())},
+              "freePortsBySpeed": free_ports_by(ports, "speed"),
+              "freePortsByPhyMode": free_ports_by(ports, "phyMode"),
+              "freePortsByTransceiver": free_ports_by(ports, "transceiverModel"),
+              "ownerShare": owner_share(ports, top_owners),
+              "cardTypeUtilization": card_type_utilization(ports, cards),
+              "peakHours": dict(peak_hours(utilization), days=days)}
+    report["generatedInSeconds"] = round(time.perf_counter() - started, 4)
+    return report
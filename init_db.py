@@ -14,6 +14,7 @@ chassis_memory_utilization
 import sqlite3
 from sqlite3 import Error
 import db_queries
+from sqlite3_utilities import rebuild_fleet_summary, rebuild_search_index
 
 
 def create_connection(db_file):
@@ -25,6 +26,8 @@ def create_connection(db_file):
     conn = None
     try:
         conn = sqlite3.connect(db_file)
+        # Persistent for the database file, lets the web app read while pollers write
+        conn.execute("PRAGMA journal_mode=WAL")
         return conn
     except Error as e:
         print(e)
@@ -41,7 +44,9 @@ def delete_table(conn):
             "DROP TABLE IF EXISTS license_details_records",
             "DROP TABLE IF EXISTS user_db",
             "DROP TABLE IF EXISTS poll_setting",
-            "DROP TABLE IF EXISTS chassis_utilization_details"]
+            "DROP TABLE IF EXISTS chassis_utilization_details",
+            "DROP TABLE IF EXISTS chassis_utilization_5min",
+            "DROP TABLE IF EXISTS chassis_utilization_hourly"]
     try:
         c = conn.cursor()
         for cmd in cmds:
@@ -63,6 +68,82 @@ def create_table(conn, create_table_sql):
         print(e)
 
 
+def add_missing_columns(conn):
+    """ add columns introduced by newer versions to tables of an existing database
+    :param conn: Connection object
+    :return:
+    """
+    try:
+        c = conn.cursor()
+        for table_name, columns in db_queries.added_columns.items():
+            existing_columns = [row[1] for row in c.execute(f"PRAGMA table_info({table_name})")]
+            for column_name, column_type in columns:
+                if column_name not in existing_columns:
+                    c.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+        conn.commit()
+    except Error as e:
+        print(e)
+
+
+def migrate_column_types(conn, table_name, create_table_sql):
+    """ rebuild table_name with the column types of create_table_sql if they differ,
+    SQLite cannot change the type of an existing column
+    :param conn: Connection object
+    :param table_name: table to migrate
+    :param create_table_sql: the current CREATE TABLE statement of table_name
+    :return:
+    """
+    migrated_table = f"{table_name}_migrated"
+    try:
+        c = conn.cursor()
+        current_types = {row[1]: row[2] for row in c.execute(f"PRAGMA table_info({table_name})")}
+        c.execute(f"DROP TABLE IF EXISTS {migrated_table}")
+        c.execute(create_table_sql.replace(table_name, migrated_table, 1))
+        wanted_types = {row[1]: row[2] for row in c.execute(f"PRAGMA table_info({migrated_table})")}
+        if all(current_types.get(column) == column_type for column, column_type in wanted_types.items()):
+            c.execute(f"DROP TABLE {migrated_table}")
+        else:
+            # Column affinity converts the copied TEXT values, e.g. '42.5' into REAL 42.5
+            columns = ", ".join(column for column in wanted_types if column in current_types)
+            c.execute(f"INSERT INTO {migrated_table} ({columns}) SELECT {columns} FROM {table_name}")
+            c.execute(f"DROP TABLE {table_name}")
+            c.execute(f"ALTER TABLE {migrated_table} RENAME TO {table_name}")
+        conn.commit()
+    except Error as e:
+        conn.rollback()
+        print(e)
+
+
+def create_indexes(conn):
+    """ create the indexes of the lookup paths
+    :param conn: Connection object
+    :return:
+    """
+    try:
+        c = conn.cursor()
+        c.execute(db_queries.backfill_sampled_at_sql)
+        for index_name in db_queries.dropped_indexes:
+            c.execute(f"DROP INDEX IF EXISTS {index_name}")
+        for create_index_sql in db_queries.create_indexes_sql:
+            c.execute(create_index_sql)
+        conn.commit()
+    except Error as e:
+        print(e)
+
+
+def fail_interrupted_jobs(conn):
+    """ mark background jobs left queued or running by a previous web process as failed
+    :param conn: Connection object
+    :return:
+    """
+    try:
+        c = conn.cursor()
+        c.execute(db_queries.fail_interrupted_jobs_sql)
+        conn.commit()
+    except Error as e:
+        print(e)
+
+
 def create_data_tables():
     database = "inventory.db"            
     # create a database connection
@@ -84,6 +165,26 @@ def create_data_tables():
         create_table(conn, db_queries.create_ip_tags_sql)
         create_table(conn, db_queries.create_card_tags_sql)
         create_table(conn, db_queries.create_usage_metrics)
+        create_table(conn, db_queries.create_usage_metrics_5min)
+        create_table(conn, db_queries.create_usage_metrics_hourly)
         create_table(conn, db_queries.create_poll_settings_table)
+        create_table(conn, db_queries.create_background_jobs_table)
+        create_table(conn, db_queries.create_chassis_facts_table)
+        create_table(conn, db_queries.create_port_stats_table)
+        create_table(conn, db_queries.create_last_poll_times_table)
+        create_table(conn, db_queries.create_fleet_summary_by_chassis_table)
+        create_table(conn, db_queries.create_fleet_summary_table)
+        create_table(conn, db_queries.create_search_documents_table)
+        create_table(conn, db_queries.create_search_index_table)
+
+        add_missing_columns(conn)
+        for table_name, create_table_sql in db_queries.retyped_tables.items():
+            migrate_column_types(conn, table_name, create_table_sql)
+        create_indexes(conn)
+        fail_interrupted_jobs(conn)
+        conn.close()
+        # Counters of a database written before the fleet summary existed, or edited by hand
+        rebuild_fleet_summary()
+        rebuild_search_index()
 
 create_data_tables()
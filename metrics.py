@@ -0,0 +1,243 @@
+"""Prometheus style counters and latency histograms for the poller and the web app.
+
+Every process records into its own in-memory registry. The poller processes
+(poll scheduler, data_poller.py) call start_flusher to write a snapshot of it
+to METRICS_DIR every few seconds. render_metrics sums the snapshots of all
+processes with the live registry of the calling process, so the /metrics
+endpoint of the web app also shows what the pollers are doing. Other processes
+importing this module, e.g. tests and benchmarks, write nothing.
+"""
+
+import atexit
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("IIE_METRICS_DIR", os.path.join(tempfile.gettempdir(), "iie-metrics"))
+# Seconds between two snapshots of a process's metrics
+FLUSH_INTERVAL = int(os.environ.get("IIE_METRICS_FLUSH_INTERVAL", "5"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_flusher = None
+
+
+class _Metric(object):
+    """Samples of one metric name keyed by label values"""
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._samples = {}
+        with _registry_lock:
+            _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def snapshot(self):
+        """JSON serialisable copy of the metric"""
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._samples.items()]
+        return {"type": self.type_name, "help": self.documentation,
+                "labelnames": list(self.labelnames), "samples": samples}
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """Latency histogram, bucket counts are stored per bucket and rendered cumulative"""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            sample["buckets"][index] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall clock time of the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        snapshot = super(Histogram, self).snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def collect():
+    """Snapshot of every metric registered in this process"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def flush():
+    """Write this process's snapshot for the other processes to aggregate"""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = _snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as snapshot_file:
+            json.dump(collect(), snapshot_file)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Failed to write metrics snapshot: {e}")
+
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def start_flusher():
+    """Start writing this process's snapshot to METRICS_DIR in the background and on exit"""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _registry_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+
+
+def _merge(merged, snapshot):
+    """Add the samples of snapshot into merged, both keyed by metric name"""
+    for name, metric in snapshot.items():
+        target = merged.setdefault(name, dict(metric, samples={}))
+        for labels, value in metric["samples"]:
+            key = tuple(labels)
+            current = target["samples"].get(key)
+            if current is None:
+                target["samples"][key] = json.loads(json.dumps(value)) if isinstance(value, dict) else value
+            elif isinstance(value, dict):
+                current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                current["sum"] += value["sum"]
+                current["count"] += value["count"]
+            else:
+                target["samples"][key] = current + value
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Prometheus text exposition of the metrics of every process sharing METRICS_DIR"""
+    merged = {}
+    own_snapshot = _snapshot_path(os.getpid())
+    if os.path.isdir(METRICS_DIR):
+        for file_name in sorted(os.listdir(METRICS_DIR)):
+            path = os.path.join(METRICS_DIR, file_name)
+            if not file_name.endswith(".json") or path == own_snapshot:
+                continue
+            try:
+                with open(path) as snapshot_file:
+                    _merge(merged, json.load(snapshot_file))
+            except (OSError, ValueError):
+                continue
+    _merge(merged, collect())
+
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        labelnames = metric["labelnames"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for values, value in sorted(metric["samples"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], value["buckets"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, values)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_of(uri):
+    """REST path of uri without scheme, chassis address and numeric ids, a low cardinality label"""
+    path = re.sub(r"^https?://[^/]+", "", uri).split("?")[0]
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+# Chassis REST calls
+HTTP_REQUEST_SECONDS = Histogram("iie_chassis_http_request_seconds",
+                                 "Latency of IxOS REST calls", ("chassis", "method", "endpoint"))
+HTTP_REQUEST_ERRORS = Counter("iie_chassis_http_request_errors_total",
+                              "Failed IxOS REST calls by reason (timeout, connection, 4xx, 5xx)",
+                              ("chassis", "endpoint", "reason"))
+
+# Polling
+POLL_CATEGORY_SECONDS = Histogram("iie_poll_category_seconds",
+                                  "Duration of a fleet wide poll of one category", ("category",))
+POLL_CATEGORY_ERRORS = Counter("iie_poll_category_errors_total",
+                               "Fleet wide polls of one category that raised", ("category",))
+POLL_CHASSIS_SECONDS = Histogram("iie_poll_chassis_seconds",
+                                 "Duration of polling one category of one chassis", ("category", "chassis"))
+POLL_CHASSIS_RESULTS = Counter("iie_poll_chassis_total",
+                               "Polls of one category of one chassis by outcome (ok, unreachable, error)",
+                               ("category", "chassis", "outcome"))
+POLL_CYCLE_OVERRUNS = Counter("iie_poll_cycle_overruns_total",
+                              "Polls that took longer than the poll interval of their category", ("category",))
+
+# Database
+DB_WRITE_SECONDS = Histogram("iie_db_write_seconds",
+                             "Duration of write_data_to_database", ("table",))
+DB_ROWS_WRITTEN = Counter("iie_db_rows_written_total",
+                          "Rows changed by write_data_to_database by operation (insert, update, delete)",
+                          ("table", "operation"))
+
+# Web app
+WEB_REQUEST_SECONDS = Histogram("iie_web_request_seconds",
+                                "Latency of Flask routes", ("route", "method", "status"))
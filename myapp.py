@@ -1,10 +1,16 @@
 import json
-from flask import render_template, request, jsonify, redirect
+import time
+import uuid
+from flask import render_template, request, jsonify, redirect, Response
 from app import create_app
 
-from  RestApi.IxOSRestInterface import IxRestSession
-from sqlite3_utilities import get_perf_metrics_from_db, read_username_password_from_database, read_data_from_database,read_tags, write_tags, is_input_in_correct_format, write_username_password_to_database, write_polling_intervals_into_database
-from data_poller import controller
+from  RestApi.IxOSRestInterface import get_cached_session
+from sqlite3_utilities import get_perf_metrics_from_db, get_perf_metrics_range_from_db, get_port_stats_from_db, read_username_password_from_database, read_data_from_database, read_table_page_from_database, read_last_poll_from_database, read_fleet_summary_from_database, read_stale_chassis_from_database, search_inventory, find_free_port_sets, claim_free_ports_in_database, release_claimed_ports_in_database, read_tags, write_tags, is_input_in_correct_format, write_username_password_to_database, write_polling_intervals_into_database
+from data_poller import controller, poll_single_chassis
+from IxOSRestAPICaller import take_ports_ownership, release_ports_ownership
+from background_jobs import job_queue, operation_queue
+from metrics import render_metrics
+from fleet_analytics import capacity_report
 
 
 
@@ -36,7 +42,8 @@ def set_polling_intervals():
     licensing = request.form['licensing']
     perf = request.form['perf']
     data_purge = request.form['purge']
-    write_polling_intervals_into_database(chassis, cards, ports, sensors, licensing, perf, data_purge)
+    portstats = request.form.get('portstats')
+    write_polling_intervals_into_database(chassis, cards, ports, sensors, licensing, perf, data_purge, portstats)
     return redirect('/')
     
 @app.get('/')
@@ -67,27 +74,40 @@ def chassis_summary_details():
             "cpu_pert_usage": record["cpu_pert_usage"],
             "os": record["os"]})
     return render_template("chassisDetails.html", headers=headers, rows = list_of_chassis, 
-                           ip_tags_dict=ip_tags_dict)
+                           ip_tags_dict=ip_tags_dict, summary=read_fleet_summary_from_database(),
+                           last_updated=read_last_poll_from_database("chassis_summary_details"))
+
+
+@app.get("/fleetSummary")
+def fleet_summary():
+    """Flask method to get the fleet dashboard counters as JSON"""
+    return jsonify(read_fleet_summary_from_database())
 
     
+# Server side DataTables of the inventory pages: table, columns in display order, extra columns
+# sent along for row styling and the column whose 'NA' marks an unreachable chassis placeholder row
+serverSideTables = {"cardDetails": ("chassis_card_details",
+                                    ["chassisIp", "typeOfChassis", "cardNumber", "serialNumber", "cardType", "numberOfPorts"],
+                                    ["cardState"], "cardState"),
+                    "portDetails": ("chassis_port_details",
+                                    ["chassisIp", "typeOfChassis", "cardNumber", "portNumber", "linkState", "transmitState",
+                                     "phyMode", "transceiverModel", "transceiverManufacturer", "type", "speed", "owner"],
+                                    [], "cardNumber"),
+                    "licenseDetails": ("license_details_records",
+                                       ["chassisIp", "typeOfChassis", "hostId", "partNumber", "activationCode",
+                                        "quantity", "description", "maintenanceDate", "expiryDate"],
+                                       ["isExpired"], "activationCode"),
+                    "sensorInformation": ("chassis_sensor_details",
+                                          ["chassisIp", "typeOfChassis", "sensorType", "sensorName", "sensorValue", "unit"],
+                                          [], "sensorValue")}
+
+
 @app.get("/cardDetails")
 def chassis_card_details():
     """Flask method to get Chassis Card Details"""
-    list_of_cards = []
     headers = ["chassisIP", "ChassisType", "cardNumber", "serialNumber", "cardType", "numberOfPorts"]
-    ip_tags_dict = read_tags(type_of_update="card")
-    records = read_data_from_database(table_name="chassis_card_details")
-    for record in records:
-        list_of_cards.append([{"chassisIp": record["chassisIp"], 
-                "chassisType": record["typeOfChassis"],
-                "cardNumber": record["cardNumber"],
-                "serialNumber": record["serialNumber"],
-                "cardType": record["cardType"],
-                "cardState": record["cardState"],
-                "numberOfPorts": record["numberOfPorts"],
-                "lastUpdatedAt_UTC": record["lastUpdatedAt_UTC"]}])
-  
-    return render_template("chassisCardsDetails.html", headers=headers, rows = list_of_cards, ip_tags_dict=ip_tags_dict)
+    return render_template("chassisCardsDetails.html", headers=headers,
+                           last_updated=read_last_poll_from_database("chassis_card_details"))
 
 
 @app.get("/licenseDetails")
@@ -95,22 +115,8 @@ def chassis_license_details():
     """Flask method to get Chassis Licensing Details"""
     headers = ["chassisIP", "chassisType", "hostID", "partNumber", "activationCode", 
                "quantity", "description", "maintenanceDate", "expiryDate"]
-    list_of_licenses= []
-    records = read_data_from_database(table_name="license_details_records")
-    for record in records:
-        list_of_licenses.append([{"chassisIp": record["chassisIp"], 
-                "typeOfChassis": record["typeOfChassis"],
-                "hostId": record["hostId"],
-                "partNumber": record["partNumber"],
-                "activationCode": record["activationCode"],
-                "quantity": record["quantity"],
-                "description": record["description"],
-                "maintenanceDate": record["maintenanceDate"],
-                "expiryDate":record["expiryDate"],
-                "isExpired": record["isExpired"],
-                "lastUpdatedAt_UTC": record["lastUpdatedAt_UTC"]}])        
-    return render_template("chassisLicenseDetails.html", headers=headers, 
-                           rows = list_of_licenses)
+    return render_template("chassisLicenseDetails.html", headers=headers,
+                           last_updated=read_last_poll_from_database("license_details_records"))
 
 
 @app.get("/portDetails")
@@ -119,44 +125,54 @@ def get_chassis_ports_information():
     headers = ["chassisIp", "typeOfChassis",
                "cardNumber", "portNumber", "linkState", "isRunningTraffic", "phyMode", "transceiverModel", 
                "transceiverManufacturer","type", "speed", "owner"]
-    port_list_details = []
-
-    records = read_data_from_database(table_name="chassis_port_details")
-    for record in records:
-        port_list_details.append([{"chassisIp": record["chassisIp"], 
-                "typeOfChassis": record["typeOfChassis"],
-                "cardNumber": record["cardNumber"],
-                "portNumber": record["portNumber"],
-                "linkState": record["linkState"],
-                "phyMode": record["phyMode"],
-                "transceiverModel": record["transceiverModel"],
-                "transceiverManufacturer": record["transceiverManufacturer"],
-                "owner": record["owner"],
-                "speed": record["speed"],
-                "type": record["type"],
-                "totalPorts":record["totalPorts"],
-                "ownedPorts": record["ownedPorts"],
-                "freePorts": record["freePorts"],
-                "transmitState": record["transmitState"],
-                "lastUpdatedAt_UTC": record["lastUpdatedAt_UTC"]}])
-    return render_template("chassisPortDetails.html", headers=headers, rows = port_list_details)
+    return render_template("chassisPortDetails.html", headers=headers,
+                           last_updated=read_last_poll_from_database("chassis_port_details"))
 
 
 @app.get("/sensorInformation")
 def get_chassis_sensor_information():
     """Flask method to get Chassis Sensor Details"""
     headers = ["chassisIP", "chassisType", "sensorType", "sensorName", "sensorValue", "unit"]
-    sensor_list_details = []
-    records = read_data_from_database(table_name="chassis_sensor_details")
-    for record in records:
-        sensor_list_details.append([{"chassisIp": record["chassisIp"], 
-                "typeOfChassis": record["typeOfChassis"],
-                "sensorType": record["sensorType"],
-                "sensorName": record["sensorName"],
-                "sensorValue": record["sensorValue"],
-                "unit": record["unit"],
-                "lastUpdatedAt_UTC":record["lastUpdatedAt_UTC"]}])
-    return render_template("chassisSensorsDetails.html", headers=headers, rows = sensor_list_details)
+    return render_template("chassisSensorsDetails.html", headers=headers,
+                           last_updated=read_last_poll_from_database("chassis_sensor_details"))
+
+
+@app.get("/tableData/<page>")
+def server_side_table_data(page):
+    """Flask method serving one page of an inventory table to DataTables server side processing"""
+    if page not in serverSideTables:
+        return jsonify({"message": f"Unknown table {page}"}), 404
+    table_name, columns, extra_columns, placeholder_column = serverSideTables[page]
+
+    try:
+        draw = int(request.args.get("draw", 0))
+        start = max(0, int(request.args.get("start", 0)))
+        length = int(request.args.get("length", 50))
+        order_index = int(request.args.get("order[0][column]", -1))
+    except ValueError:
+        return jsonify({"message": "draw, start, length and order must be integers"}), 400
+    column_filters = {}
+    for index, column in enumerate(columns):
+        value = request.args.get(f"columns[{index}][search][value]", "")
+        if value:
+            column_filters[column] = value
+    order_by = columns[order_index] if 0 <= order_index < len(columns) else None
+
+    total, filtered, records = read_table_page_from_database(
+        table_name, columns + extra_columns, start=start, length=length,
+        search=request.args.get("search[value]", ""), column_filters=column_filters,
+        order_by=order_by, order_dir=request.args.get("order[0][dir]", "asc"),
+        placeholder_column=placeholder_column)
+    rows = [dict(record) for record in records]
+    # Rows of unreachable chassis are their last known data, flagged for the page to show it
+    stale_chassis = read_stale_chassis_from_database()
+    for row in rows:
+        row["stale"] = row["chassisIp"] in stale_chassis
+    if page == "cardDetails":
+        card_tags_dict = read_tags(type_of_update="card")
+        for row in rows:
+            row["tags"] = card_tags_dict.get(row["serialNumber"], [])
+    return jsonify({"draw": draw, "recordsTotal": total, "recordsFiltered": filtered, "data": rows})
 
 
 
@@ -208,7 +224,7 @@ def lineChartPerfMetrics(ip):
                                 chassis_list = chassis_list)
 
     elif ip:
-        records = get_perf_metrics_from_db(str(ip))
+        records = get_perf_metrics_from_db(str(ip), limit=10)
         mem_values = []
         cpu_values = []
         date_timeline_value = []
@@ -218,31 +234,220 @@ def lineChartPerfMetrics(ip):
             mem_values.append(float(record['mem_utilization']))
             cpu_values.append(float(record['cpu_utilization']))
         return render_template('chassisPerformanceMetrics.html', title='Performance Metrics', 
-                                max=100, mem_values=mem_values[-10:], 
-                                cpu_values=cpu_values[-10:], 
-                                date_timeline_value=date_timeline_value[-10:],
+                                max=100, mem_values=mem_values, 
+                                cpu_values=cpu_values, 
+                                date_timeline_value=date_timeline_value,
                                 ip = ip,
                                 chassis_list = chassis_list)
 
+@app.get('/perfMetrics/<ip>')
+def perfMetricsRange(ip):
+    """Flask method to get downsampled performance metrics of a time range as JSON
+    Query parameters: start, end (epoch seconds, default last 24 hours), maxPoints (default 300)"""
+    now = int(time.time())
+    try:
+        end = int(request.args.get("end", now))
+        start = int(request.args.get("start", end - 24 * 60 * 60))
+        max_points = min(5000, max(1, int(request.args.get("maxPoints", 300))))
+    except ValueError:
+        return jsonify({"message": "start, end and maxPoints must be integers"}), 400
+    if start > end:
+        return jsonify({"message": "start must not be after end"}), 400
+
+    resolution, records = get_perf_metrics_range_from_db(str(ip), start, end, max_points)
+    points = [{"t": record["t"],
+               "samples": record["samples"],
+               "mem_min": record["mem_min"], "mem_avg": record["mem_avg"], "mem_max": record["mem_max"],
+               "cpu_min": record["cpu_min"], "cpu_avg": record["cpu_avg"], "cpu_max": record["cpu_max"]}
+              for record in records]
+    return jsonify({"ip": ip, "start": start, "end": end, "resolution": resolution, "points": points})
+
+@app.get('/portStats/<ip>')
+def portStats(ip):
+    """Flask method to get port counters and rates of a chassis as JSON
+    Query parameters: start, end (epoch seconds, default last hour), card, port"""
+    now = int(time.time())
+    try:
+        end = int(request.args.get("end", now))
+        start = int(request.args.get("start", end - 60 * 60))
+        card = int(request.args["card"]) if request.args.get("card") else None
+        port = int(request.args["port"]) if request.args.get("port") else None
+    except ValueError:
+        return jsonify({"message": "start, end, card and port must be integers"}), 400
+
+    ports = {}
+    for record in get_port_stats_from_db(str(ip), start, end, card, port):
+        samples = ports.setdefault((record["cardNumber"], record["portNumber"]), [])
+        samples.append({key: record[key] for key in record.keys() if key not in ("chassisIp", "cardNumber", "portNumber")})
+    return jsonify({"ip": ip, "start": start, "end": end,
+                    "ports": [{"cardNumber": card_number, "portNumber": port_number, "samples": samples}
+                              for (card_number, port_number), samples in ports.items()]})
+
+@app.get('/capacityReport')
+def capacityReport():
+    """Flask method to get the fleet capacity report as JSON
+    Query parameters: days of utilization history (default 7), topOwners (default 20)"""
+    try:
+        days = min(365, max(1, int(request.args.get("days", 7))))
+        top_owners = max(1, int(request.args.get("topOwners", 20)))
+    except ValueError:
+        return jsonify({"message": "days and topOwners must be integers"}), 400
+    return jsonify(capacity_report(days, top_owners))
+
+# Inventory page listing the rows of every kind of search hit
+searchHitPages = {"chassis": "/chassisDetails", "chassisTag": "/chassisDetails", "card": "/cardDetails",
+                  "cardTag": "/cardDetails", "port": "/portDetails", "license": "/licenseDetails"}
+
+
+@app.get('/search')
+def search():
+    """Flask method to search the whole inventory: serials, models, owners, licenses and tags
+    Query parameters: q, start (default 0), length (default 20, at most 100), kind (e.g. port)"""
+    query = request.args.get("q", "")
+    kind = request.args.get("kind") or None
+    try:
+        start = max(0, int(request.args.get("start", 0)))
+        length = min(100, max(1, int(request.args.get("length", 20))))
+    except ValueError:
+        return jsonify({"message": "start and length must be integers"}), 400
+    if kind is not None and kind not in searchHitPages:
+        return jsonify({"message": f"Unknown kind {kind}"}), 400
+    total, hits = search_inventory(query, start, length, kind)
+    for hit in hits:
+        hit["url"] = searchHitPages[hit["kind"]]
+    return jsonify({"query": query, "total": total, "start": start, "length": length, "hits": hits})
+
 @app.get("/pollLatestData/<category>")
+@app.post("/pollLatestData/<category>")
 def pollLatestChassisData(category):
-    """Mthod to load latest data out of polling cycle"""
-    controller(category_of_poll=category)
-    return redirect(categoryToFuntionMap[category]) 
+    """Method to queue a refresh of category out of polling cycle, optionally for a single chassis (?ip=)"""
+    if category not in categoryToFuntionMap:
+        return jsonify({"error": f"Unknown category {category}"}), 404
+    ip = request.args.get("ip")
+    if ip:
+        serv_list = read_username_password_from_database()
+        chassis_list = json.loads(serv_list) if serv_list else []
+        chassis = next((chassis for chassis in chassis_list if chassis["ip"] == ip), None)
+        if chassis is None:
+            return jsonify({"error": f"Unknown chassis {ip}"}), 404
+        # A full refresh of the category already covers this chassis
+        job = job_queue.submit(("poll", category, ip), "poll", poll_single_chassis, category, chassis,
+                               coalesce_with=[("poll", category, None)], category=category, ip=ip)
+    else:
+        job = job_queue.submit(("poll", category, None), "poll", controller, category,
+                               category=category, ip=None)
+    job["statusUrl"] = f"/jobs/{job['id']}"
+    return jsonify(job), 202
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint with the metrics of the web app and poller processes"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    """Method to report the state of a background job"""
+    job = job_queue.status_of(job_id) or operation_queue.status_of(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(job)
+
+def _collect_chassis_logs(chassis):
+    """Authenticate and run the IxOS collectlogs operation, waiting for it off the request thread"""
+    session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+    result = session.collect_chassis_logs()
+    # The result url of the async operation, any other answer is a response object the job cannot store
+    if not isinstance(result, str):
+        raise Exception(f"Log collection did not start on {chassis['ip']}: "
+                        f"{getattr(result, 'status_code', '')} {getattr(result, 'data', result)}")
+    return result
 
 @app.post("/getLogs")
 def getlogs():
-    """This flask method will start the async call to get logs from Ixia Chassis"""
-    chassis_list = json.loads(read_username_password_from_database())
+    """This flask method will queue the async call to get logs from Ixia Chassis, poll /jobs/<id> for the result url"""
+    serv_list = read_username_password_from_database()
+    chassis_list = json.loads(serv_list) if serv_list else []
     input_json = request.get_json(force=True) 
     chassis_ip = input_json['ip']
-    for chassis_item in chassis_list:
-        if chassis_item["ip"] == chassis_ip:
-            chassis = chassis_item
+    chassis = next((chassis for chassis in chassis_list if chassis["ip"] == chassis_ip), None)
+    if chassis is None:
+        return jsonify({"error": f"Unknown chassis {chassis_ip}"}), 404
+    job = operation_queue.submit(("collectlogs", chassis_ip), "collectlogs", _collect_chassis_logs, chassis, ip=chassis_ip)
+    job["statusUrl"] = f"/jobs/{job['id']}"
+    job["message"] = "Please login to your chassis and enter this url in browser to download logs"
+    return jsonify(job), 202
+
+
+def _free_port_request(values):
+    """count, speed, phyMode and linkState of a free port search, ValueError when count is not a positive integer"""
+    count = int(values.get("count", 1))
+    if count < 1:
+        raise ValueError(count)
+    return count, values.get("speed") or None, values.get("phyMode") or None, values.get("linkState") or None
+
+
+@app.get("/freePorts")
+def free_ports():
+    """Flask method to find sets of free ports, best locality first
+    Query parameters: count (default 1), speed (e.g. 100000 or 100G), phyMode, linkState, options (default 5)"""
+    try:
+        count, speed, phy_mode, link_state = _free_port_request(request.args)
+        options = min(20, max(1, int(request.args.get("options", 5))))
+    except ValueError:
+        return jsonify({"message": "count and options must be positive integers"}), 400
+    return jsonify({"count": count, "speed": speed, "phyMode": phy_mode, "linkState": link_state,
+                    "options": find_free_port_sets(count, speed, phy_mode, link_state, options)})
+
+
+# Finder runs of a reservation whose ports were claimed by a concurrent one in between
+RESERVATION_ATTEMPTS = 3
+
+
+def _reserve_ports(count, speed, phy_mode, link_state, chassis_list):
+    """Take ownership of the best located set of free ports, all of them or none"""
+    chassis_by_ip = {chassis["ip"]: chassis for chassis in chassis_list}
+    for _ in range(RESERVATION_ATTEMPTS):
+        port_sets = find_free_port_sets(count, speed, phy_mode, link_state, options=1)
+        if not port_sets:
+            raise Exception(f"There are not {count} free ports matching the request")
+        ports_by_chassis = {}
+        for port in port_sets[0]["ports"]:
+            ports_by_chassis.setdefault(port["chassisIp"], []).append(port)
+        for chassis_ip in ports_by_chassis:
+            if chassis_ip not in chassis_by_ip:
+                raise Exception(f"No credentials for chassis {chassis_ip}")
+        owners = {chassis_ip: chassis_by_ip[chassis_ip]["username"] for chassis_ip in ports_by_chassis}
+        if claim_free_ports_in_database(port_sets[0]["ports"], owners):
             break
-    session = IxRestSession(chassis["ip"], chassis["username"], chassis["password"])
-    out = session.collect_chassis_logs(session)
-    return jsonify({"resultUrl" : out, "message": "Please login to your chassis and enter this url in browser to download logs"})
+    else:
+        raise Exception(f"The free ports found were reserved by other requests {RESERVATION_ATTEMPTS} times, please retry")
+    taken = []
+    try:
+        for chassis_ip, ports in ports_by_chassis.items():
+            chassis = chassis_by_ip[chassis_ip]
+            session = get_cached_session(chassis["ip"], chassis["username"], chassis["password"])
+            taken.append((session, take_ports_ownership(session, chassis_ip, ports)))
+    except Exception:
+        for session, chassis_ports in taken:
+            release_ports_ownership(session, chassis_ports)
+        release_claimed_ports_in_database(port_sets[0]["ports"], owners)
+        raise
+    return port_sets[0]
+
+@app.post("/reservePorts")
+def reserve_ports():
+    """This flask method will queue taking ownership of the best located set of free ports, poll /jobs/<id> for the ports
+    JSON body: count, speed, phyMode, linkState as for /freePorts"""
+    try:
+        count, speed, phy_mode, link_state = _free_port_request(request.get_json(force=True))
+    except ValueError:
+        return jsonify({"message": "count must be a positive integer"}), 400
+    serv_list = read_username_password_from_database()
+    chassis_list = json.loads(serv_list) if serv_list else []
+    job = operation_queue.submit(("reserveports", uuid.uuid4().hex), "reserveports", _reserve_ports,
+                                 count, speed, phy_mode, link_state, chassis_list, count=count)
+    job["statusUrl"] = f"/jobs/{job['id']}"
+    return jsonify(job), 202
 
 
 categoryToFuntionMap = {"chassis": "/chassisDetails",
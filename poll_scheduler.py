@@ -0,0 +1,197 @@
+"""Single process poll scheduler.
+
+Replaces the one-process-per-category pollers started by runApplication.sh.
+Every (category, chassis) pair is a task kept in a priority queue ordered by
+the time it is next due. Due tasks run on one shared worker pool, so all
+categories share the cached chassis sessions and a single writer process
+talks to inventory.db. Chassis list and poll interval changes written by the
+web UI are picked up every few seconds without a restart.
+"""
+
+import heapq
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from sqlite3_utilities import read_username_password_from_database, read_poll_setting_from_database, \
+    delete_data_of_removed_chassis, REMOVED_CHASSIS_TABLES
+from metrics import POLL_CYCLE_OVERRUNS, start_flusher
+from RestApi.IxOSRestInterface import close_http_sessions, invalidate_cached_session
+from IxOSRestAPICaller import forget_snapshots
+from chassis_health import chassis_health
+from chassis_facts import chassis_facts
+from data_poller import poll_single_chassis, apply_metric_retention, apply_metric_rollup, categoryToChassisPollMap, MAX_POLL_WORKERS
+
+# Used until the user saves intervals from the UI, same as runApplication.sh used to pass
+DEFAULT_POLL_INTERVALS = {"chassis": 60,
+                          "cards": 60,
+                          "ports": 60,
+                          "sensors": 60,
+                          "perf": 60,
+                          "portstats": 15,
+                          "licensing": 120,
+                          "data_purge": 1}
+
+# How often poll_setting and user_db are re-read, in seconds
+SETTINGS_REFRESH_INTERVAL = 5
+
+# How often performance metrics are rolled up between two data purges, in seconds
+ROLLUP_INTERVAL = 300
+
+
+class PollScheduler(object):
+    """Priority queue of next-due (category, chassis ip) tasks run on a shared worker pool.
+    data_purge and rollup are not chassis specific and are scheduled as (data_purge, None) and (rollup, None).
+    """
+
+    def __init__(self, workers=MAX_POLL_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self._lock = threading.Lock()
+        self._queue = []
+        self._counter = itertools.count()
+        self._intervals = dict(DEFAULT_POLL_INTERVALS)
+        self._chassis = None
+        self._last_run = {}
+        self._scheduled = set()
+        self._in_flight = set()
+
+    def interval_of(self, category):
+        """Poll interval of category in seconds"""
+        if category == "rollup":
+            return ROLLUP_INTERVAL
+        interval = int(self._intervals[category])
+        # Data Purge would be in days
+        if category == "data_purge":
+            interval = interval * 24 * 60 * 60
+        return interval
+
+    def _push(self, task):
+        """Queue task at its next due time, right away if it never ran"""
+        last_run = self._last_run.get(task)
+        due = time.time() if last_run is None else last_run + self.interval_of(task[0])
+        heapq.heappush(self._queue, (due, next(self._counter), task))
+        self._scheduled.add(task)
+
+    def refresh_configuration(self):
+        """Pick up chassis list and poll interval changes made from the web UI"""
+        intervals = dict(DEFAULT_POLL_INTERVALS)
+        poll_setting = read_poll_setting_from_database()
+        if poll_setting:
+            for category in intervals:
+                if poll_setting[category]:
+                    intervals[category] = int(poll_setting[category])
+
+        serv_list = read_username_password_from_database()
+        chassis_list = json.loads(serv_list) if serv_list else []
+
+        chassis_by_ip = {chassis["ip"]: chassis for chassis in chassis_list}
+        with self._lock:
+            first_refresh = self._chassis is None
+            previous_chassis = self._chassis or {}
+            self._chassis = chassis_by_ip
+            removed = [ip for ip in previous_chassis if ip not in chassis_by_ip]
+            for task in [task for task in self._last_run if task[1] in removed]:
+                del self._last_run[task]
+            if intervals != self._intervals:
+                # Recompute every due time from the last run with the new intervals
+                self._intervals = intervals
+                self._queue = []
+                self._scheduled = set()
+
+            tasks = [(category, ip) for category in categoryToChassisPollMap for ip in self._chassis]
+            tasks.append(("data_purge", None))
+            tasks.append(("rollup", None))
+            for task in tasks:
+                if task not in self._scheduled and task not in self._in_flight:
+                    self._push(task)
+
+        # Sessions authenticated with credentials that are not in user_db anymore
+        for ip, chassis in previous_chassis.items():
+            current = chassis_by_ip.get(ip)
+            if current is None or (current["username"], current["password"]) != (chassis["username"], chassis["password"]):
+                invalidate_cached_session(ip)
+            if current is None:
+                close_http_sessions(ip)
+                forget_snapshots(ip)
+
+        for ip in removed:
+            chassis_health.forget(ip)
+            chassis_facts.forget(ip)
+        # On start, chassis removed while the scheduler was not running are cleaned up as well
+        if removed or first_refresh:
+            for table_name in REMOVED_CHASSIS_TABLES:
+                delete_data_of_removed_chassis(table_name, chassis_by_ip)
+
+    def dispatch_due_tasks(self):
+        """Submit every due task to the worker pool and return when the next one is due"""
+        now = time.time()
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                _, _, task = heapq.heappop(self._queue)
+                self._scheduled.discard(task)
+                category, ip = task
+                # Chassis was removed from the inventory
+                if ip is not None and ip not in self._chassis:
+                    continue
+                self._in_flight.add(task)
+                self._last_run[task] = now
+                self.executor.submit(self._run_task, task, self._chassis.get(ip))
+            return self._queue[0][0] if self._queue else None
+
+    def _run_task(self, task, chassis):
+        """Worker pool entry point, requeues the task once it is done"""
+        category, ip = task
+        started = time.time()
+        try:
+            if category == "data_purge":
+                apply_metric_retention()
+            elif category == "rollup":
+                apply_metric_rollup()
+            else:
+                poll_single_chassis(category, chassis)
+        except Exception as e:
+            print(f"Poll of {category} for {ip} failed: {e}")
+        finally:
+            if time.time() - started > self.interval_of(category):
+                POLL_CYCLE_OVERRUNS.inc(category=category)
+            with self._lock:
+                self._in_flight.discard(task)
+                removed = ip is not None and ip not in self._chassis
+                if not removed:
+                    self._push(task)
+                chassis_ips = list(self._chassis)
+            # The chassis was removed while this poll was running, drop what the poll wrote back
+            if removed and categoryToChassisPollMap[category][1] in REMOVED_CHASSIS_TABLES:
+                delete_data_of_removed_chassis(categoryToChassisPollMap[category][1], chassis_ips)
+
+    def run_forever(self):
+        """Main scheduler loop"""
+        next_refresh = 0
+        while True:
+            if time.time() >= next_refresh:
+                try:
+                    self.refresh_configuration()
+                except Exception as e:
+                    print(f"Failed to read poll configuration: {e}")
+                next_refresh = time.time() + SETTINGS_REFRESH_INTERVAL
+            next_due = self.dispatch_due_tasks()
+            wake_at = next_refresh if next_due is None else min(next_due, next_refresh)
+            time.sleep(max(0, wake_at - time.time()))
+
+
+@click.command()
+@click.option('--workers', default= MAX_POLL_WORKERS, help='Maximum number of polls running concurrently')
+def start_scheduler(workers):
+    """Poll every category of every chassis from a single process"""
+    start_flusher()
+    try:
+        PollScheduler(workers=workers).run_forever()
+    finally:
+        close_http_sessions()
+
+if __name__ == '__main__':
+    start_scheduler()
@@ -1,106 +1,693 @@
 import sqlite3
 import json
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
 
-def _get_db_connection():
-    """Get connection to sqlite3 database"""
-    conn = sqlite3.connect('inventory.db')
+import db_queries
+from metrics import DB_WRITE_SECONDS, DB_ROWS_WRITTEN
+
+DB_PATH = 'inventory.db'
+# Milliseconds a writer waits for the write lock before "database is locked" is raised
+BUSY_TIMEOUT = int(os.environ.get("IIE_DB_BUSY_TIMEOUT", "10000"))
+
+# Days performance metrics are kept at every resolution
+RAW_RETENTION_DAYS = int(os.environ.get("IIE_RAW_RETENTION_DAYS", "7"))
+FIVE_MIN_RETENTION_DAYS = int(os.environ.get("IIE_5MIN_RETENTION_DAYS", "30"))
+HOURLY_RETENTION_DAYS = int(os.environ.get("IIE_HOURLY_RETENTION_DAYS", "365"))
+# Port counters are sampled every few seconds, keep only recent history
+PORT_STATS_RETENTION_HOURS = int(os.environ.get("IIE_PORTSTATS_RETENTION_HOURS", "6"))
+# Licenses expiring within this many days are counted as expiring soon by the fleet summary
+LICENSE_EXPIRY_WARNING_DAYS = int(os.environ.get("IIE_LICENSE_EXPIRY_WARNING_DAYS", "30"))
+
+_connections = threading.local()
+
+
+def _open_db_connection(read_only):
+    """Open a new sqlite3 connection tuned for concurrent pollers and web readers"""
+    if read_only:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=BUSY_TIMEOUT / 1000)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT / 1000)
+        # WAL lets readers keep reading the last committed data while a poll is writing
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT}")
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def write_data_to_database(table_name=None, records=None, ip_tags_dict=None):
-    """Write polled data inside sqlite3 DB"""
-    tags = ""
-    conn = _get_db_connection()
-    cur = conn.cursor()
-    
-    # Clear of old records from database
-    if table_name != "chassis_utilization_details":
-        cur.execute(f"DELETE FROM {table_name}")
-    
+def _get_db_connection(read_only=False):
+    """Get connection to sqlite3 database
+    Connections are opened once per thread and process and reused, callers must not close them.
+    Read only connections are used by all read paths so web requests never take the write lock.
+    """
+    pid = os.getpid()
+    if getattr(_connections, "pid", None) != pid:
+        # New thread, or a forked process that must not reuse its parent's connections
+        _connections.pid = pid
+        _connections.by_mode = {}
+    conn = _connections.by_mode.get(read_only)
+    if conn is None:
+        conn = _open_db_connection(read_only)
+        _connections.by_mode[read_only] = conn
+    elif conn.in_transaction:
+        # Left over by a write that failed half way
+        conn.rollback()
+    return conn
+
+
+# Columns identifying a row of every polled table, rows are diffed on these keys
+POLLED_TABLE_KEYS = {"chassis_summary_details": ("ip",),
+                     "chassis_card_details": ("chassisIp", "cardNumber"),
+                     "chassis_port_details": ("chassisIp", "cardNumber", "portNumber"),
+                     "license_details_records": ("chassisIp", "partNumber", "activationCode"),
+                     "chassis_sensor_details": ("chassisIp", "sensorType", "sensorName")}
+
+# Tables whose rows of a chassis are deleted once it is removed from the inventory. Performance
+# metrics history is only removed by its retention, the capacity report looks back over it
+REMOVED_CHASSIS_TABLES = tuple(POLLED_TABLE_KEYS) + ("chassis_port_stats",)
+
+# Column holding 'NA' in the placeholder rows written for a chassis that never answered a poll
+PLACEHOLDER_COLUMNS = {"chassis_summary_details": "chassisSN",
+                       "chassis_card_details": "cardNumber",
+                       "chassis_port_details": "cardNumber",
+                       "license_details_records": "activationCode",
+                       "chassis_sensor_details": "sensorName"}
+
+
+def _get_tags(ip_tags_dict, key):
+    """Comma separated tags of key from a read_tags dict"""
+    if ip_tags_dict:
+        tags = ip_tags_dict.get(key) #This is a list
+        if tags:
+            return ",".join(tags)
+    return ""
+
+
+def _rows_from_records(table_name, records, ip_tags_dict):
+    """Flatten polled records into column -> value dicts of table_name"""
+    rows = []
     for record in records:
         if table_name == "chassis_summary_details":
-            if ip_tags_dict:
-                tags = ip_tags_dict.get(record["chassisIp"]) #This is a list
-                if tags:
-                    tags = ",".join(tags)
-                else:
-                    tags = ""
-            else:
-                tags = ""
-                
-            record.update({"tags": tags })
-            
-            cur.execute(f"""INSERT INTO {table_name} (ip, chassisSN, controllerSN, type_of_chassis, 
-                        physicalCards, status_status, ixOS, ixNetwork_Protocols, ixOS_REST, tags, lastUpdatedAt_UTC, 
-                        mem_bytes, mem_bytes_total, cpu_pert_usage, os) VALUES 
-                        ('{record["chassisIp"]}', '{record['chassisSerial#']}',
-                        '{record['controllerSerial#']}','{record['chassisType']}','{record['physicalCards#']}',
-                        '{record['chassisStatus']}',
-                        '{record.get('IxOS', "NA")}','{record.get('IxNetwork Protocols',"NA")}','{record.get('IxOS REST',"NA")}','{record['tags']}', 
-                        datetime('now'), '{record.get('mem_bytes', '0')}','{record.get('mem_bytes_total', '0')}','{record.get('cpu_pert_usage', '0')}',
-                        '{record['os']}')""")
-        
+            rows.append({"ip": record["chassisIp"],
+                         "chassisSN": record['chassisSerial#'],
+                         "controllerSN": record['controllerSerial#'],
+                         "type_of_chassis": record['chassisType'],
+                         "physicalCards": record['physicalCards#'],
+                         "status_status": record['chassisStatus'],
+                         "ixOS": record.get('IxOS', "NA"),
+                         "ixNetwork_Protocols": record.get('IxNetwork Protocols', "NA"),
+                         "ixOS_REST": record.get('IxOS REST', "NA"),
+                         "tags": _get_tags(ip_tags_dict, record["chassisIp"]),
+                         "mem_bytes": record.get('mem_bytes', '0'),
+                         "mem_bytes_total": record.get('mem_bytes_total', '0'),
+                         "cpu_pert_usage": record.get('cpu_pert_usage', '0'),
+                         "os": record['os']})
+
         if table_name == "license_details_records":
             for rcd in record:
-                cur.execute(f"""INSERT INTO {table_name} (chassisIp, typeOfChassis, hostId, partNumber, 
-                            activationCode, quantity, description, maintenanceDate, expiryDate, isExpired, lastUpdatedAt_UTC) VALUES 
-                            ('{rcd["chassisIp"]}', '{rcd["typeOfChassis"]}',
-                            '{rcd["hostId"]}','{rcd["partNumber"]}',
-                            '{rcd["activationCode"]}','{str(rcd["quantity"])}','{rcd["description"]}',
-                            '{rcd["maintenanceDate"]}','{rcd["expiryDate"]}','{str(rcd["isExpired"])}', datetime('now'))""")
-                
+                rows.append({"chassisIp": rcd["chassisIp"],
+                             "typeOfChassis": rcd["typeOfChassis"],
+                             "hostId": rcd["hostId"],
+                             "partNumber": rcd["partNumber"],
+                             "activationCode": rcd["activationCode"],
+                             "quantity": str(rcd["quantity"]),
+                             "description": rcd["description"],
+                             "maintenanceDate": rcd["maintenanceDate"],
+                             "expiryDate": rcd["expiryDate"],
+                             "isExpired": str(rcd["isExpired"])})
+
         if table_name == "chassis_card_details":
             for rcd in record:
-                if ip_tags_dict:
-                    tags = ip_tags_dict.get(record["chassisIp"]) #This is a list
-                    if tags:
-                        tags = ",".join(tags)
-                    else:
-                        tags = ""
-                else:
-                    tags = ""    
-                rcd.update({"tags": tags })
-                cur.execute(f"""INSERT INTO {table_name} (chassisIp,typeOfChassis,cardNumber,serialNumber,cardType,cardState,numberOfPorts,tags,
-                            lastUpdatedAt_UTC) VALUES 
-                            ('{rcd["chassisIp"]}', '{rcd["chassisType"]}', '{rcd["cardNumber"]}','{rcd["serialNumber"]}',
-                            '{rcd["cardType"]}','{rcd["cardState"]}','{rcd["numberOfPorts"]}', '{rcd['tags']}', datetime('now'))""")
-            
+                rows.append({"chassisIp": rcd["chassisIp"],
+                             "typeOfChassis": rcd["chassisType"],
+                             "cardNumber": rcd["cardNumber"],
+                             "serialNumber": rcd["serialNumber"],
+                             "cardType": rcd["cardType"],
+                             "cardState": rcd["cardState"],
+                             "numberOfPorts": rcd["numberOfPorts"],
+                             "tags": _get_tags(ip_tags_dict, rcd["chassisIp"])})
+
         if table_name == "chassis_port_details":
             for rcd in record:
-                cur.execute(f"""INSERT INTO {table_name} (chassisIp,typeOfChassis,cardNumber,portNumber,linkState,phyMode,transceiverModel,
-                            transceiverManufacturer,owner, speed, type, totalPorts,ownedPorts,freePorts, transmitState, lastUpdatedAt_UTC) VALUES 
-                                ('{rcd["chassisIp"]}', '{rcd["typeOfChassis"]}', '{rcd["cardNumber"]}','{rcd["portNumber"]}','{rcd.get("linkState", "NA")}',
-                                '{rcd.get("phyMode","NA")}','{rcd.get("transceiverModel", "NA")}', '{rcd.get("transceiverManufacturer", "NA")}','{rcd["owner"]}',
-                                '{rcd.get("speed", "NA")}','{rcd.get("type", "NA")}','{rcd["totalPorts"]}','{rcd["ownedPorts"]}', '{rcd["freePorts"]}','{rcd.get('transmitState','NA')}',datetime('now'))""")
-                
+                rows.append({"chassisIp": rcd["chassisIp"],
+                             "typeOfChassis": rcd["typeOfChassis"],
+                             "cardNumber": rcd["cardNumber"],
+                             "portNumber": rcd["portNumber"],
+                             "linkState": rcd.get("linkState", "NA"),
+                             "phyMode": rcd.get("phyMode", "NA"),
+                             "transceiverModel": rcd.get("transceiverModel", "NA"),
+                             "transceiverManufacturer": rcd.get("transceiverManufacturer", "NA"),
+                             "owner": rcd["owner"],
+                             "speed": rcd.get("speed", "NA"),
+                             "type": rcd.get("type", "NA"),
+                             "totalPorts": rcd["totalPorts"],
+                             "ownedPorts": rcd["ownedPorts"],
+                             "freePorts": rcd["freePorts"],
+                             "transmitState": rcd.get('transmitState', 'NA')})
+
         if table_name == "chassis_sensor_details":
             for rcd in record:
                 unit = rcd["unit"]
                 if {rcd["unit"]} ==  "CELSIUS": unit = f'{rcd["value"]} {chr(176)}C'
                 if {rcd["unit"]} ==  "AMPERSEND": unit = "AMP"
-                cur.execute(f"""INSERT INTO {table_name} (chassisIp,typeOfChassis,sensorType,sensorName,sensorValue,unit,lastUpdatedAt_UTC) VALUES 
-                                ('{rcd["chassisIp"]}', '{rcd["typeOfChassis"]}', '{rcd.get("type", "NA")}','{rcd["name"]}',
-                                 '{rcd["value"]}','{unit}', datetime('now'))""")
-          
+                rows.append({"chassisIp": rcd["chassisIp"],
+                             "typeOfChassis": rcd["typeOfChassis"],
+                             "sensorType": rcd.get("type", "NA"),
+                             "sensorName": rcd["name"],
+                             "sensorValue": rcd["value"],
+                             "unit": unit})
+
         if table_name == "chassis_utilization_details":
-            cur.execute(f"""INSERT INTO {table_name} (chassisIp,mem_utilization,cpu_utilization,lastUpdatedAt_UTC) VALUES 
-                            ('{record["chassisIp"]}', '{record["mem_utilization"]}', '{record["cpu_utilization"]}', '{record["lastUpdatedAt_UTC"]}')""")
-            
+            sampled_at = datetime.strptime(record["lastUpdatedAt_UTC"], "%m/%d/%Y, %H:%M:%S").replace(tzinfo=timezone.utc)
+            rows.append({"chassisIp": record["chassisIp"],
+                         "mem_utilization": record["mem_utilization"],
+                         "cpu_utilization": record["cpu_utilization"],
+                         "lastUpdatedAt_UTC": record["lastUpdatedAt_UTC"],
+                         "sampledAt": int(sampled_at.timestamp())})
+    # Values are stored as TEXT, normalize them so keys and hashes compare with what is in DB
+    return [{k: str(v) for k, v in row.items()} for row in rows]
+
+
+def _row_hash(row):
+    """Content hash of a row, used to skip rewriting rows that did not change"""
+    # Rows of a table always list the same columns in the same order and hold strings only
+    return hashlib.sha1("\x1f".join(row.values()).encode()).hexdigest()
+
+
+def write_data_to_database(table_name=None, records=None, ip_tags_dict=None, chassis_ip=None):
+    """Write polled data inside sqlite3 DB
+    Rows are upserted on POLLED_TABLE_KEYS and only rewritten when their content changed,
+    rows that are no longer polled are deleted. When chassis_ip is given only the rows of
+    that chassis are considered
+    """
+    started = time.perf_counter()
+    conn = _get_db_connection()
+    cur = conn.cursor()
+
+    # Port counters are a time series with rates computed from the previous samples
+    if table_name == "chassis_port_stats":
+        written = _write_port_stats(cur, records)
+        cur.close()
+        conn.commit()
+        _record_write(table_name, started, inserted=written)
+        return
+
+    rows = _rows_from_records(table_name, records, ip_tags_dict)
+
+    # Performance metrics are a time series, always appended
+    if table_name == "chassis_utilization_details":
+        cur.executemany(f"""INSERT INTO {table_name} (chassisIp,mem_utilization,cpu_utilization,lastUpdatedAt_UTC,sampledAt) VALUES
+                            (:chassisIp, :mem_utilization, :cpu_utilization, :lastUpdatedAt_UTC, :sampledAt)""", rows)
+        cur.close()
+        conn.commit()
+        _record_write(table_name, started, inserted=len(rows))
+        return
+
+    key_columns = POLLED_TABLE_KEYS[table_name]
+    ip_field = key_columns[0]
+    if chassis_ip is not None:
+        scope, scope_params = f"WHERE {ip_field} = ?", [chassis_ip]
+    else:
+        scope, scope_params = "", []
+
+    # Existing rows of the chassis being written, a key can repeat in DB written by older versions
+    existing = {}
+    # Positional access, looking columns up by name costs more than the rest of the loop on a large fleet
+    for post in cur.execute(f"SELECT rowid, rowHash, {', '.join(key_columns)} FROM {table_name} {scope}", scope_params):
+        existing.setdefault(tuple(map(str, post[2:])), []).append((post[0], post[1]))
+    had_rows = bool(existing)
+
+    last_update_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    inserts = []
+    updates = []
+    changed_keys = set()
+    for row in rows:
+        row_hash = _row_hash(row)
+        key = tuple(row[c] for c in key_columns)
+        matches = existing.get(key)
+        if matches:
+            rowid, old_hash = matches.pop(0)
+            if old_hash != row_hash:
+                updates.append(list(row.values()) + [row_hash, last_update_at, rowid])
+                changed_keys.add(key)
+        else:
+            inserts.append(list(row.values()) + [row_hash, last_update_at])
+            changed_keys.add(key)
+
+    # All rows of a table share the same columns, so every change is one prepared statement
+    if rows:
+        columns = list(rows[0])
+        if inserts:
+            placeholders = ", ".join("?" * (len(columns) + 2))
+            cur.executemany(f"INSERT INTO {table_name} ({', '.join(columns)}, rowHash, lastUpdatedAt_UTC) VALUES ({placeholders})",
+                            inserts)
+        if updates:
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            cur.executemany(f"UPDATE {table_name} SET {assignments}, rowHash = ?, lastUpdatedAt_UTC = ? WHERE rowid = ?",
+                            updates)
+
+    # Chassis, cards, ports... that disappeared
+    deletes = [(rowid,) for matches in existing.values() for rowid, _ in matches]
+    cur.executemany(f"DELETE FROM {table_name} WHERE rowid = ?", deletes)
+    changed_keys.update(key for key, matches in existing.items() if matches)
+
+    # Every chassis written was polled now, whether its rows changed or not
+    polled_chassis = [chassis_ip] if chassis_ip is not None else {row[ip_field] for row in rows}
+    cur.executemany("""INSERT INTO last_poll_times (tableName, chassisIp, lastPolledAt) VALUES (?, ?, ?)
+                       ON CONFLICT (tableName, chassisIp) DO UPDATE SET lastPolledAt = excluded.lastPolledAt""",
+                    [(table_name, ip, last_update_at) for ip in polled_chassis])
+
+    # In the same transaction, so the summary never disagrees with the rows it counts
+    _refresh_fleet_summary(cur, table_name, {key[0] for key in changed_keys})
+    if had_rows:
+        _refresh_search_index(cur, table_name, changed_keys)
+    else:
+        _index_new_search_documents(cur, table_name, {key[0] for key in changed_keys})
+    cur.close()
+    conn.commit()
+    _record_write(table_name, started, inserted=len(inserts), updated=len(updates), deleted=len(deletes))
+
+PORT_STATS_COUNTERS = ("txFrames", "rxFrames", "txBytes", "rxBytes", "fcsErrors")
+PORT_STATS_RATES = {"txFrameRate": ("txFrames", 1), "rxFrameRate": ("rxFrames", 1),
+                    "txBitRate": ("txBytes", 8), "rxBitRate": ("rxBytes", 8), "fcsErrorRate": ("fcsErrors", 1)}
+
+
+def counter_delta(previous, current):
+    """Increase of a counter between two samples.
+    A counter that went down either wrapped around (it was close to the top of its
+    32 or 64 bit range) or was reset, e.g. cleared stats or a port reboot, in which
+    case it counted up from zero since.
+    """
+    if previous is None or current is None:
+        return None
+    if current >= previous:
+        return current - previous
+    for bits in (32, 64):
+        limit = 2 ** bits
+        if previous < limit and previous > limit * 3 // 4 and current < limit // 4:
+            return limit - previous + current
+    return current
+
+def _write_port_stats(cur, records):
+    """Append port counter samples with the rates since the previous sample of every port,
+    then drop the samples of the chassis older than PORT_STATS_RETENTION_HOURS. Returns rows written"""
+    samples_by_chassis = {}
+    for record in records:
+        for sample in record:
+            samples_by_chassis.setdefault(sample["chassisIp"], []).append(sample)
+
+    columns = ("chassisIp", "ts", "cardNumber", "portNumber") + PORT_STATS_COUNTERS + tuple(PORT_STATS_RATES)
+    written = 0
+    for chassis_ip, samples in samples_by_chassis.items():
+        previous = {(post["cardNumber"], post["portNumber"]): post for post in cur.execute(
+            """SELECT * FROM chassis_port_stats WHERE chassisIp = ? AND
+               ts = (SELECT MAX(ts) FROM chassis_port_stats WHERE chassisIp = ?)""", (chassis_ip, chassis_ip))}
+        rows = []
+        for sample in samples:
+            row = dict(sample)
+            last = previous.get((sample["cardNumber"], sample["portNumber"]))
+            elapsed = sample["ts"] - last["ts"] if last else 0
+            for rate, (counter, scale) in PORT_STATS_RATES.items():
+                delta = counter_delta(last[counter], sample.get(counter)) if elapsed > 0 else None
+                row[rate] = delta * scale / elapsed if delta is not None else None
+            rows.append([row.get(column) for column in columns])
+        # A sample with the timestamp of the previous one would carry no new information
+        cur.executemany(f"INSERT OR IGNORE INTO chassis_port_stats ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        rows)
+        written += len(rows)
+        cutoff = int(time.time()) - PORT_STATS_RETENTION_HOURS * 3600
+        cur.execute("DELETE FROM chassis_port_stats WHERE chassisIp = ? AND ts < ?", (chassis_ip, cutoff))
+    return written
+
+def _record_write(table_name, started, inserted=0, updated=0, deleted=0):
+    """Record duration and changed row counts of a write_data_to_database call"""
+    DB_WRITE_SECONDS.observe(time.perf_counter() - started, table=table_name)
+    for operation, count in (("insert", inserted), ("update", updated), ("delete", deleted)):
+        if count:
+            DB_ROWS_WRITTEN.inc(count, table=table_name, operation=operation)
+
+def _fleet_summary_counts_sql(table_name, scope):
+    """SELECT of (chassis, metric, group, count) of every fleet summary metric of table_name, rows filtered by scope"""
+    ip_field, placeholder_column, metrics = db_queries.fleet_summary_metrics[table_name]
+    if placeholder_column:
+        scope += f" AND {placeholder_column} IS NOT 'NA'"
+    return " UNION ALL ".join(f"""SELECT {ip_field}, '{metric}', {expression}, COUNT(*) FROM {table_name}
+                                  WHERE {scope} AND {expression} IS NOT NULL GROUP BY 1, 3"""
+                              for metric, expression in metrics.items())
+
+
+def _refresh_fleet_summary(cur, table_name, chassis_ips):
+    """Recount the fleet summary groups of table_name for chassis_ips and add the
+    difference with their previous counts to the fleet wide totals"""
+    if table_name not in db_queries.fleet_summary_metrics:
+        return
+    metrics = list(db_queries.fleet_summary_metrics[table_name][2])
+    counts_sql = _fleet_summary_counts_sql(table_name, f"{db_queries.fleet_summary_metrics[table_name][0]} = ?")
+    metric_filter = f"metric IN ({', '.join('?' * len(metrics))})"
+    deltas = {}
+    for chassis_ip in chassis_ips:
+        counts = {(metric, value): count for _, metric, value, count in cur.execute(counts_sql, [chassis_ip] * len(metrics))}
+        previous = {(metric, value): count for metric, value, count in cur.execute(
+            f"SELECT metric, groupValue, count FROM fleet_summary_by_chassis WHERE chassisIp = ? AND {metric_filter}",
+            [chassis_ip] + metrics)}
+        if counts == previous:
+            continue
+        for group in counts.keys() | previous.keys():
+            deltas[group] = deltas.get(group, 0) + counts.get(group, 0) - previous.get(group, 0)
+        cur.execute(f"DELETE FROM fleet_summary_by_chassis WHERE chassisIp = ? AND {metric_filter}", [chassis_ip] + metrics)
+        cur.executemany("INSERT INTO fleet_summary_by_chassis (chassisIp, metric, groupValue, count) VALUES (?, ?, ?, ?)",
+                        [(chassis_ip, metric, value, count) for (metric, value), count in counts.items()])
+    deltas = [(metric, value, delta) for (metric, value), delta in deltas.items() if delta]
+    if deltas:
+        cur.executemany("""INSERT INTO fleet_summary (metric, groupValue, count) VALUES (?, ?, ?)
+                           ON CONFLICT (metric, groupValue) DO UPDATE SET count = count + excluded.count""", deltas)
+        cur.execute("DELETE FROM fleet_summary WHERE count <= 0")
+
+
+def rebuild_fleet_summary():
+    """Recount the whole fleet summary from the polled tables, e.g. for a database written by an older version"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM fleet_summary_by_chassis")
+    cur.execute("DELETE FROM fleet_summary")
+    for table_name in db_queries.fleet_summary_metrics:
+        cur.execute(f"INSERT INTO fleet_summary_by_chassis (chassisIp, metric, groupValue, count) {_fleet_summary_counts_sql(table_name, '1')}")
+    cur.execute("""INSERT INTO fleet_summary (metric, groupValue, count)
+                   SELECT metric, groupValue, SUM(count) FROM fleet_summary_by_chassis GROUP BY metric, groupValue""")
+    cur.close()
+    conn.commit()
+
+
+def _search_key_columns(table_name):
+    """Columns identifying the row a search document of table_name was made from"""
+    return POLLED_TABLE_KEYS.get(table_name) or (db_queries.search_documents[table_name][1],)
+
+
+def _search_row_key(key):
+    """rowKey of the search document of a row from the values of its key columns"""
+    return "/".join("" if value is None else str(value) for value in key)
+
+
+def _search_documents_sql(table_name, scope, joined=""):
+    """SELECT of (kind, sourceKey, rowKey, label, body) search documents of the rows of table_name filtered by scope,
+    joined is put in front of table_name in the FROM clause"""
+    kind, key_field, placeholder_column, label, body_columns = db_queries.search_documents[table_name]
+    if placeholder_column:
+        scope += f" AND {placeholder_column} IS NOT 'NA'"
+    # Same text as _search_row_key, so a document can be found again from the key of its row
+    row_key = " || '/' || ".join(f"IFNULL({column}, '')" for column in _search_key_columns(table_name))
+    body = " || ' ' || ".join(f"COALESCE({column}, '')" for column in body_columns)
+    return f"SELECT '{kind}', {key_field}, {row_key}, {label}, {body} FROM {joined}{table_name} WHERE {scope}"
+
+
+def _drop_search_documents(cur, kind, column, values):
+    """Remove the search documents of kind whose column is one of values from the index and search_documents"""
+    params = [(kind, value) for value in values]
+    # An external content index has to be told the old text of the documents it drops
+    cur.executemany(f"""INSERT INTO search_index (search_index, rowid, label, body)
+                        SELECT 'delete', id, label, body FROM search_documents WHERE kind = ? AND {column} = ?""",
+                    params)
+    cur.executemany(f"DELETE FROM search_documents WHERE kind = ? AND {column} = ?", params)
+
+
+def _refresh_search_index(cur, table_name, row_keys):
+    """Replace the search documents of the table_name rows of every row key, the values of the
+    row's key columns. Only the documents of rows that were inserted, updated or deleted are touched"""
+    if table_name not in db_queries.search_documents:
+        return
+    kind = db_queries.search_documents[table_name][0]
+    key_columns = _search_key_columns(table_name)
+    # Set based statements over a scratch table of the keys, a statement per row would cost more than the write itself
+    key_fields = [f"key{i}" for i in range(len(key_columns))]
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS search_refresh (rowKey TEXT PRIMARY KEY, key0, key1, key2) WITHOUT ROWID")
+    cur.execute("DELETE FROM search_refresh")
+    cur.executemany(f"INSERT OR IGNORE INTO search_refresh (rowKey, {', '.join(key_fields)}) VALUES (?, {', '.join('?' * len(key_fields))})",
+                    ((_search_row_key(key),) + tuple(key) for key in row_keys))
+    changed_documents = "kind = ? AND (sourceKey, rowKey) IN (SELECT key0, rowKey FROM search_refresh)"
+    # An external content index has to be told the old text of the documents it drops. FTS5 writes out
+    # its pending changes whenever a rowid is lower than the previous one, so they go in id order
+    cur.execute(f"""INSERT INTO search_index (search_index, rowid, label, body)
+                    SELECT 'delete', id, label, body FROM search_documents WHERE {changed_documents} ORDER BY id""", (kind,))
+    cur.execute(f"DELETE FROM search_documents WHERE {changed_documents}", (kind,))
+    # Without AUTOINCREMENT new documents get ids above the current largest one
+    last_id = cur.execute("SELECT IFNULL(MAX(id), 0) FROM search_documents").fetchone()[0]
+    # CROSS JOIN keeps search_refresh as the outer loop, every key is then one lookup in the table's index
+    scope = " AND ".join(f"{table_name}.{column} = search_refresh.key{i}" for i, column in enumerate(key_columns))
+    cur.execute(f"""INSERT INTO search_documents (kind, sourceKey, rowKey, label, body)
+                    {_search_documents_sql(table_name, scope, "search_refresh CROSS JOIN ")}""")
+    cur.execute("INSERT INTO search_index (rowid, label, body) SELECT id, label, body FROM search_documents WHERE id > ?",
+                (last_id,))
+
+
+def _index_new_search_documents(cur, table_name, source_keys):
+    """Replace every search document of table_name rows of the chassis or cards in source_keys, cheaper than
+    _refresh_search_index when all of their rows were just inserted"""
+    if table_name not in db_queries.search_documents:
+        return
+    kind, key_field = db_queries.search_documents[table_name][:2]
+    _drop_search_documents(cur, kind, "sourceKey", source_keys)
+    last_id = cur.execute("SELECT IFNULL(MAX(id), 0) FROM search_documents").fetchone()[0]
+    cur.executemany(f"INSERT INTO search_documents (kind, sourceKey, rowKey, label, body) {_search_documents_sql(table_name, f'{key_field} = ?')}",
+                    [(source_key,) for source_key in source_keys])
+    cur.execute("INSERT INTO search_index (rowid, label, body) SELECT id, label, body FROM search_documents WHERE id > ?",
+                (last_id,))
+
+
+def rebuild_search_index():
+    """Recreate every search document from the inventory and tag tables and reindex them"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM search_documents")
+    for table_name in db_queries.search_documents:
+        cur.execute(f"INSERT INTO search_documents (kind, sourceKey, rowKey, label, body) {_search_documents_sql(table_name, '1')}")
+    cur.execute("INSERT INTO search_index (search_index) VALUES ('rebuild')")
+    cur.close()
+    conn.commit()
+
+
+# Hits counted at most by search_inventory, counting a query that matches most of the inventory costs as much as running it
+SEARCH_MAX_COUNT = 1000
+
+
+def search_inventory(query, start=0, length=20, kind=None):
+    """Search documents containing every term of query, best bm25 rank first.
+    A term is matched as a phrase of its words ('10.0.0.5', 'QSFP28-100G'), a term ending
+    with '*' as a prefix. Returns (total hits up to SEARCH_MAX_COUNT, hits of the page)"""
+    phrases = []
+    for term in query.split():
+        words = re.findall(r"\w+", term)
+        if words:
+            # Quoted words cannot be read as FTS5 operators or column filters
+            phrases.append('"' + " ".join(words) + '"' + ("*" if term.endswith("*") else ""))
+    if not phrases:
+        return 0, []
+    where, params = "search_index MATCH ?", [" ".join(phrases)]
+    if kind:
+        where, params = where + " AND d.kind = ?", params + [kind]
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    from_sql = f"FROM search_index JOIN search_documents d ON d.id = search_index.rowid WHERE {where}"
+    total = cur.execute(f"SELECT COUNT(*) FROM (SELECT 1 {from_sql} LIMIT {SEARCH_MAX_COUNT})", params).fetchone()[0]
+    hits = [dict(post) for post in cur.execute(
+        f"""SELECT d.kind, d.sourceKey, d.label, snippet(search_index, 1, '[', ']', '...', 12) AS snippet
+            {from_sql} ORDER BY bm25(search_index, 2.0, 1.0) LIMIT ? OFFSET ?""", params + [length, start])]
+    cur.close()
+    return total, hits
+
+
+def _chassis_of_table(cur, table_name, ip_field):
+    """Every chassis with rows in table_name, one index seek per chassis instead of reading every row"""
+    chassis = []
+    post = cur.execute(f"SELECT MIN({ip_field}) FROM {table_name}").fetchone()
+    while post[0] is not None:
+        chassis.append(post[0])
+        post = cur.execute(f"SELECT MIN({ip_field}) FROM {table_name} WHERE {ip_field} > ?", (post[0],)).fetchone()
+    return chassis
+
+
+def delete_data_of_removed_chassis(table_name, chassis_ips):
+    """Delete the rows of every chassis of table_name (one of REMOVED_CHASSIS_TABLES) that is not in chassis_ips anymore"""
+    ip_field = POLLED_TABLE_KEYS[table_name][0] if table_name in POLLED_TABLE_KEYS else "chassisIp"
+    chassis_ips = set(chassis_ips)
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    # The chassis list can be longer than the number of parameters SQLite accepts in an IN list
+    removed = [(ip,) for ip in _chassis_of_table(cur, table_name, ip_field) if ip not in chassis_ips]
+    if removed:
+        cur.executemany(f"DELETE FROM {table_name} WHERE {ip_field} = ?", removed)
+        DB_ROWS_WRITTEN.inc(max(cur.rowcount, 0), table=table_name, operation="delete")
+        _refresh_fleet_summary(cur, table_name, [ip for ip, in removed])
+        if table_name in db_queries.search_documents:
+            _drop_search_documents(cur, db_queries.search_documents[table_name][0], "sourceKey", [ip for ip, in removed])
+    # A chassis polled without returning rows has a poll time but nothing in table_name
+    cur.executemany("DELETE FROM last_poll_times WHERE tableName = ? AND chassisIp = ?",
+                    [(table_name, post["chassisIp"])
+                     for post in cur.execute("SELECT chassisIp FROM last_poll_times WHERE tableName = ?",
+                                             (table_name,)).fetchall()
+                     if post["chassisIp"] not in chassis_ips])
+    cur.close()
+    conn.commit()
+
+def chassis_has_data_in_database(table_name, chassisIp):
+    """True when table_name holds polled rows of chassisIp, not only the placeholder of a chassis that never answered"""
+    ip_field = POLLED_TABLE_KEYS[table_name][0] if table_name in POLLED_TABLE_KEYS else "chassisIp"
+    placeholder_column = PLACEHOLDER_COLUMNS.get(table_name)
+    scope = f" AND {placeholder_column} IS NOT 'NA'" if placeholder_column else ""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    post = cur.execute(f"SELECT 1 FROM {table_name} WHERE {ip_field} = ?{scope} LIMIT 1", (chassisIp,)).fetchone()
+    cur.close()
+    return post is not None
+
+def mark_chassis_data_stale(chassisIp):
+    """Flag the last known data of an unreachable chassis as stale"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    # Clearing rowHash makes the next successful poll rewrite the real status. A chassis that
+    # never answered keeps its Not Reachable placeholder
+    cur.execute("""UPDATE chassis_summary_details SET status_status = 'STALE', rowHash = NULL
+                   WHERE ip = ? AND chassisSN IS NOT 'NA'""", (chassisIp,))
+    _refresh_fleet_summary(cur, "chassis_summary_details", [chassisIp])
+    _refresh_search_index(cur, "chassis_summary_details", [(chassisIp,)])
     cur.close()
     conn.commit()
-    conn.close()
+
+def read_stale_chassis_from_database():
+    """Chassis whose last known data is shown because they are unreachable"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    posts = cur.execute("SELECT ip FROM chassis_summary_details WHERE status_status = 'STALE'").fetchall()
+    cur.close()
+    return {post["ip"] for post in posts}
 
 def read_data_from_database(table_name=None):
     """Write polled data from sqlite3 DB"""
-    conn = _get_db_connection()
+    conn = _get_db_connection(read_only=True)
     cur = conn.cursor()
     records = cur.execute(f"SELECT * FROM {table_name}").fetchall()
     cur.close()
-    conn.close()
     return records
 
 
+def read_columns_from_database(table_name, columns, where="", params=()):
+    """Read columns of table_name as plain tuples, the cheapest form to build columnar frames from"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    cur.row_factory = None
+    posts = cur.execute(f"SELECT {', '.join(columns)} FROM {table_name} {where}", params).fetchall()
+    cur.close()
+    return posts
+
+def read_table_page_from_database(table_name, columns, start=0, length=50, search="", column_filters=None,
+                                  order_by=None, order_dir="asc", placeholder_column=None):
+    """Read one page of table_name for server side DataTables, filtering, sorting and paging run in SQL.
+    columns, order_by and the keys of column_filters must come from code, never from the request.
+    Rows whose placeholder_column is 'NA' (unreachable chassis) are left out.
+    Returns total row count, filtered row count and the page rows"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+
+    base_conditions = []
+    if placeholder_column:
+        base_conditions.append(f"{placeholder_column} IS NOT 'NA'")
+    conditions = list(base_conditions)
+    params = []
+    if search:
+        conditions.append("(" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in columns) + ")")
+        params.extend([_like_pattern(search)] * len(columns))
+    for column, value in (column_filters or {}).items():
+        conditions.append(f"{column} LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(value))
+
+    base_where = f"WHERE {' AND '.join(base_conditions)}" if base_conditions else ""
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    total = cur.execute(f"SELECT COUNT(*) FROM {table_name} {base_where}").fetchone()[0]
+    filtered = cur.execute(f"SELECT COUNT(*) FROM {table_name} {where}", params).fetchone()[0] if params else total
+
+    order = f"ORDER BY {order_by} {'DESC' if order_dir == 'desc' else 'ASC'}, rowid" if order_by else "ORDER BY rowid"
+    # length -1 means all rows, e.g. for CSV export
+    limit = "LIMIT ? OFFSET ?" if length >= 0 else ""
+    page_params = params + ([length, start] if length >= 0 else [])
+    posts = cur.execute(f"SELECT {', '.join(columns)} FROM {table_name} {where} {order} {limit}", page_params).fetchall()
+    cur.close()
+    return total, filtered, posts
+
+
+def read_last_poll_from_database(table_name):
+    """Time of the latest successful poll written to table_name, the latest row change
+    for a database written before poll times were recorded"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    posts = cur.execute("SELECT MAX(lastPolledAt) FROM last_poll_times WHERE tableName = ?", (table_name,)).fetchone()
+    if posts[0] is None:
+        posts = cur.execute(f"SELECT MAX(lastUpdatedAt_UTC) FROM {table_name}").fetchone()
+    cur.close()
+    return posts[0]
+
+
+LICENSE_DATE_FORMATS = ("%d-%b-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d %b %Y", "%b %d, %Y")
+
+
+def _parse_license_date(value):
+    """Date of a license expiryDate, None for 'Permanent' and unknown formats"""
+    for date_format in LICENSE_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def read_fleet_summary_from_database(expiry_warning_days=LICENSE_EXPIRY_WARNING_DAYS):
+    """Dashboard counters of the fleet from the fleet_summary table, a read of a few rows per group
+    whatever the size of the fleet"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    groups = {}
+    for metric, value, count in cur.execute("SELECT metric, groupValue, count FROM fleet_summary"):
+        groups.setdefault(metric, {})[value] = count
+    cur.close()
+
+    today = datetime.now(timezone.utc).date()
+    expiring = 0
+    for value, count in groups.get("licenseExpiryDate", {}).items():
+        expiry_date = _parse_license_date(value)
+        if expiry_date is not None and 0 <= (expiry_date - today).days <= expiry_warning_days:
+            expiring += count
+    ports = groups.get("ports", {})
+
+    def by_count(metric):
+        return dict(sorted(groups.get(metric, {}).items(), key=lambda item: -item[1]))
+
+    return {"chassis": groups.get("chassis", {}).get("all", 0),
+            "chassisByStatus": by_count("chassisStatus"),
+            "chassisByType": by_count("chassisType"),
+            "ixosVersions": by_count("ixosVersion"),
+            "cards": groups.get("cards", {}).get("all", 0),
+            "cardsByType": by_count("cardType"),
+            "cardsByState": by_count("cardState"),
+            "ports": sum(ports.values()),
+            "ownedPorts": ports.get("owned", 0),
+            "freePorts": ports.get("free", 0),
+            "freePortsBySpeed": by_count("freePortsBySpeed"),
+            "portsByLinkState": by_count("linkState"),
+            "licenses": sum(groups.get("licenseExpired", {}).values()),
+            "expiredLicenses": groups.get("licenseExpired", {}).get("True", 0),
+            "licensesExpiringSoon": expiring,
+            "expiryWarningDays": expiry_warning_days}
+
+
+def _like_pattern(value):
+    """Case insensitive 'contains' pattern for LIKE with the wildcards of value escaped"""
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
 def write_tags(ip, tags, type_of_update=None, operation=None):
     """Write tags to sqlite3 DB"""
     updated_tags = ""
@@ -130,15 +717,16 @@ def write_tags(ip, tags, type_of_update=None, operation=None):
                 currenttags.remove(t)
             updated_tags = ",".join(currenttags)
             
-        cur.execute(f"UPDATE {table} SET tags = '{updated_tags}' where {field} = '{ip}'")
-        cur.execute(f"UPDATE chassis_summary_details SET tags = '{updated_tags}' where ip = '{ip}'")
+        cur.execute(f"UPDATE {table} SET tags = ? where {field} = ?", (updated_tags, ip))
+        cur.execute("UPDATE chassis_summary_details SET tags = ? where ip = ?", (updated_tags, ip))
     else: # New Record
-        cur.execute(f"INSERT INTO {table} ({field}, tags) VALUES ('{ip}', '{tags}')")
-        
+        cur.execute(f"INSERT INTO {table} ({field}, tags) VALUES (?, ?)", (ip, tags))
         
+    _refresh_search_index(cur, table, [(ip,)])
+    if type_of_update == "chassis":
+        _refresh_search_index(cur, "chassis_summary_details", [(ip,)])
     conn.commit()
     cur.close()
-    conn.close()
     return "Records successfully updated"
         
 def read_tags(type_of_update=None):
@@ -152,13 +740,12 @@ def read_tags(type_of_update=None):
         table = "user_card_tags"
         field = "serialNumber"
     
-    conn = _get_db_connection()
+    conn = _get_db_connection(read_only=True)
     cur = conn.cursor()
 
     query = f"SELECT * FROM {table};"
     posts = cur.execute(query).fetchall()
     cur.close()
-    conn.close()
     for post in posts:
         ip_tags_dict.update({post[field]: post["tags"].split(",")})
     return ip_tags_dict
@@ -166,13 +753,12 @@ def read_tags(type_of_update=None):
 
 def get_chassis_type_from_ip(chassisIp):
     """Get type of Ixia Chassis from IP"""
-    conn = _get_db_connection()
+    conn = _get_db_connection(read_only=True)
     cur = conn.cursor()
     
-    query = f"SELECT type_of_chassis FROM chassis_summary_details where ip = '{chassisIp}';"
-    posts = cur.execute(query).fetchone()
+    query = "SELECT type_of_chassis FROM chassis_summary_details where ip = ?;"
+    posts = cur.execute(query, (chassisIp,)).fetchone()
     cur.close()
-    conn.close()
     if posts:
         return  posts['type_of_chassis']
     return "NA"
@@ -187,22 +773,20 @@ def write_username_password_to_database(list_of_un_pw):
     user_pw_dict = creat_config_dict(list_of_un_pw)
     user_pw_dict = list({v['ip']:v for v in user_pw_dict}.values())
     json_str_data = json.dumps(user_pw_dict)
-    q = f"""INSERT INTO user_db (ixia_servers_json) VALUES ('{json_str_data}')"""
-    cur.execute(q)
+    q = """INSERT INTO user_db (ixia_servers_json) VALUES (?)"""
+    cur.execute(q, (json_str_data,))
     cur.close()
     conn.commit()
-    conn.close()
    
     
     
 def read_username_password_from_database():
     """Write user information about ixia servers from database"""
-    conn = _get_db_connection()
+    conn = _get_db_connection(read_only=True)
     cur = conn.cursor()
     query = "SELECT * FROM user_db;"
     posts = cur.execute(query).fetchone()
     cur.close()
-    conn.close()
     if posts:
         return posts['ixia_servers_json']
     return []
@@ -243,52 +827,312 @@ def creat_config_dict(list_of_un_pw):
             })
     return config_now
 
-def get_perf_metrics_from_db(ip):
-    """Fetch Ixia Chassis Performance Metrics"""
-    conn = _get_db_connection()
+def get_perf_metrics_from_db(ip, limit=10):
+    """Fetch the latest Ixia Chassis Performance Metrics samples, oldest first"""
+    conn = _get_db_connection(read_only=True)
     cur = conn.cursor()
-    query = f"SELECT * FROM chassis_utilization_details where chassisIp='{ip}';"
-    posts = cur.execute(query).fetchall()
+    query = """SELECT * FROM (SELECT * FROM chassis_utilization_details where chassisIp = ?
+               ORDER BY sampledAt DESC LIMIT ?) ORDER BY sampledAt;"""
+    posts = cur.execute(query, (ip, limit)).fetchall()
     cur.close()
-    conn.close()
     return posts
-    
-def write_polling_intervals_into_database(chassis, cards, ports, sensors, licensing, perf, data_purge):
+
+
+def get_perf_metrics_range_from_db(ip, start, end, max_points):
+    """Fetch Ixia Chassis Performance Metrics between start and end (epoch seconds),
+    downsampled in SQL into at most max_points min/avg/max buckets.
+    Returns the resolution the buckets were computed from and the buckets, oldest first"""
+    now = int(datetime.now(timezone.utc).timestamp())
+    bucket = max(1, -(-(end - start + 1) // max_points))
+
+    # Coarsest data that still has enough resolution for the bucket size and covers start
+    if bucket < 300 and start >= now - RAW_RETENTION_DAYS * 86400:
+        resolution, rollup_table = "raw", None
+    elif bucket < 3600 and start >= now - FIVE_MIN_RETENTION_DAYS * 86400:
+        resolution, rollup_table = "5min", "chassis_utilization_5min"
+    else:
+        resolution, rollup_table = "hourly", "chassis_utilization_hourly"
+
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    if rollup_table is None:
+        raw_from, rolled_until, rollup_table = start, start, "chassis_utilization_5min"
+    else:
+        # Raw samples fill in the time the rollups did not reach yet
+        step = 300 if resolution == "5min" else 3600
+        latest_bucket = cur.execute(f"SELECT MAX(bucketStart) FROM {rollup_table} WHERE chassisIp = ?", (ip,)).fetchone()[0]
+        rolled_until = latest_bucket + step if latest_bucket is not None else start
+        raw_from = max(start, rolled_until)
+
+    query = f"""SELECT MIN(t) AS t, SUM(samples) AS samples,
+                       MIN(mem_min) AS mem_min, SUM(mem_avg * samples) / SUM(samples) AS mem_avg, MAX(mem_max) AS mem_max,
+                       MIN(cpu_min) AS cpu_min, SUM(cpu_avg * samples) / SUM(samples) AS cpu_avg, MAX(cpu_max) AS cpu_max
+                FROM (SELECT bucketStart AS t, samples, mem_min, mem_avg, mem_max, cpu_min, cpu_avg, cpu_max
+                      FROM {rollup_table}
+                      WHERE chassisIp = :ip AND bucketStart >= :start AND bucketStart < :rolled_until AND bucketStart <= :end
+                      UNION ALL
+                      SELECT sampledAt, 1, mem_utilization, mem_utilization, mem_utilization,
+                             cpu_utilization, cpu_utilization, cpu_utilization
+                      FROM chassis_utilization_details
+                      WHERE chassisIp = :ip AND sampledAt >= :raw_from AND sampledAt <= :end)
+                GROUP BY (t - :start) / :bucket
+                ORDER BY t;"""
+    posts = cur.execute(query, {"ip": ip, "start": start, "end": end, "bucket": bucket,
+                                "rolled_until": rolled_until, "raw_from": raw_from}).fetchall()
+    cur.close()
+    return resolution, posts
+
+def get_port_stats_from_db(ip, start, end, card=None, port=None):
+    """Port counter samples and rates of a chassis between the start and end epochs, optionally of one card or port"""
+    conditions, params = ["chassisIp = ?", "ts >= ?", "ts <= ?"], [ip, start, end]
+    if card is not None:
+        conditions.append("cardNumber = ?")
+        params.append(card)
+    if port is not None:
+        conditions.append("portNumber = ?")
+        params.append(port)
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    posts = cur.execute(f"""SELECT * FROM chassis_port_stats WHERE {' AND '.join(conditions)}
+                            ORDER BY cardNumber, portNumber, ts""", params).fetchall()
+    cur.close()
+    return posts
+
+def _port_filters(speed=None, phy_mode=None, link_state=None):
+    """Conditions on the columns of idx_port_free matching free ports, speed also accepted as e.g. '100G'"""
+    if speed is not None and re.fullmatch(r"\d+[Gg]", speed):
+        speed = str(int(speed[:-1]) * 1000)
+    conditions, params = ["owner = 'Free'"], []
+    for column, value in (("speed", speed), ("phyMode", phy_mode), ("linkState", link_state)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    return " AND ".join(conditions), params
+
+
+def find_free_port_sets(count, speed=None, phy_mode=None, link_state=None, options=5):
+    """Sets of count free ports matching the filters, best locality first: ports of a single
+    card (tightest fit first), then of a single chassis (fewest cards first), and when no chassis
+    has enough, one set spread over the chassis with the most free ports"""
+    where, params = _port_filters(speed, phy_mode, link_state)
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    free_by_card = {}
+    for chassis_ip, card_number, free in cur.execute(
+            f"SELECT chassisIp, cardNumber, COUNT(*) FROM chassis_port_details WHERE {where} GROUP BY chassisIp, cardNumber",
+            params):
+        free_by_card.setdefault(chassis_ip, []).append((free, card_number))
+
+    # Sets as lists of (chassisIp, cardNumber, ports taken from the card)
+    card_sets = sorted((free - count, chassis_ip, card_number)
+                       for chassis_ip, cards in free_by_card.items() for free, card_number in cards if free >= count)
+    sets = [("card", [(chassis_ip, card_number, count)]) for _, chassis_ip, card_number in card_sets[:options]]
+
+    def fill(cards, needed):
+        """Take ports from the cards with the most free ports first"""
+        taken = []
+        for chassis_ip, card_number, free in cards:
+            if needed <= 0:
+                break
+            taken.append((chassis_ip, card_number, min(free, needed)))
+            needed -= free
+        return taken if needed <= 0 else None
+
+    if len(sets) < options:
+        chassis_sets = []
+        for chassis_ip, cards in free_by_card.items():
+            total = sum(free for free, _ in cards)
+            if total >= count and max(free for free, _ in cards) < count:
+                taken = fill([(chassis_ip, card_number, free) for free, card_number in sorted(cards, reverse=True)], count)
+                chassis_sets.append((len(taken), total - count, chassis_ip, taken))
+        sets += [("chassis", taken) for *_, taken in sorted(chassis_sets)[:options - len(sets)]]
+
+    if not sets:
+        cards = sorted(((chassis_ip, card_number, free) for chassis_ip, cards in free_by_card.items()
+                        for free, card_number in cards),
+                       key=lambda card: (-sum(free for free, _ in free_by_card[card[0]]), card[0], -card[2]))
+        taken = fill(cards, count)
+        if taken:
+            sets.append(("fleet", taken))
+
+    port_sets = []
+    for locality, taken in sets:
+        ports = []
+        for chassis_ip, card_number, needed in taken:
+            ports += [{"chassisIp": chassis_ip, "cardNumber": card_number, "portNumber": port_number}
+                      for port_number, in cur.execute(
+                          f"""SELECT portNumber FROM chassis_port_details WHERE {where} AND chassisIp = ? AND cardNumber = ?
+                              ORDER BY portNumber LIMIT ?""", params + [chassis_ip, card_number, needed])]
+        port_sets.append({"locality": locality,
+                          "chassisCount": len({chassis_ip for chassis_ip, _, _ in taken}),
+                          "cardCount": len(taken),
+                          "ports": ports})
+    cur.close()
+    return port_sets
+
+
+def _refresh_ports_owner(cur, ports):
+    """Refresh the fleet summary and search documents of ports whose owner was just changed"""
+    _refresh_fleet_summary(cur, "chassis_port_details", {port["chassisIp"] for port in ports})
+    _refresh_search_index(cur, "chassis_port_details",
+                          [(port["chassisIp"], str(port["cardNumber"]), str(port["portNumber"])) for port in ports])
+
+def claim_free_ports_in_database(ports, owners):
+    """Record the owner of ports (owners maps chassisIp to owner) until the next poll of their chassis, all
+    of them only if all are still free. The check and the claim are one transaction, so concurrent
+    reservations, from any thread or process, never get the same port. Returns whether the ports were claimed"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    # Clearing rowHash makes the next poll rewrite the owner reported by the chassis
+    for port in ports:
+        cur.execute("""UPDATE chassis_port_details SET owner = ?, rowHash = NULL
+                       WHERE chassisIp = ? AND cardNumber = ? AND portNumber = ? AND owner = 'Free'""",
+                    (owners[port["chassisIp"]], port["chassisIp"], port["cardNumber"], port["portNumber"]))
+        if cur.rowcount != 1:
+            cur.close()
+            conn.rollback()
+            return False
+    _refresh_ports_owner(cur, ports)
+    cur.close()
+    conn.commit()
+    return True
+
+def release_claimed_ports_in_database(ports, owners):
+    """Mark ports claimed by claim_free_ports_in_database free again, unless a poll changed their owner since"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.executemany("""UPDATE chassis_port_details SET owner = 'Free', rowHash = NULL
+                       WHERE chassisIp = ? AND cardNumber = ? AND portNumber = ? AND owner = ?""",
+                    [(port["chassisIp"], port["cardNumber"], port["portNumber"], owners[port["chassisIp"]]) for port in ports])
+    _refresh_ports_owner(cur, ports)
+    cur.close()
+    conn.commit()
+
+def write_polling_intervals_into_database(chassis, cards, ports, sensors, licensing, perf, data_purge, portstats=None):
     """Write the polling intervals for different data categories"""
     conn = _get_db_connection()
     cur = conn.cursor()
     
     cur.execute("DELETE from poll_setting")
-    cur.execute(f"""INSERT INTO poll_setting (chassis, cards, ports, sensors, perf, licensing, data_purge) VALUES 
-                ({int(chassis)},{int(cards)},{int(ports)},{int(sensors)},{int(perf)},{int(licensing)}, {int(data_purge)})""")
+    cur.execute("""INSERT INTO poll_setting (chassis, cards, ports, sensors, perf, licensing, data_purge, portstats) VALUES 
+                (?, ?, ?, ?, ?, ?, ?, ?)""", (int(chassis), int(cards), int(ports), int(sensors), int(perf), int(licensing), int(data_purge),
+                                              int(portstats) if portstats else None))
     cur.close()
     conn.commit()
-    conn.close()
     
 def read_poll_setting_from_database():
     """Read the polling intervals for different data categories"""
-    conn = _get_db_connection()
+    conn = _get_db_connection(read_only=True)
     cur = conn.cursor()
     query = "SELECT * FROM poll_setting;"
     posts = cur.execute(query).fetchone()
     cur.close()
-    conn.close()
     if posts:
         return posts
 
-def delte_half_data_from_performace_metric_table():
-    """This funtion will delete half the records from performace metrics data"""
+def rollup_utilization(now=None):
+    """Downsample performance metrics into 5 minute and hourly min/avg/max rollups"""
+    now = int(now if now is not None else datetime.now(timezone.utc).timestamp())
     conn = _get_db_connection()
     cur = conn.cursor()
-    
-    query = """DELETE FROM chassis_utilization_details 
-                WHERE rowid IN 
-                (SELECT rowid FROM chassis_utilization_details  ORDER BY lastUpdatedAt_UTC DESC
-                LIMIT (SELECT COUNT(*)/2 FROM chassis_utilization_details));"""
-    cur.execute(query)
+
+    # Only complete buckets are rolled up, the latest rolled up one is recomputed in case
+    # it was rolled up before all of its samples arrived
+    since = cur.execute("SELECT MAX(bucketStart) FROM chassis_utilization_5min").fetchone()[0] or 0
+    cur.execute(db_queries.rollup_usage_metrics_5min_sql, {"since": since, "until": now - now % 300})
+    since = cur.execute("SELECT MAX(bucketStart) FROM chassis_utilization_hourly").fetchone()[0] or 0
+    cur.execute(db_queries.rollup_usage_metrics_hourly_sql, {"since": since, "until": now - now % 3600})
+    conn.commit()
+    cur.close()
+
+def prune_port_stats(now=None):
+    """Drop the port counter samples of every chassis older than PORT_STATS_RETENTION_HOURS,
+    also of chassis that are not polled anymore"""
+    now = int(now if now is not None else time.time())
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM chassis_port_stats WHERE ts < ?", (now - PORT_STATS_RETENTION_HOURS * 3600,))
+    DB_ROWS_WRITTEN.inc(max(cur.rowcount, 0), table="chassis_port_stats", operation="delete")
+    conn.commit()
+    cur.close()
+
+def rollup_and_prune_utilization(now=None):
+    """Roll up performance metrics, then drop every tier older than its retention window"""
+    now = int(now if now is not None else datetime.now(timezone.utc).timestamp())
+    rollup_utilization(now)
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM chassis_utilization_details WHERE sampledAt < ?", (now - RAW_RETENTION_DAYS * 86400,))
+    cur.execute("DELETE FROM chassis_utilization_5min WHERE bucketStart < ?", (now - FIVE_MIN_RETENTION_DAYS * 86400,))
+    cur.execute("DELETE FROM chassis_utilization_hourly WHERE bucketStart < ?", (now - HOURLY_RETENTION_DAYS * 86400,))
     conn.commit()
     cur.close()
-    conn.close()
+
+CHASSIS_FACTS_COLUMNS = ("ip", "serialNumber", "ixosVersion", "os", "chassisType", "hostId", "expiresAt")
+
+
+def read_chassis_facts_from_database(ip):
+    """Read the cached static facts of a chassis, None if there are none"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    row = cur.execute(f"SELECT {', '.join(CHASSIS_FACTS_COLUMNS)} FROM chassis_facts WHERE ip = ?", (ip,)).fetchone()
+    cur.close()
+    return dict(row) if row else None
+
+def write_chassis_facts_to_database(facts):
+    """Insert or replace the cached static facts of a chassis"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"INSERT OR REPLACE INTO chassis_facts ({', '.join(CHASSIS_FACTS_COLUMNS)}) VALUES ({', '.join('?' * len(CHASSIS_FACTS_COLUMNS))})",
+                [facts.get(column) for column in CHASSIS_FACTS_COLUMNS])
+    cur.close()
+    conn.commit()
+
+def delete_chassis_facts_from_database(ip):
+    """Delete the cached static facts of a chassis"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM chassis_facts WHERE ip = ?", (ip,))
+    cur.close()
+    conn.commit()
+
+JOB_COLUMNS = ("id", "kind", "status", "submittedAt", "startedAt", "finishedAt", "result", "error")
+
+
+def write_job_to_database(job):
+    """Insert or update the state of a background job, fields outside JOB_COLUMNS are kept as JSON details"""
+    details = {key: value for key, value in job.items() if key not in JOB_COLUMNS}
+    values = [job.get(column) for column in JOB_COLUMNS]
+    values[JOB_COLUMNS.index("result")] = json.dumps(job.get("result"))
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute(f"""INSERT INTO background_jobs ({", ".join(JOB_COLUMNS)}, details) VALUES ({", ".join("?" * (len(JOB_COLUMNS) + 1))})
+                    ON CONFLICT(id) DO UPDATE SET status = excluded.status, startedAt = excluded.startedAt,
+                    finishedAt = excluded.finishedAt, result = excluded.result, error = excluded.error""",
+                values + [json.dumps(details)])
+    cur.close()
+    conn.commit()
+
+def read_job_from_database(job_id):
+    """Read the state of a background job, None if there is no such job"""
+    conn = _get_db_connection(read_only=True)
+    cur = conn.cursor()
+    row = cur.execute(f"SELECT {', '.join(JOB_COLUMNS)}, details FROM background_jobs WHERE id = ?", (job_id,)).fetchone()
+    cur.close()
+    if row is None:
+        return None
+    job = json.loads(row["details"] or "{}")
+    job.update({column: row[column] for column in JOB_COLUMNS})
+    job["result"] = json.loads(row["result"]) if row["result"] else None
+    return job
+
+def delete_finished_jobs_from_database(finished_before):
+    """Forget background jobs that finished before the finished_before epoch"""
+    conn = _get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM background_jobs WHERE finishedAt < ?", (finished_before,))
+    cur.close()
+    conn.commit()
 
 def is_input_in_correct_format(ip_pw_list):
     for line in ip_pw_list.split("\n"):
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def metrics_dir(tmp_path, monkeypatch):
+    """Metrics snapshots of the test, never the ones of a running app"""
+    import metrics
+    monkeypatch.setenv("IIE_METRICS_DIR", str(tmp_path / "metrics"))
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path / "metrics"))
+    return tmp_path / "metrics"
+
+
+@pytest.fixture
+def inventory_db(tmp_path, monkeypatch):
+    """Empty inventory.db in a temporary working directory"""
+    monkeypatch.chdir(tmp_path)
+    import sqlite3_utilities
+    # Connections are cached per thread, forget the ones of the previous test's database
+    sqlite3_utilities._connections.pid = None
+    import init_db
+    init_db.create_data_tables()
+    return tmp_path
+
+
+@pytest.fixture
+def client(inventory_db):
+    """Flask test client of myapp on the inventory_db database"""
+    import myapp
+    return myapp.app.test_client()
+
+
+def card_records(ip, cards=2):
+    """Polled chassis_card_details records of a chassis"""
+    return [[{"chassisIp": ip, "chassisType": "Ixia XGS2", "cardNumber": card_number,
+              "serialNumber": f"{ip}-{card_number}", "cardType": "NOVUS100GE8Q28", "cardState": "UP",
+              "numberOfPorts": 2, "lastUpdatedAt_UTC": "NA"} for card_number in range(1, cards + 1)]]
+
+
+def port_records(ip, cards=2, ports_per_card=2, owners=None):
+    """Polled chassis_port_details records of a chassis, owners maps (cardNumber, portNumber) of owned ports to their owner"""
+    owners = owners or {}
+    return [[{"chassisIp": ip, "typeOfChassis": "Ixia XGS2", "cardNumber": card_number, "portNumber": port_number,
+              "linkState": "UP", "phyMode": "FIBER", "transceiverModel": "QSFP28-100G-SR4", "transceiverManufacturer": "Keysight",
+              "owner": owners.get((card_number, port_number), "Free"), "speed": "100000", "type": "NOVUS100GE8Q28",
+              "totalPorts": cards * ports_per_card, "ownedPorts": 0, "freePorts": cards * ports_per_card,
+              "transmitState": "IDLE", "lastUpdatedAt_UTC": "NA"}
+             for card_number in range(1, cards + 1) for port_number in range(1, ports_per_card + 1)]]
+
+
+def port_stats_records(ip, ts, frames=0, cards=1, ports_per_card=1):
+    """Polled chassis_port_stats records of a chassis, every counter of every port at frames (bytes at 64 per frame)"""
+    return [[{"chassisIp": ip, "ts": ts, "cardNumber": card_number, "portNumber": port_number,
+              "txFrames": frames, "rxFrames": frames, "txBytes": frames * 64, "rxBytes": frames * 64, "fcsErrors": 0}
+             for card_number in range(1, cards + 1) for port_number in range(1, ports_per_card + 1)]]
+
+
+def summary_record(ip, status="UP"):
+    """Polled chassis_summary_details record of a chassis"""
+    return {"chassisIp": ip, "chassisSerial#": "SN1", "controllerSerial#": "CTL1", "chassisType": "Ixia XGS2",
+            "physicalCards#": "2", "chassisStatus": status, "lastUpdatedAt_UTC": "NA", "mem_bytes": "1 GB",
+            "mem_bytes_total": "2 GB", "cpu_pert_usage": 5, "os": "Linux", "IxOS": "9.30", "IxNetwork Protocols": "9.30",
+            "IxOS REST": "1.6"}
+
+
+@pytest.fixture
+def unreachable_chassis(monkeypatch):
+    """Chassis whose REST calls fail with a connection error, with a fresh circuit breaker opening on the first failure"""
+    import requests
+    import data_poller
+    from chassis_health import ChassisHealth
+
+    def refuse(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("Connection refused")
+
+    monkeypatch.setattr(data_poller, "chassis_health", ChassisHealth(failure_threshold=1, base_backoff=60))
+    monkeypatch.setattr(data_poller, "get_cached_session", refuse)
+    return {"ip": "10.0.0.9", "username": "admin", "password": "admin"}
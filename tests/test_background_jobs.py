@@ -0,0 +1,96 @@
+import threading
+
+
+def _wait_for(queue, job_id, timeout=5):
+    """Job state once it is DONE or FAILED"""
+    import time
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.status_of(job_id)
+        if job["status"] in ("DONE", "FAILED"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_jobs_coalesce_on_their_keys(inventory_db):
+    from background_jobs import JobQueue
+    queue = JobQueue(workers=2)
+    release = threading.Event()
+
+    fleet = queue.submit(("poll", "cards", None), "poll", release.wait, 5)
+    assert queue.submit(("poll", "cards", None), "poll", release.wait, 5)["id"] == fleet["id"]
+    # A single chassis refresh coalesces with the running fleet refresh of its category
+    single = queue.submit(("poll", "cards", "10.0.0.1"), "poll", release.wait, 5, coalesce_with=[("poll", "cards", None)])
+    assert single["id"] == fleet["id"] and single["coalesced"]
+    other = queue.submit(("poll", "ports", None), "poll", release.wait, 5)
+    assert other["id"] != fleet["id"] and "coalesced" not in other
+
+    release.set()
+    assert _wait_for(queue, fleet["id"])["status"] == "DONE"
+    _wait_for(queue, other["id"])
+    # Finished jobs are not coalesced with anymore
+    assert queue.submit(("poll", "cards", None), "poll", release.wait, 5)["id"] != fleet["id"]
+    queue.executor.shutdown()
+
+
+def test_job_state_survives_a_restart(inventory_db):
+    import sqlite3
+    import init_db
+    from background_jobs import JobQueue
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    done = queue.submit("done", "collectlogs", lambda: {"resultUrl": "https://10.0.0.1/logs.zip"}, ip="10.0.0.1")
+    _wait_for(queue, done["id"])
+    started = threading.Event()
+
+    def collect_logs():
+        started.set()
+        release.wait(5)
+
+    running = queue.submit("running", "collectlogs", collect_logs)
+    assert started.wait(5)
+
+    # A new web process only has the database
+    conn = sqlite3.connect("inventory.db")
+    init_db.fail_interrupted_jobs(conn)
+    conn.close()
+    restarted = JobQueue(workers=1)
+    job = restarted.status_of(done["id"])
+    assert (job["status"], job["result"], job["ip"]) == ("DONE", {"resultUrl": "https://10.0.0.1/logs.zip"}, "10.0.0.1")
+    job = restarted.status_of(running["id"])
+    assert (job["status"], job["error"]) == ("FAILED", "Interrupted by a restart")
+    assert job["finishedAt"] is not None
+    assert restarted.status_of("unknown") is None
+
+    release.set()
+    queue.executor.shutdown()
+    restarted.executor.shutdown()
+
+
+def test_log_collection_without_async_operation_fails_the_job(client, monkeypatch):
+    import requests
+    import myapp
+    from background_jobs import JobQueue
+    from sqlite3_utilities import write_username_password_to_database
+    write_username_password_to_database("ADD,10.0.0.1,admin,admin")
+
+    class Session(object):
+        def collect_chassis_logs(self):
+            response = requests.Response()
+            response.status_code = 200
+            response.data = {"message": "collectlogs is not supported"}
+            return response
+
+    monkeypatch.setattr(myapp, "operation_queue", JobQueue(workers=1))
+    monkeypatch.setattr(myapp, "get_cached_session", lambda ip, username, password: Session())
+
+    job = client.post("/getLogs", json={"ip": "10.0.0.1"}).get_json()
+    _wait_for(myapp.operation_queue, job["id"])
+    response = client.get(job["statusUrl"])
+    assert response.status_code == 200
+    job = response.get_json()
+    assert job["status"] == "FAILED"
+    assert job["error"] == "Log collection did not start on 10.0.0.1: 200 {'message': 'collectlogs is not supported'}"
+    assert job["result"] is None
+    myapp.operation_queue.executor.shutdown()
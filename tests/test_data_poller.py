@@ -0,0 +1,97 @@
+from conftest import card_records, port_stats_records, summary_record
+
+
+def _status_of(ip):
+    from sqlite3_utilities import read_data_from_database
+    return {row["ip"]: row["status_status"] for row in read_data_from_database("chassis_summary_details")}[ip]
+
+
+def test_never_reachable_chassis_keeps_its_placeholder(inventory_db, unreachable_chassis):
+    from data_poller import poll_single_chassis
+
+    poll_single_chassis("chassis", unreachable_chassis)
+    assert _status_of(unreachable_chassis["ip"]) == "Not Reachable"
+    # Circuit is open now, the poll is skipped
+    poll_single_chassis("chassis", unreachable_chassis)
+    assert _status_of(unreachable_chassis["ip"]) == "Not Reachable"
+
+
+def test_chassis_that_went_down_is_stale_on_every_page(inventory_db, unreachable_chassis):
+    import data_poller
+    from sqlite3_utilities import write_data_to_database
+    ip = unreachable_chassis["ip"]
+    write_data_to_database("chassis_summary_details", [summary_record(ip)], {}, chassis_ip=ip)
+    write_data_to_database("chassis_card_details", card_records(ip), {}, chassis_ip=ip)
+
+    # Also right after a restart, the circuit breaker of unreachable_chassis never saw the chassis
+    data_poller.poll_single_chassis("cards", unreachable_chassis)
+
+    assert _status_of(ip) == "STALE"
+    import myapp
+    rows = myapp.app.test_client().get("/tableData/cardDetails").get_json()["data"]
+    assert len(rows) == 2 and all(row["stale"] for row in rows)
+
+
+
+def test_failed_poll_of_a_healthy_chassis_keeps_its_rows(inventory_db, monkeypatch):
+    import data_poller
+    from sqlite3_utilities import write_data_to_database, read_data_from_database
+    ip = "10.0.0.12"
+    write_data_to_database("chassis_summary_details", [summary_record(ip)], {}, chassis_ip=ip)
+    write_data_to_database("chassis_card_details", card_records(ip), {}, chassis_ip=ip)
+
+    def server_error(*args, **kwargs):
+        raise ValueError("Unexpected answer")
+
+    monkeypatch.setattr(data_poller, "get_cached_session", server_error)
+    data_poller.poll_single_chassis("cards", {"ip": ip, "username": "admin", "password": "admin"})
+
+    cards = read_data_from_database("chassis_card_details")
+    assert sorted(row["cardNumber"] for row in cards) == [1, 2]
+    assert _status_of(ip) == "STALE"
+    # Not a connectivity problem, the circuit breaker is left alone
+    assert _poll_results("cards", ip) == {"error": 1}
+    assert data_poller.chassis_health.should_poll(ip)
+
+def _poll_results(category, ip):
+    from metrics import POLL_CHASSIS_RESULTS
+    return {key[2]: value for key, value in POLL_CHASSIS_RESULTS.snapshot()["samples"]
+            if key[:2] == [category, ip]}
+
+
+def test_failed_polls_are_counted_unreachable(inventory_db, unreachable_chassis):
+    import data_poller
+    from sqlite3_utilities import write_data_to_database
+    never_answered = dict(unreachable_chassis, ip="10.0.0.10")
+    went_down = dict(unreachable_chassis, ip="10.0.0.11")
+    write_data_to_database("chassis_card_details", card_records(went_down["ip"]), {}, chassis_ip=went_down["ip"])
+
+    # One poll gets the NA placeholder, the other keeps the last known data
+    data_poller.poll_single_chassis("cards", never_answered)
+    data_poller.poll_single_chassis("cards", went_down)
+    # Circuit is open now
+    data_poller.poll_single_chassis("cards", never_answered)
+
+    assert _poll_results("cards", never_answered["ip"]) == {"unreachable": 2}
+    assert _poll_results("cards", went_down["ip"]) == {"unreachable": 1}
+
+
+def test_data_purge_expires_port_stats_of_every_chassis(inventory_db):
+    import time
+    from data_poller import apply_metric_retention
+    import sqlite3_utilities
+    from sqlite3_utilities import write_data_to_database, read_columns_from_database, PORT_STATS_RETENTION_HOURS
+
+    now = int(time.time())
+    expired = now - PORT_STATS_RETENTION_HOURS * 3600 - 60
+    # Both chassis were polled before the cutoff, 10.0.0.1 stopped answering since then
+    conn = sqlite3_utilities._get_db_connection()
+    conn.executemany("INSERT INTO chassis_port_stats (chassisIp, ts, cardNumber, portNumber) VALUES (?, ?, 1, 1)",
+                     [("10.0.0.1", expired), ("10.0.0.2", expired)])
+    conn.commit()
+    write_data_to_database("chassis_port_stats", port_stats_records("10.0.0.2", now))
+
+    apply_metric_retention()
+
+    rows = read_columns_from_database("chassis_port_stats", ["chassisIp", "ts"])
+    assert rows == [("10.0.0.2", now)]
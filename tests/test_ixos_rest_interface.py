@@ -0,0 +1,19 @@
+def test_grown_pool_closes_the_replaced_adapter(monkeypatch):
+    from RestApi import IxOSRestInterface
+    from RestApi.IxOSRestInterface import get_http_session, close_http_sessions
+    monkeypatch.setattr(IxOSRestInterface, "_http_sessions", {})
+
+    http_session = get_http_session("10.0.0.1", pool_size=2)
+    adapter = http_session.adapters["https://"]
+    adapter.poolmanager.connection_from_url("https://10.0.0.1")
+    assert len(adapter.poolmanager.pools) == 1
+
+    assert get_http_session("10.0.0.1", pool_size=4) is http_session
+    assert len(adapter.poolmanager.pools) == 0
+    assert http_session.adapters["https://"] is not adapter
+    assert http_session.adapters["https://"]._pool_maxsize == 4
+    # A smaller pool size keeps the current pool
+    grown = http_session.adapters["https://"]
+    get_http_session("10.0.0.1", pool_size=2)
+    assert http_session.adapters["https://"] is grown
+    close_http_sessions()
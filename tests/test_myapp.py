@@ -0,0 +1,97 @@
+import pytest
+
+from conftest import port_records
+
+
+def _write_ports(ip, owners=None, cards=2, ports_per_card=2):
+    from sqlite3_utilities import write_data_to_database
+    write_data_to_database("chassis_port_details", port_records(ip, cards, ports_per_card, owners), {}, chassis_ip=ip)
+
+
+def _search(client, **args):
+    response = client.get("/search", query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_search_matches_every_term(client):
+    _write_ports("10.0.0.1", {(1, 2): "alice"})
+    _write_ports("10.0.0.2", {(2, 1): "alice"})
+
+    hits = _search(client, q="alice 10.0.0.1")["hits"]
+    assert [(hit["kind"], hit["label"], hit["url"]) for hit in hits] == [("port", "10.0.0.1 port 1/2", "/portDetails")]
+    assert _search(client, q="alice COPPER")["total"] == 0
+
+
+def test_search_prefix_terms(client):
+    _write_ports("10.0.0.1")
+
+    assert _search(client, q="NOVUS")["total"] == 0
+    assert _search(client, q="NOVUS*")["total"] == 4
+    assert _search(client, q="QSFP28-100G*")["total"] == 4
+
+
+def test_search_kind_filter(client):
+    from sqlite3_utilities import write_data_to_database
+    from conftest import card_records
+    write_data_to_database("chassis_card_details", card_records("10.0.0.1"), {}, chassis_ip="10.0.0.1")
+    _write_ports("10.0.0.1")
+
+    assert _search(client, q="NOVUS*")["total"] == 6
+    result = _search(client, q="NOVUS*", kind="card")
+    assert result["total"] == 2
+    assert {hit["kind"] for hit in result["hits"]} == {"card"}
+    assert client.get("/search", query_string={"q": "NOVUS*", "kind": "serial"}).status_code == 400
+
+
+def test_search_paging(client):
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        _write_ports(ip)
+
+    pages = [_search(client, q="FIBER", start=start, length=3) for start in (0, 3, 6)]
+    assert [page["total"] for page in pages] == [8, 8, 8]
+    assert [len(page["hits"]) for page in pages] == [3, 3, 2]
+    labels = [hit["label"] for page in pages for hit in page["hits"]]
+    assert len(set(labels)) == 8
+    assert client.get("/search", query_string={"q": "FIBER", "start": "x"}).status_code == 400
+
+
+def test_search_forgets_deleted_rows(client):
+    _write_ports("10.0.0.1", {(1, 2): "alice", (2, 1): "bob"})
+    assert _search(client, q="alice")["total"] == 1
+
+    # Port 2 of every card is gone, alice's port with it
+    _write_ports("10.0.0.1", {(2, 1): "bob"}, ports_per_card=1)
+
+    assert _search(client, q="alice")["total"] == 0
+    assert [hit["label"] for hit in _search(client, q="bob")["hits"]] == ["10.0.0.1 port 2/1"]
+    assert _search(client, q="FIBER")["total"] == 2
+
+
+def test_reservation_is_released_when_a_take_fails(client, monkeypatch):
+    import myapp
+    from sqlite3_utilities import read_data_from_database
+    # No chassis has 4 free ports, the set is spread over both
+    _write_ports("10.0.0.1", cards=1)
+    _write_ports("10.0.0.2", cards=1)
+    released = []
+
+    def take_ports_ownership(session, chassis_ip, ports):
+        if chassis_ip == "10.0.0.2":
+            raise Exception(f"Port 1/1 of {chassis_ip} is owned by bob")
+        return [dict(port, id=port["portNumber"]) for port in ports]
+
+    monkeypatch.setattr(myapp, "get_cached_session", lambda ip, username, password: ip)
+    monkeypatch.setattr(myapp, "take_ports_ownership", take_ports_ownership)
+    monkeypatch.setattr(myapp, "release_ports_ownership", lambda session, ports: released.append((session, ports)))
+    chassis_list = [{"ip": ip, "username": "alice", "password": "secret"} for ip in ("10.0.0.1", "10.0.0.2")]
+
+    with pytest.raises(Exception, match="owned by bob"):
+        myapp._reserve_ports(4, None, None, None, chassis_list)
+
+    assert [(session, [port["portNumber"] for port in ports]) for session, ports in released] == [("10.0.0.1", [1, 2])]
+    assert {row["owner"] for row in read_data_from_database("chassis_port_details")} == {"Free"}
+    # Nothing failing, every port of the set is reserved
+    monkeypatch.setattr(myapp, "take_ports_ownership", lambda session, chassis_ip, ports: ports)
+    assert len(myapp._reserve_ports(4, None, None, None, chassis_list)["ports"]) == 4
+    assert {row["owner"] for row in read_data_from_database("chassis_port_details")} == {"alice"}
@@ -0,0 +1,100 @@
+from conftest import card_records, port_records, port_stats_records
+
+
+def test_removed_chassis_data_is_deleted(inventory_db):
+    from sqlite3_utilities import write_username_password_to_database, write_data_to_database, \
+        read_data_from_database, read_fleet_summary_from_database
+    from poll_scheduler import PollScheduler
+
+    write_username_password_to_database("ADD,10.0.0.1,admin,admin\nADD,10.0.0.2,admin,admin")
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        write_data_to_database("chassis_card_details", card_records(ip), {}, chassis_ip=ip)
+        write_data_to_database("chassis_port_details", port_records(ip), {}, chassis_ip=ip)
+    scheduler = PollScheduler(workers=1)
+    scheduler.refresh_configuration()
+    scheduler._last_run[("cards", "10.0.0.2")] = 0
+    assert read_fleet_summary_from_database()["cards"] == 4
+
+    write_username_password_to_database("DELETE,10.0.0.2,admin,admin")
+    scheduler.refresh_configuration()
+
+    for table_name in ("chassis_card_details", "chassis_port_details"):
+        assert {row["chassisIp"] for row in read_data_from_database(table_name)} == {"10.0.0.1"}
+    summary = read_fleet_summary_from_database()
+    assert summary["cards"] == 2
+    assert summary["ports"] == 4
+    assert ("cards", "10.0.0.2") not in scheduler._last_run
+    scheduler.executor.shutdown()
+
+
+def test_chassis_removed_while_stopped_is_deleted_on_start(inventory_db):
+    from sqlite3_utilities import write_username_password_to_database, write_data_to_database, read_data_from_database
+    from poll_scheduler import PollScheduler
+
+    write_username_password_to_database("ADD,10.0.0.1,admin,admin")
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        write_data_to_database("chassis_card_details", card_records(ip), {}, chassis_ip=ip)
+    scheduler = PollScheduler(workers=1)
+    scheduler.refresh_configuration()
+
+    assert {row["chassisIp"] for row in read_data_from_database("chassis_card_details")} == {"10.0.0.1"}
+    scheduler.executor.shutdown()
+
+
+def test_rollup_runs_between_data_purges(inventory_db):
+    import time
+    import sqlite3_utilities
+    from poll_scheduler import PollScheduler, ROLLUP_INTERVAL
+
+    hour_ago = int(time.time()) - 3600
+    conn = sqlite3_utilities._get_db_connection()
+    conn.executemany("INSERT INTO chassis_utilization_details (chassisIp, mem_utilization, cpu_utilization, sampledAt) VALUES (?, ?, ?, ?)",
+                     [("10.0.0.1", 50, cpu, hour_ago - hour_ago % 3600 + 60 * minute) for minute, cpu in enumerate((10, 30))])
+    conn.commit()
+    scheduler = PollScheduler(workers=1)
+    scheduler.refresh_configuration()
+    assert ("rollup", None) in scheduler._scheduled
+    assert scheduler.interval_of("rollup") == ROLLUP_INTERVAL < scheduler.interval_of("data_purge")
+
+    scheduler._run_task(("rollup", None), None)
+
+    rollups = conn.execute("SELECT chassisIp, samples, cpu_avg, cpu_max FROM chassis_utilization_hourly").fetchall()
+    assert [tuple(row) for row in rollups] == [("10.0.0.1", 2, 20, 30)]
+    scheduler.executor.shutdown()
+
+
+def test_port_stats_of_removed_chassis_are_deleted(inventory_db):
+    import time
+    from sqlite3_utilities import write_username_password_to_database, write_data_to_database, read_columns_from_database
+    from poll_scheduler import PollScheduler
+
+    write_username_password_to_database("ADD,10.0.0.1,admin,admin\nADD,10.0.0.2,admin,admin")
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        write_data_to_database("chassis_port_stats", port_stats_records(ip, int(time.time())))
+    scheduler = PollScheduler(workers=1)
+    scheduler.refresh_configuration()
+
+    write_username_password_to_database("DELETE,10.0.0.2,admin,admin")
+    scheduler.refresh_configuration()
+
+    assert {row[0] for row in read_columns_from_database("chassis_port_stats", ["chassisIp"])} == {"10.0.0.1"}
+    scheduler.executor.shutdown()
+
+
+def test_snapshots_of_removed_chassis_are_forgotten(inventory_db, monkeypatch):
+    import time
+    import IxOSRestAPICaller
+    from sqlite3_utilities import write_username_password_to_database
+    from poll_scheduler import PollScheduler
+
+    snapshots = {(ip, resource): (time.time(), []) for ip in ("10.0.0.1", "10.0.0.2") for resource in ("cards", "ports")}
+    monkeypatch.setattr(IxOSRestAPICaller, "_snapshots", snapshots)
+    write_username_password_to_database("ADD,10.0.0.1,admin,admin\nADD,10.0.0.2,admin,admin")
+    scheduler = PollScheduler(workers=1)
+    scheduler.refresh_configuration()
+
+    write_username_password_to_database("DELETE,10.0.0.2,admin,admin")
+    scheduler.refresh_configuration()
+
+    assert sorted(snapshots) == [("10.0.0.1", "cards"), ("10.0.0.1", "ports")]
+    scheduler.executor.shutdown()
@@ -0,0 +1,252 @@
+import pytest
+
+from conftest import card_records, port_records, port_stats_records, summary_record
+
+
+def test_unchanged_poll_advances_poll_time_only(inventory_db):
+    import sqlite3_utilities
+    from sqlite3_utilities import read_last_poll_from_database, write_data_to_database
+    ip = "10.0.0.5"
+    write_data_to_database("chassis_card_details", card_records(ip), {}, chassis_ip=ip)
+    conn = sqlite3_utilities._get_db_connection()
+    conn.execute("UPDATE chassis_card_details SET lastUpdatedAt_UTC = '2020-01-01 00:00:00'")
+    conn.execute("UPDATE last_poll_times SET lastPolledAt = '2020-01-01 00:00:00'")
+    conn.commit()
+
+    write_data_to_database("chassis_card_details", card_records(ip), {}, chassis_ip=ip)
+
+    changed_at = {row[0] for row in conn.execute("SELECT lastUpdatedAt_UTC FROM chassis_card_details")}
+    assert changed_at == {"2020-01-01 00:00:00"}
+    assert read_last_poll_from_database("chassis_card_details") > "2020-01-01 00:00:00"
+
+    sqlite3_utilities.delete_data_of_removed_chassis("chassis_card_details", [])
+    assert read_last_poll_from_database("chassis_card_details") is None
+
+
+def test_search_documents_of_unchanged_rows_are_kept(inventory_db):
+    import sqlite3_utilities
+    from sqlite3_utilities import search_inventory, write_data_to_database
+    ip = "10.0.0.5"
+    ports = port_records(ip)
+    write_data_to_database("chassis_port_details", ports, {}, chassis_ip=ip)
+    conn = sqlite3_utilities._get_db_connection()
+    documents = dict(conn.execute("SELECT rowKey, id FROM search_documents WHERE kind = 'port'").fetchall())
+    assert len(documents) == 4
+
+    ports[0][1]["owner"] = "alice"
+    write_data_to_database("chassis_port_details", ports, {}, chassis_ip=ip)
+
+    refreshed = dict(conn.execute("SELECT rowKey, id FROM search_documents WHERE kind = 'port'").fetchall())
+    assert refreshed.keys() == documents.keys()
+    assert [key for key in documents if documents[key] != refreshed[key]] == [f"{ip}/1/2"]
+    total, hits = search_inventory("alice")
+    assert total == 1 and hits[0]["label"] == f"{ip} port 1/2"
+
+
+@pytest.mark.parametrize("previous, current, delta", [
+    (1000, 1500, 500),                        # counted up
+    (2 ** 32 - 100, 400, 500),                # 32 bit counter wrapped
+    (2 ** 64 - 100, 400, 500),                # 64 bit counter wrapped
+    (2 ** 33, 400, 400),                      # above the 32 bit range, not close to the 64 bit top: reset
+    (1000, 400, 400),                         # stats cleared, counted up from zero since
+    (None, 400, None),                        # no previous sample
+])
+def test_counter_delta(previous, current, delta):
+    from sqlite3_utilities import counter_delta
+    assert counter_delta(previous, current) == delta
+
+
+def test_port_stats_rates_since_previous_sample(inventory_db):
+    import time
+    from sqlite3_utilities import write_data_to_database, get_port_stats_from_db
+    ip = "10.0.0.5"
+    now = int(time.time())
+    # Every counter close to the top of its 32 bit range
+    near_wrap = port_stats_records(ip, now - 30, frames=2 ** 32 - 100)
+    near_wrap[0][0].update(txBytes=2 ** 32 - 6400, rxBytes=2 ** 32 - 6400)
+    write_data_to_database("chassis_port_stats", near_wrap)
+    for ts, frames in ((now - 20, 400), (now - 10, 900), (now, 100)):
+        write_data_to_database("chassis_port_stats", port_stats_records(ip, ts, frames=frames))
+
+    first, wrapped, counted_up, reset = get_port_stats_from_db(ip, now - 30, now)
+    assert first["txFrameRate"] is None and first["txBitRate"] is None
+    for sample in (wrapped, counted_up):
+        assert sample["txFrameRate"] == sample["rxFrameRate"] == 50
+        assert sample["txBitRate"] == sample["rxBitRate"] == 500 * 64 * 8 / 10
+        assert sample["fcsErrorRate"] == 0
+    # The port counted 100 frames from zero since the reset
+    assert reset["txFrameRate"] == 10
+    assert reset["txBitRate"] == 100 * 64 * 8 / 10
+
+
+def _insert_utilization(samples, ip="10.0.0.1"):
+    """Raw performance metrics samples of (sampledAt, mem, cpu)"""
+    import sqlite3_utilities
+    conn = sqlite3_utilities._get_db_connection()
+    conn.executemany("INSERT INTO chassis_utilization_details (chassisIp, mem_utilization, cpu_utilization, sampledAt) VALUES (?, ?, ?, ?)",
+                     [(ip, mem, cpu, sampled_at) for sampled_at, mem, cpu in samples])
+    conn.commit()
+    return conn
+
+
+def test_rollup_min_avg_max(inventory_db):
+    import time
+    from sqlite3_utilities import rollup_and_prune_utilization, RAW_RETENTION_DAYS
+    hour = int(time.time()) // 3600 * 3600 - 3 * 3600
+    expired = hour - (RAW_RETENTION_DAYS + 1) * 86400
+    conn = _insert_utilization([(hour, 40, 10), (hour + 60, 40, 20), (hour + 120, 40, 60),
+                                (hour + 300, 70, 90),
+                                # The 5 minute bucket and the hour are still running
+                                (hour + 3600, 100, 100),
+                                (expired, 10, 10)])
+
+    rollup_and_prune_utilization(now=hour + 3610)
+
+    columns = "bucketStart, samples, mem_min, mem_avg, mem_max, cpu_min, cpu_avg, cpu_max"
+    assert list(map(tuple, conn.execute(f"SELECT {columns} FROM chassis_utilization_5min ORDER BY bucketStart"))) == [
+        (expired - expired % 300, 1, 10, 10, 10, 10, 10, 10),
+        (hour, 3, 40, 40, 40, 10, 30, 60),
+        (hour + 300, 1, 70, 70, 70, 90, 90, 90)]
+    # Averages weighted by the samples of every 5 minute bucket
+    assert list(map(tuple, conn.execute(f"SELECT {columns} FROM chassis_utilization_hourly WHERE bucketStart = ?", (hour,)))) == [
+        (hour, 4, 40, 47.5, 70, 10, 45, 90)]
+    # Expired raw samples are dropped once rolled up
+    assert conn.execute("SELECT MIN(sampledAt) FROM chassis_utilization_details").fetchone()[0] == hour
+
+    # A sample that arrived late in the latest rolled up bucket is rolled up again
+    _insert_utilization([(hour + 310, 70, 30)])
+    rollup_and_prune_utilization(now=hour + 3610)
+    assert list(map(tuple, conn.execute(f"SELECT {columns} FROM chassis_utilization_5min WHERE bucketStart = ?", (hour + 300,)))) == [
+        (hour + 300, 2, 70, 70, 70, 30, 60, 90)]
+    assert list(map(tuple, conn.execute("SELECT samples, cpu_avg FROM chassis_utilization_hourly WHERE bucketStart = ?", (hour,)))) == [
+        (5, 42)]
+
+
+@pytest.mark.parametrize("age, span, max_points, resolution", [
+    (3600, 3600, 60, "raw"),                    # 1 minute buckets
+    (86400, 86400, 100, "5min"),                # 15 minute buckets
+    (7 * 86400, 7 * 86400, 100, "hourly"),      # 2 hour buckets
+    (10 * 86400, 3600, 60, "5min"),             # raw samples of the range are expired
+    (40 * 86400, 3600, 60, "hourly"),           # 5 minute rollups of the range are expired
+])
+def test_perf_metrics_tier_of_range(inventory_db, age, span, max_points, resolution):
+    import time
+    from sqlite3_utilities import get_perf_metrics_range_from_db
+    now = int(time.time())
+    start = now - age
+    assert get_perf_metrics_range_from_db("10.0.0.1", start, start + span, max_points)[0] == resolution
+
+
+def test_perf_metrics_rollups_filled_in_with_raw_samples(inventory_db):
+    import time
+    from sqlite3_utilities import get_perf_metrics_range_from_db
+    now = int(time.time())
+    hour = now // 3600 * 3600
+    # Every tier has its own cpu value to tell where a bucket comes from
+    conn = _insert_utilization([(now - 600 + 60 * minute, 20, 10) for minute in range(10)])
+    conn.execute("INSERT INTO chassis_utilization_5min VALUES ('10.0.0.1', ?, 5, 20, 20, 20, 55, 55, 55)", (hour - 7200,))
+    conn.execute("INSERT INTO chassis_utilization_hourly VALUES ('10.0.0.1', ?, 60, 20, 20, 20, 77, 77, 77)", (hour - 3 * 86400,))
+    conn.commit()
+
+    def cpu_of(start, max_points):
+        resolution, buckets = get_perf_metrics_range_from_db("10.0.0.1", start, now, max_points)
+        return resolution, sorted({bucket["cpu_avg"] for bucket in buckets})
+
+    assert cpu_of(now - 3600, 60) == ("raw", [10])
+    # Samples after the latest rollup come from the raw samples
+    assert cpu_of(now - 86400, 100) == ("5min", [10, 55])
+    assert cpu_of(now - 7 * 86400, 100) == ("hourly", [10, 77])
+
+
+def _locality(port_set):
+    """(locality, sorted (chassisIp, cardNumber, ports taken from the card)) of a find_free_port_sets set"""
+    cards = {}
+    for port in port_set["ports"]:
+        key = (port["chassisIp"], port["cardNumber"])
+        cards[key] = cards.get(key, 0) + 1
+    return port_set["locality"], sorted(key + (taken,) for key, taken in cards.items())
+
+
+def test_free_port_sets_best_locality_first(inventory_db):
+    from sqlite3_utilities import write_data_to_database, find_free_port_sets
+    # 10.0.0.1: cards with 4 and 2 free ports, 10.0.0.2: a card with 3, 10.0.0.3: 3 cards with 2
+    fleet = {"10.0.0.1": port_records("10.0.0.1", 2, 4, {(2, 1): "alice", (2, 2): "alice"}),
+             "10.0.0.2": port_records("10.0.0.2", 1, 4, {(1, 4): "bob"}),
+             "10.0.0.3": port_records("10.0.0.3", 3, 2)}
+    for ip, records in fleet.items():
+        write_data_to_database("chassis_port_details", records, {}, chassis_ip=ip)
+
+    # A single card, the one with the fewest spare free ports first, then a single chassis
+    assert [_locality(port_set) for port_set in find_free_port_sets(3)] == [
+        ("card", [("10.0.0.2", 1, 3)]),
+        ("card", [("10.0.0.1", 1, 3)]),
+        ("chassis", [("10.0.0.3", 2, 1), ("10.0.0.3", 3, 2)])]
+    assert [port["portNumber"] for port in find_free_port_sets(3, options=1)[0]["ports"]] == [1, 2, 3]
+    # A single chassis, the one needing the fewest cards first
+    assert [_locality(port_set) for port_set in find_free_port_sets(5)] == [
+        ("chassis", [("10.0.0.1", 1, 4), ("10.0.0.1", 2, 1)]),
+        ("chassis", [("10.0.0.3", 1, 1), ("10.0.0.3", 2, 2), ("10.0.0.3", 3, 2)])]
+    # Spread over the chassis with the most free ports
+    assert [_locality(port_set) for port_set in find_free_port_sets(8)] == [
+        ("fleet", [("10.0.0.1", 1, 4), ("10.0.0.1", 2, 2), ("10.0.0.3", 1, 2)])]
+    assert find_free_port_sets(16) == []
+
+
+def test_claim_free_ports_all_or_none(inventory_db):
+    from sqlite3_utilities import write_data_to_database, claim_free_ports_in_database, \
+        release_claimed_ports_in_database, read_data_from_database
+    write_data_to_database("chassis_port_details", port_records("10.0.0.1", 1, 2), {}, chassis_ip="10.0.0.1")
+    first, second = [{"chassisIp": "10.0.0.1", "cardNumber": 1, "portNumber": port} for port in (1, 2)]
+
+    def owners():
+        return {row["portNumber"]: row["owner"] for row in read_data_from_database("chassis_port_details")}
+
+    assert claim_free_ports_in_database([second], {"10.0.0.1": "alice"})
+    # A reservation picking the port alice was given in the meantime gets none of its ports
+    assert not claim_free_ports_in_database([first, second], {"10.0.0.1": "bob"})
+    assert owners() == {1: "Free", 2: "alice"}
+
+    release_claimed_ports_in_database([second], {"10.0.0.1": "alice"})
+    assert owners() == {1: "Free", 2: "Free"}
+
+
+def test_incremental_fleet_summary_matches_rebuild(inventory_db):
+    import sqlite3_utilities
+    from sqlite3_utilities import write_data_to_database, rebuild_fleet_summary, mark_chassis_data_stale, \
+        claim_free_ports_in_database, delete_data_of_removed_chassis, REMOVED_CHASSIS_TABLES
+    conn = sqlite3_utilities._get_db_connection()
+
+    def summary_tables():
+        return [sorted(map(tuple, conn.execute(f"SELECT * FROM {table_name}")))
+                for table_name in ("fleet_summary", "fleet_summary_by_chassis")]
+
+    def assert_matches_rebuild():
+        incremental = summary_tables()
+        rebuild_fleet_summary()
+        assert incremental == summary_tables()
+
+    def write_chassis(ip, status="UP", card_state="UP", cards=2, ports_per_card=2, owners=None):
+        write_data_to_database("chassis_summary_details", [summary_record(ip, status)], {}, chassis_ip=ip)
+        cards_records = card_records(ip, cards)
+        for card in cards_records[0]:
+            card["cardState"] = card_state
+        write_data_to_database("chassis_card_details", cards_records, {}, chassis_ip=ip)
+        write_data_to_database("chassis_port_details", port_records(ip, cards, ports_per_card, owners), {}, chassis_ip=ip)
+
+    # Inserts
+    write_chassis("10.0.0.1", owners={(1, 1): "alice"})
+    write_chassis("10.0.0.2", status="DOWN", cards=3)
+    assert_matches_rebuild()
+    # Updates
+    write_chassis("10.0.0.1", card_state="DOWN", owners={(1, 2): "bob", (2, 2): "bob"})
+    mark_chassis_data_stale("10.0.0.2")
+    claim_free_ports_in_database([{"chassisIp": "10.0.0.2", "cardNumber": 3, "portNumber": 1}], {"10.0.0.2": "alice"})
+    assert_matches_rebuild()
+    # Deletes
+    write_chassis("10.0.0.2", cards=1, ports_per_card=1)
+    assert_matches_rebuild()
+    # Chassis removal
+    for table_name in REMOVED_CHASSIS_TABLES:
+        delete_data_of_removed_chassis(table_name, ["10.0.0.2"])
+    assert_matches_rebuild()
+    assert {row[0] for row in conn.execute("SELECT chassisIp FROM fleet_summary_by_chassis")} == {"10.0.0.2"}